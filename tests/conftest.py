@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from uhashfs import uHashFS
+
+
+@pytest.fixture
+def make_fs(tmpdir):
+    '''returns a function creating a sha3_256, width 1, depth 2 root named name in tmpdir, kwargs override'''
+    def make(name='data', **kwargs):
+        settings = dict(algorithm='sha3_256', width=1, depth=2)
+        settings.update(kwargs)
+        return uHashFS(root=str(tmpdir.join(name)), **settings)
+    return make
+
+
+@pytest.fixture
+def fs(make_fs):
+    return make_fs()
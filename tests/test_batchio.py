@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+from uhashfs.batchio import ThreadPoolBackend, io_backend
+
+
+@pytest.fixture
+def fs(make_fs):
+    return make_fs(io_backend='threads', io_depth=4)
+
+
+def check_backend(backend, fs):
+    addresses = [fs.putstr('x' * i) for i in range(1, 20)]
+    paths = [address.abspath for address in addresses]
+    missing = fs.hexdigestpath('0' * fs.hexdigestlen)
+    sizes = list(backend.sizes(paths + [missing, fs.root]))
+    assert sizes == [(path, i) for i, path in enumerate(paths, 1)] + [(missing, None), (fs.root, None)]
+    assert [found for _, found in backend.exists([missing] + paths)] == [False] + [True] * len(paths)
+    hashes = list(backend.hashes(paths + [missing], fs.algorithm))
+    assert hashes == [(address.abspath, address.digest) for address in addresses] + [(missing, None)]
+
+
+def test_threads(fs):
+    backend = ThreadPoolBackend(depth=3)
+    check_backend(backend, fs)
+    backend.close()
+
+
+def test_io_uring(fs):
+    pytest.importorskip('liburing')
+    backend = io_backend('io_uring', depth=8)
+    assert backend.name == 'io_uring'
+    check_backend(backend, fs)
+    backend.close()
+
+
+def test_auto(fs):
+    assert io_backend('auto').name == 'threads'  # io_uring only when asked for
+    assert fs.batchio().name == 'threads'
+
+
+def test_existsmany(fs):
+    present = [fs.putstr(str(i)).hexdigest for i in range(10)]
+    absent = [('%x' % i) * fs.hexdigestlen for i in range(10)]
+    assert list(fs.existsmany(present + absent)) == [(h, True) for h in present] + [(h, False) for h in absent]
+
+
+def test_check_batched(fs):
+    address = fs.putstr('good')
+    bad = fs.putstr('bad')
+    os.chmod(bad.abspath, 0o644)
+    with open(bad.abspath, 'w') as fh:
+        fh.write('rotten')
+    corrupted = list(fs.check(path=fs.root, quiet=True))
+    assert [path for path, _ in corrupted] == [bad.abspath]
+    assert corrupted[0][1].digest != bad.digest
+    assert address.abspath.exists()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+from uhashfs.bloom import uHashFSBloom, bloom_size, BUILDING
+
+
+def absent(fs, count):
+    return [('%x' % i).rjust(fs.hexdigestlen, 'f') for i in range(count)]
+
+
+def test_bloom_size():
+    bits, k = bloom_size(1000000, 0.01)
+    assert 9 * 10 ** 6 < bits < 10 ** 7
+    assert k == 7
+
+
+def test_bloom(make_fs):
+    existing = make_fs()
+    before = [existing.putstr(str(i)) for i in range(50)]
+    fs = make_fs(bloom=True)  # built by a walk
+    assert fs.bloom.count() == 50
+    after = [fs.putstr('new' + str(i)) for i in range(50)]
+    for address in before + after:
+        assert fs.bloom.might_contain(address.digest)
+        assert fs.existshexdigest(address.hexdigest)
+    misses = absent(fs, 1000)
+    false_positives = sum(fs.bloom.might_contain(bytes.fromhex(hexdigest)) for hexdigest in misses)
+    assert false_positives < 50
+    assert not any(fs.existshexdigest(hexdigest) for hexdigest in misses)
+    assert list(fs.existsmany([after[0].hexdigest] + misses[:3])) == [(after[0].hexdigest, True)] + [(h, False) for h in misses[:3]]
+    with pytest.raises(FileNotFoundError):
+        fs.gethexdigest(misses[0])
+    with pytest.raises(ValueError):
+        fs.existshexdigest('z' * fs.hexdigestlen)
+    other = make_fs()  # another process, shares the file
+    assert other.bloom
+    late = fs.putstr('late')
+    assert other.bloom.might_contain(late.digest)
+
+
+def test_bloom_rebuild(make_fs):
+    fs = make_fs(bloom=True)
+    addresses = [fs.putstr(str(i)) for i in range(20)]
+    other = make_fs()
+    fs.deletehexdigest(addresses[0].hexdigest)
+    assert fs.bloom.rebuild(capacity=100) == 19
+    assert not fs.bloom.flags() & BUILDING
+    assert other.bloom.might_contain(addresses[1].digest)  # reopens the retired file
+    assert other.bloom.bits == fs.bloom.bits
+    late = other.putstr('after the rebuild')
+    assert fs.bloom.might_contain(late.digest)
+    stats = fs.bloom.stats()
+    assert stats['count'] == 20
+    assert 0 < stats['fill'] < 1
+
+
+def test_bloom_rebuild_during_put(make_fs, monkeypatch):
+    fs = make_fs(bloom=True)
+    fs.putstr('before')
+    other = make_fs()  # another process, rebuilding
+    mvtemp = fs._mvtemp
+
+    def rebuild_then_link(*args, **kwargs):  # added to the old filter, linked after the walk
+        other.bloom.rebuild(capacity=100)
+        return mvtemp(*args, **kwargs)
+    monkeypatch.setattr(fs, '_mvtemp', rebuild_then_link)
+    raced = fs.putstr('raced')
+    assert make_fs().bloom.might_contain(raced.digest)
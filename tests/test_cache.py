@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+from uhashfs import uHashFS
+
+
+@pytest.fixture
+def fs(tmpdir, make_fs):
+    return make_fs(cache_root=str(tmpdir.join('cache')), cache_bytes=25)
+
+
+def test_cache_read_through(fs):
+    address = fs.putstr('x' * 10)
+    assert not fs.cache.fs.existshexdigest(address.hexdigest)
+    with fs.openhexdigest(address.hexdigest) as fh:
+        assert fh.read() == b'x' * 10
+    assert fs.cache.fs.existshexdigest(address.hexdigest)
+    cached = fs.gethexdigest(address.hexdigest)
+    assert cached.fs is fs.cache.fs
+    assert fs.cache.bytes == 10
+
+    fs.deletehexdigest(address.hexdigest)
+    assert not fs.cache.fs.existshexdigest(address.hexdigest)
+    assert fs.cache.bytes == 0
+    with pytest.raises(FileNotFoundError):
+        fs.openhexdigest(address.hexdigest)
+
+
+def test_cache_lru_eviction_and_reload(tmpdir, fs):
+    addresses = [fs.putstr(str(i) * 10) for i in range(3)]
+    fs.openhexdigest(addresses[0].hexdigest).close()
+    fs.openhexdigest(addresses[1].hexdigest).close()
+    fs.openhexdigest(addresses[0].hexdigest).close()  # 1 is now least recently used
+    fs.openhexdigest(addresses[2].hexdigest).close()
+    assert fs.cache.bytes == 20
+    assert fs.cache.fs.existshexdigest(addresses[0].hexdigest)
+    assert not fs.cache.fs.existshexdigest(addresses[1].hexdigest)
+    assert fs.cache.fs.existshexdigest(addresses[2].hexdigest)
+    fs.cache.flush()
+
+    reopened = uHashFS(root=str(tmpdir.join('data')), cache_root=str(tmpdir.join('cache')), cache_bytes=25)
+    assert list(reopened.cache.lru) == [addresses[0].digest, addresses[2].digest]
+    assert reopened.cache.bytes == 20
+    assert os.listdir(str(tmpdir.join('cache'))).count('_lru') == 1
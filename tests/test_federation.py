@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import uhashfs.uhashfs
+from uhashfs.federation import uHashFSFederation
+
+
+@pytest.fixture
+def federation(tmpdir):
+    members = {'0': str(tmpdir.join('disk0')), '8': str(tmpdir.join('disk1'))}
+    return uHashFSFederation(root=str(tmpdir.join('federation')), members=members, algorithm='sha3_256', width=1, depth=2)
+
+
+def test_federation_unwritten_members(federation):
+    assert list(federation.files()) == []
+    assert list(federation.check()) == []
+
+
+def test_federation_routing(federation, tmpdir):
+    disk0, disk1 = federation.layout
+    addresses = [federation.putstr(str(i)) for i in range(20)]
+    for address in addresses:
+        owner = disk0 if address.hexdigest < '8' else disk1
+        assert address.fs is owner
+        assert federation.existshexdigest(address.hexdigest)
+        assert federation.gethexdigest(address.hexdigest).abspath == address.abspath
+        with federation.openhexdigest(address.hexdigest) as fh:
+            assert fh.read().decode() in [str(i) for i in range(20)]
+    assert len([path for path in disk0.files() if path.name != disk0.emptyhexdigest]) == len([a for a in addresses if a.fs is disk0])
+    infile = tmpdir.join('infile')
+    infile.write('from a file')
+    assert federation.putfile(str(infile)).fs is federation.member(federation.putstr('from a file').hexdigest)
+    assert federation.putstr('0').is_duplicate
+
+    hexdigests = sorted(address.hexdigest for address in addresses)
+    listing = list(federation.sorted_hexdigests())
+    assert listing == sorted(set(hexdigests) | {federation.putstr('from a file').hexdigest})
+    page, cursor = federation.list_hexdigests(prefix='8', limit=1000)
+    assert page == [hexdigest for hexdigest in listing if hexdigest.startswith('8')]
+    assert cursor is None
+    assert sorted(str(path) for path in federation.files()) == sorted(str(path) for fs in (disk0, disk1) for path in fs.files())
+    assert list(federation.check()) == []
+
+    missing = '0' * 64
+    assert dict(federation.existsmany(hexdigests[:5] + [missing])) == dict([(h, True) for h in hexdigests[:5]] + [(missing, False)])
+    assert federation.delete_many(hexdigests[:5] + [missing]) == hexdigests[:5]
+    assert not any(federation.existshexdigest(hexdigest) for hexdigest in hexdigests[:5])
+    with pytest.raises(FileNotFoundError):
+        federation.deletehexdigest(missing)
+    with pytest.raises(ValueError):
+        federation.member('xyz')
+
+    again = uHashFSFederation(root=str(federation.root))
+    assert (again.algorithm, again.members) == ('sha3_256', federation.members)
+
+
+def test_federation_rebalance(federation, tmpdir):
+    addresses = [federation.putstr(str(i)) for i in range(30)]
+    disk2 = str(tmpdir.join('disk2'))
+    members = dict(federation.members, c=disk2)
+    moved = federation.rebalance(members)
+    assert moved == len([address for address in addresses if address.hexdigest >= 'c'])
+    assert federation.previous is None
+    for address in addresses:
+        assert federation.member(address.hexdigest).root == federation.gethexdigest(address.hexdigest).abspath.parents[3]
+        assert (address.hexdigest >= 'c') == (federation.member(address.hexdigest).root == federation.instances[disk2].root)
+    assert uHashFSFederation(root=str(federation.root)).members == members
+
+    federation._write_descriptor({'0': members['0']}, previous=members)  # an interrupted rebalance
+    reopened = uHashFSFederation(root=str(federation.root))
+    assert all(reopened.existshexdigest(address.hexdigest) for address in addresses)  # found at their previous owner
+    assert reopened.rebalance({'0': members['0']}) == len([address for address in addresses if address.hexdigest >= '8'])
+    assert sorted(os.listdir(os.path.join(members['0'], 'sha3_256'))) == sorted({address.hexdigest[0] for address in addresses} | {reopened.layout[0].emptyhexdigest[0]})
+
+
+def test_federation_concurrent_puts(federation):
+    disk0, disk1 = federation.layout
+    data = next(str(i) for i in range(100) if disk1.putstr(str(i)).hexdigest >= '8')  # staged on disk0, owned by disk1
+    disk1.deletehexdigest(disk1.putstr(data).hexdigest)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        addresses = list(pool.map(lambda _: federation.putstr(data), range(32)))
+    assert all(address.fs is disk1 for address in addresses)
+    assert not disk0.existshexdigest(addresses[0].hexdigest)  # the staged copy is gone
+    assert federation.routing == {}
+
+
+def test_federation_putfile_once(federation, tmpdir, monkeypatch):
+    disk0, disk1 = federation.layout
+    data = next(str(i) for i in range(100) if disk1.putstr(str(i)).hexdigest >= '8')  # owned by disk1
+    disk1.deletehexdigest(disk1.putstr(data).hexdigest)
+    infile = tmpdir.join('infile')
+    infile.write(data)
+    opened = []
+    real_open = open
+    monkeypatch.setattr(uhashfs.uhashfs, 'open', lambda path, *args, **kwargs: opened.append(path) or real_open(path, *args, **kwargs), raising=False)
+    real_link = os.link
+    crossed = []
+
+    def cross_device(src, dst, *args, **kwargs):
+        if str(dst).startswith(str(disk1.root)) and not crossed:  # the staged temp file, disk1 is another filesystem
+            crossed.append(dst)
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        return real_link(src, dst, *args, **kwargs)
+    monkeypatch.setattr(os, 'link', cross_device)
+    fds = len(os.listdir('/proc/self/fd'))
+    address = federation.putfile(str(infile))
+    assert address.fs is disk1 and not address.is_duplicate
+    assert crossed and opened.count(str(infile)) == 1
+    assert not disk0.existshexdigest(address.hexdigest)
+    with federation.openhexdigest(address.hexdigest) as fh:
+        assert fh.read().decode() == data
+    assert len(os.listdir('/proc/self/fd')) == fds  # neither temp file left open
+
+    monkeypatch.setattr(federation, 'member', lambda hexdigest: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        federation.putfile(str(infile))
+    assert len(os.listdir('/proc/self/fd')) == fds
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import pytest
+from uhashfs import uHashFSMetadata
+from uhashfs.garbage import mark, sweep, is_marked
+
+
+@pytest.fixture
+def metafs(tmpdir, fs):
+    return uHashFSMetadata(root=str(tmpdir.join('meta')), uhashfs=fs, width=1, depth=2)
+
+
+def test_mark_and_sweep(fs, metafs):
+    about = fs.putstr('http://example.com')
+    body = fs.putstr('body')
+    garbage = fs.putstr('garbage')
+    metafs.putrecord(about_hash=about, to_hash=body, link_name='body', data_source_name='test', timestamp='1.0')
+    metafs.putrecord(about_hash=about, to_hash=body, link_name='body', data_source_name='test', timestamp='2.0')
+
+    marked, counts = mark(metafs, processes=1)
+    assert len(marked) == 2
+    assert sorted(counts) == [1, 2]
+    assert is_marked(marked, about.digest)
+    assert is_marked(marked, body.digest)
+    assert not is_marked(marked, garbage.digest)
+
+    assert not list(sweep(fs, marked))  # too young
+    unreferenced = list(sweep(fs, marked, min_age=-60))
+    assert [address.hexdigest for address in unreferenced] == [garbage.hexdigest]
+
+
+def test_sweep_delete(fs, metafs):
+    about = fs.putstr('http://example.com')
+    garbage = fs.putstr('garbage')
+    metafs.putrecord(about_hash=about, to_hash=about, link_name='self', data_source_name='test', timestamp='1.0')
+    marked, _ = mark(metafs)  # process pool
+    assert len(list(sweep(fs, marked, min_age=-60, delete=True))) == 1
+    assert not fs.existshexdigest(garbage.hexdigest)
+    assert fs.existshexdigest(about.hexdigest)
+
+
+def test_sweep_rechecks_records_written_since_mark(fs, metafs):
+    about = fs.putstr('http://example.com')
+    body = fs.putstr('body')
+    metafs.putrecord(about_hash=about, to_hash=about, link_name='self', data_source_name='test', timestamp='1.0')
+    started = time.time()
+    marked, _ = mark(metafs, processes=1)
+    assert not is_marked(marked, body.digest)
+    assert not len(mark(metafs, processes=1, since=started + 60)[0])  # nothing changed since
+
+    # written after mark() read the about_hash folder, before the sweep
+    metafs.putrecord(about_hash=about, to_hash=body, link_name='body', data_source_name='test', timestamp='2.0')
+    assert [address.hexdigest for address in sweep(fs, marked, min_age=-60)] == [body.hexdigest]
+    assert not list(sweep(fs, marked, min_age=-60, delete=True, metafs=metafs, since=started, processes=1))
+    assert fs.existshexdigest(body.hexdigest)
+
+
+def test_mark_any_layout(fs, metafs):
+    about = fs.putstr('http://example.com')
+    body = fs.putstr('body')
+    metafs.putrecord(about_hash=about, to_hash=body, link_name='body', data_source_name='test', timestamp='1.0')
+    about_path = metafs.aboutpath(about)
+    deeper = about_path.parent / about.hexdigest[2] / about.hexdigest  # as a deeper layout wrote it
+    about_path.rename(str(about_path) + '.tmp')
+    os.makedirs(str(deeper.parent))
+    os.rename(str(about_path) + '.tmp', str(deeper))
+    marked, _ = mark(metafs, processes=1)
+    assert is_marked(marked, about.digest)
+    assert is_marked(marked, body.digest)
@@ -5,7 +5,7 @@ from io import BufferedReader
 import os
 import py
 import pytest
-from uhashfs import uHashFS, unshard, path_is_parent
+from uhashfs import uHashFS, uHashFSMetadata, unshard, path_is_parent
 
 TIMESTAMP = str(time.time())
 
@@ -94,6 +94,11 @@ def fssha1(testpath_fsroot):
     return uHashFS(root=str(testpath_fsroot), algorithm='sha1', width=1, depth=4)
 
 
+@pytest.fixture
+def metafs(tmpdir, fs):
+    return uHashFSMetadata(root=str(tmpdir.join('uhashfs_metaroot' + TIMESTAMP)), uhashfs=fs, width=fs.width, depth=fs.depth)
+
+
 def putstr_range(fs, count):
     return dict((address.abspath, address)
                 for address in (fs.putstr(u'{0}'.format(i))
@@ -296,7 +301,7 @@ def test_uhashfs_deletehexdigest(fs, unicodestring, address_attr):
     address = fs.putstr(unicodestring)
 
     fs.deletehexdigest(getattr(address, address_attr))
-    assert len(os.listdir(fs.root)) == 2  # _tmp and hash_folder
+    assert len(os.listdir(fs.root)) == 3  # _tmp, hash_folder and the root descriptor
 
 
 def test_uhashfs_deletehexdigest_error(fs):
@@ -397,3 +402,249 @@ def test_uhashfs_correct_file_count(fs):
     count = 5
     putstr_range(fs, count)
     assert len(list(fs.files())) == count
+
+
+def test_uhashfsmetadata_putrecord(fs, metafs):
+    about = fs.putstr('about')
+    to = fs.putstr('to')
+    metafs.putrecord(about_hash=about, to_hash=to, link_name='link', data_source_name='source', timestamp='1.0')
+    metafs.putrecord(about_hash=about, to_hash=to, link_name='link', data_source_name='source', timestamp='2.0')
+    dest_about = metafs.root / about.relative_path
+    assert os.readlink(dest_about / 'archive' / '1.0' / 'source' / 'link') == to.hexdigest
+    assert os.readlink(dest_about / 'latest_archive') == os.path.join('archive', '2.0')
+    assert sorted(os.listdir(dest_about)) == ['archive', 'latest_archive']
+
+
+def test_uhashfsmetadata_putrecords(fs, metafs):
+    about_a = fs.putstr('about_a')
+    about_b = fs.putstr('about_b')
+    to = putstr_range(fs, 3)
+    records = [(about_a, address, 'link' + str(index), 'source', '1.0') for index, address in enumerate(to.values())]
+    records.append((about_b, about_a, 'link', 'other', '1.0'))
+    records.append((about_a, about_b, 'link', 'other', '3.0'))
+    records.append((about_a, about_b, 'link', 'other', '2.0'))
+    assert metafs.putrecords(iter(records)) == 6
+    dest_a = metafs.root / about_a.relative_path
+    dest_b = metafs.root / about_b.relative_path
+    assert len(os.listdir(dest_a / 'archive' / '1.0' / 'source')) == 3
+    assert os.readlink(dest_a / 'archive' / '3.0' / 'other' / 'link') == about_b.hexdigest
+    assert os.readlink(dest_a / 'latest_archive') == os.path.join('archive', '2.0')  # last record wins
+    assert os.readlink(dest_b / 'latest_archive') == os.path.join('archive', '1.0')
+    assert sorted(os.listdir(dest_a)) == ['archive', 'latest_archive']
+    assert metafs.putrecords(records) == 6  # idempotent
+
+
+def test_uhashfs_root_descriptor(fs, testpath_fsroot):
+    assert not os.path.exists(os.path.join(str(fs.root), '_uhashfs'))  # written on first write
+    address = fs.putstr('foo')
+    with open(os.path.join(str(fs.root), '_uhashfs')) as fh:
+        assert fh.read() == 'format=1\nalgorithm=sha3_256\nwidth=1\ndepth=4\n'
+
+    reopened = uHashFS(root=str(testpath_fsroot))
+    assert reopened.has_descriptor
+    assert (reopened.algorithm, reopened.width, reopened.depth) == ('sha3_256', 1, 4)
+    assert reopened.existshexdigest(address.hexdigest)
+
+    with pytest.raises(ValueError, match='was created with width 1, not 2'):
+        uHashFS(root=str(testpath_fsroot), width=2)
+
+
+def test_uhashfs_sorted_hexdigests(tmpdir):
+    fs = uHashFS(root=str(tmpdir.join('sorted')), algorithm='sha3_256', width=2, depth=2)
+    hexdigests = sorted(fs.putstr(str(i)).hexdigest for i in range(300))
+    assert list(fs.sorted_hexdigests()) == hexdigests
+    prefix = hexdigests[0][:1]
+    assert list(fs.sorted_hexdigests(prefix=prefix)) == [h for h in hexdigests if h.startswith(prefix)]
+    prefix = hexdigests[0][:3]  # within the second shard level
+    assert list(fs.sorted_hexdigests(prefix=prefix)) == [h for h in hexdigests if h.startswith(prefix)]
+    assert list(fs.sorted_hexdigests(prefix=hexdigests[5])) == [hexdigests[5]]
+    for start_after in (hexdigests[0], hexdigests[150], hexdigests[150][:3], 'f', hexdigests[-1]):
+        assert list(fs.sorted_hexdigests(start_after=start_after)) == [h for h in hexdigests if h > start_after]
+    pages = []
+    cursor = ''
+    while cursor is not None:
+        page, cursor = fs.list_hexdigests(start_after=cursor, limit=64)
+        assert len(page) <= 64
+        pages.extend(page)
+    assert pages == hexdigests
+    assert fs.list_hexdigests(limit=300) == (hexdigests, None)
+
+
+def test_uhashfs_delete_many(fs):
+    addresses = [fs.putstr(str(i)) for i in range(5)]
+    missing = '0' * fs.hexdigestlen
+    deleted = fs.delete_many([address.hexdigest for address in addresses[:3]] + [missing])
+    assert deleted == [address.hexdigest for address in addresses[:3]]
+    assert sorted(fs.files()) == sorted(address.abspath for address in addresses[3:])
+    assert not fs.existsdigest(addresses[0].digest)
+    assert fs.existsdigest(addresses[4].digest)
+    assert fs.deletedigest(addresses[4].digest)
+    with fs.opendigest(addresses[3].digest) as fh:
+        assert fh.read() == b'3'
+    assert not [name for name in os.listdir(str(fs.tmproot)) if name.startswith('_tombstone.')]
+
+
+def test_uhashfs_put_during_delete(fs):
+    import threading
+    address = fs.putstr('contended')
+    tombstone = fs._tombstone(address.hexdigest)
+    os.makedirs(str(fs.tmproot), exist_ok=True)
+    open(str(tombstone), 'w').close()  # a delete is in progress
+
+    def finish_delete():
+        time.sleep(0.05)
+        os.remove(str(address.abspath))
+        os.unlink(str(tombstone))
+
+    deleter = threading.Thread(target=finish_delete)
+    deleter.start()
+    again = fs.putstr('contended')  # found it stored, but waits for the delete and stores it again
+    deleter.join()
+    assert not again.is_duplicate
+    assert os.path.exists(str(address.abspath))
+    open(str(tombstone), 'w').close()
+    os.utime(str(tombstone), (0, 0))  # left by a crashed delete
+    assert fs.putstr('contended').is_duplicate
+    assert not os.path.exists(str(tombstone))
+
+
+def test_uhashfs_putfrom_link_checks(fs, make_fs):
+    import threading
+    src = make_fs('src')
+    address = src.putstr('linked')
+    fs.putstr('linked')
+    tombstone = fs._tombstone(address.hexdigest)
+    os.makedirs(str(fs.tmproot), exist_ok=True)
+    open(str(tombstone), 'w').close()  # a delete is in progress
+
+    def finish_delete():
+        time.sleep(0.05)
+        os.remove(str(fs.hexdigestpath(address.hexdigest)))
+        os.unlink(str(tombstone))
+
+    deleter = threading.Thread(target=finish_delete)
+    deleter.start()
+    again = fs.putfrom(src, address.hexdigest, link=True)  # waits for the delete and links it again
+    deleter.join()
+    assert not again.is_duplicate
+    assert os.path.exists(str(again.abspath))
+
+    corrupt = src.putstr('corrupt')
+    os.chmod(str(corrupt.abspath), 0o644)
+    with open(str(corrupt.abspath), 'w') as fh:
+        fh.write('changed')
+    with pytest.raises(ValueError):
+        fs.putfrom(src, corrupt.hexdigest, link=True)
+    assert not os.path.exists(str(fs.hexdigestpath(corrupt.hexdigest)))
+    assert not fs.putfrom(src, corrupt.hexdigest, link=True, verify=False).is_duplicate
+
+
+def test_uhashfs_anonymous_tmp(fs):
+    if not fs.anonymous_tmp:
+        pytest.skip("O_TMPFILE not supported here")
+    tmp = fs._mktemp()
+    tmp.write(b'unnamed')
+    tmp.close()
+    assert os.path.getsize(tmp.name) == 7
+    assert not os.path.exists(str(fs.tmproot))  # no directory entry until linked
+    address = fs._commit(digest=fs.putstr('unnamed').digest, tmp=tmp)
+    assert address.is_duplicate
+    with pytest.raises(OSError):
+        os.fstat(tmp.fd)  # discarded with its fd
+
+
+def test_uhashfs_named_tmp_fallback(fs, fileio_outside_fsroot):
+    fs.anonymous_tmp = False
+    tmp = fs._mktemp()
+    assert tmp.name.startswith(str(fs.tmproot / (str(os.getpid()) + '.')))  # in this worker's folder
+    tmp.discard()
+    address = fs.putfile(fileio_outside_fsroot)
+    assert not address.is_duplicate
+    assert [files for _, _, files in os.walk(str(fs.tmproot)) if files] == []
+    assert list(fs.check(fs.root)) == []  # worker folders are not part of the tree
+    fs._remove_tmp_workers()
+    assert os.listdir(str(fs.tmproot)) == []
+
+
+def test_uhashfs_hash_address_lazy(fs):
+    address = fs.putstr('lazy')
+    assert not hasattr(address, '__dict__')
+    assert address.hexdigest == address.digest.hex()
+    assert address.abspath == fs.hexdigestpath(address.hexdigest)
+    derived = type(address)(address.digest, fs)  # abspath from the layout
+    assert derived.abspath == address.abspath
+    assert derived.relative_path == address.relative_path
+    assert str(derived.relative_path).startswith('sha3_256' + os.sep)
+
+
+def test_uhashfs_hash_address_eq(fs):
+    address = fs.putstr('equal')
+    HashAddress = type(address)
+    lazy = HashAddress(address.digest, fs, None)
+    assert lazy == fs.gethexdigest(address.hexdigest)  # before abspath is read
+    lazy.abspath
+    assert lazy == fs.gethexdigest(address.hexdigest)
+    assert HashAddress(address.digest, fs, str(address.abspath)) == HashAddress(address.digest, fs, address.abspath)
+    assert HashAddress(address.digest, fs, None) != HashAddress(address.digest, fs, None, is_duplicate=True)
+
+
+def test_uhashfs_batches(fs, tmpdir):
+    infiles = []
+    for data in ['a', 'b', 'a', 'c'] * 3:  # 12 items, past one flags byte
+        infile = tmpdir.join('batch_{0}'.format(len(infiles)))
+        infile.write(data)
+        infiles.append(str(infile))
+    batch = fs.putbatch(infiles)
+    assert len(batch) == 12
+    assert len(batch.digests) == 12 * fs.digestlen
+    assert len(batch.flags) == 2
+    assert [batch.flag(index) for index in range(12)] == [False, False, True, False] + [True] * 8
+    assert batch.count() == 9
+    assert list(batch.hexdigests(flag=False)) == [fs.putstr(data).hexdigest for data in 'abc']
+    assert batch[-1].hexdigest == batch.hexdigest(11) == fs.putstr('c').hexdigest
+    assert batch[3].abspath == fs.putstr('c').abspath and batch[3].is_duplicate is False
+    with pytest.raises(IndexError):
+        batch.digest(12)
+
+    missing = '0' * fs.hexdigestlen
+    exists = fs.existsbatch([batch.hexdigest(0), missing, batch.hexdigest(1)])
+    assert [address.is_duplicate for address in exists] == [True, False, True]
+    assert list(exists.hexdigests(flag=False)) == [missing]
+
+    listing = fs.listbatch()
+    assert list(listing.hexdigests()) == list(fs.sorted_hexdigests())
+    assert listing.count() == 0
+    assert len(fs.listbatch(limit=2)) == 2
+
+
+class SortedSet():
+    '''the redis sorted set calls uHashFS makes, in memory'''
+    def __init__(self):
+        self.scores = {}
+
+    def zadd(self, name, mapping):
+        self.scores.update(mapping)
+
+    def zrem(self, name, *members):
+        for member in members:
+            self.scores.pop(member, None)
+
+    def zscore(self, name, member):
+        return self.scores.get(member)
+
+
+def test_uhashfs_delete_many_redis_race(fs):
+    address = fs.putstr('raced')
+    fs.redis = SortedSet()
+    fs.rediskey = 'test#'
+    zrem = fs.redis.zrem
+
+    def put_between(name, *members):  # a duplicate put between the redis removal and the unlink
+        zrem(name, *members)
+        fs.redis.zrem = zrem
+        assert fs.putstr('raced').is_duplicate
+        assert fs.redis.zscore(fs.rediskey, address.digest)
+    fs.redis.zrem = put_between
+    assert fs.delete_many([address.hexdigest]) == [address.hexdigest]
+    assert not os.path.exists(str(address.abspath))
+    assert fs.redis.zscore(fs.rediskey, address.digest) is None
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from uhashfs import uHashFSMetadata
+
+
+@pytest.fixture
+def metafs(tmpdir, fs):
+    return uHashFSMetadata(root=str(tmpdir.join('meta')), uhashfs=fs, width=1, depth=2, index=True)
+
+
+def test_index_putrecord_lookups(fs, metafs):
+    about = fs.putstr('http://example.com')
+    body_1 = fs.putstr('body 1')
+    body_2 = fs.putstr('body 2')
+    metafs.putrecord(about_hash=about, to_hash=body_1, link_name='body', data_source_name='crawler', timestamp='100.0')
+    metafs.putrecords([(about, body_2, 'body', 'crawler', '200.0'),
+                       (about, body_2, 'copy', 'mirror', '300.0')])
+
+    assert [record[0] for record in metafs.index.about(body_2.digest)] == [about.hexdigest] * 2
+    assert len(list(metafs.index.records(about.digest))) == 3
+    assert len(list(metafs.index.source('crawler'))) == 2
+    assert [record[1] for record in metafs.index.source('crawler', start=150)] == [body_2.hexdigest]
+    assert [record[3] for record in metafs.index.timerange(250, 400)] == ['copy']
+    assert metafs.index.latest(about.digest) == '300.0'
+    assert metafs.index.latest(body_1.digest) is None
+
+
+def test_index_rebuild(tmpdir, fs, metafs):
+    about = fs.putstr('http://example.com')
+    body = fs.putstr('body')
+    metafs.putrecord(about_hash=about, to_hash=body, link_name='body', data_source_name='crawler', timestamp='100.0')
+    metafs.putrecord(about_hash=about, to_hash=about, link_name='self', data_source_name='crawler', timestamp='50.0')
+    before = sorted(metafs.index.records(about.digest))
+    metafs.index.clear()
+    assert not list(metafs.index.records(about.digest))
+
+    reopened = uHashFSMetadata(root=str(tmpdir.join('meta')), uhashfs=fs, index=True)
+    assert reopened.index.rebuild(reopened) == 2
+    assert sorted(reopened.index.records(about.digest)) == before
+    assert reopened.index.latest(about.digest) == '50.0'
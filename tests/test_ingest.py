@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+from uhashfs.federation import uHashFSFederation
+from uhashfs.ingest import ingest, walk, IngestSummary
+
+
+@pytest.fixture
+def tree(tmpdir):
+    top = tmpdir.mkdir('tree')
+    top.join('a').write('same')
+    top.mkdir('sub').join('b').write('same')
+    top.join('sub').mkdir('deeper').join('c').write('different')
+    os.symlink(str(top.join('a')), str(top.join('sub', 'link')))  # skipped inside trees
+    return top
+
+
+def test_walk(tree, fs):
+    found = dict(walk([str(tree)], recursive=True))
+    assert sorted(os.path.relpath(path, str(tree)) for path in found) == ['a', os.path.join('sub', 'b'), os.path.join('sub', 'deeper', 'c')]
+    assert not any(found.values())
+    (path, error), = walk([str(tree)])
+    assert isinstance(error, IsADirectoryError)
+    (path, error), = walk([str(tree.join('missing'))])
+    assert isinstance(error, FileNotFoundError)
+    assert dict(walk([str(tree.join('sub', 'link'))])) == {str(tree.join('sub', 'link')): None}  # given, followed
+
+
+def test_ingest(tree, fs, tmpdir):
+    inside = str(fs.root)
+    fs.putstr('inside')
+    summary = IngestSummary()
+    results = list(ingest(fs, [str(tmpdir)], recursive=True, workers=2, queue_size=1))
+    for result in results:
+        summary.add(result)
+    assert all(not os.path.realpath(result.path).startswith(inside) for result in results)  # the root is skipped
+    assert summary.errors == 0
+    assert (summary.new, summary.new_bytes) == (2, len('same') + len('different'))
+    assert (summary.duplicate, summary.duplicate_bytes) == (1, len('same'))
+    for result in results:
+        with open(result.path, 'rb') as source:
+            assert fs.gethexdigest(result.address.hexdigest).abspath.read_bytes() == source.read()
+    assert os.stat(str(fs.putstr('different').abspath)).st_mtime_ns == os.stat(str(tree.join('sub', 'deeper', 'c'))).st_mtime_ns
+
+    result, = ingest(fs, [str(tree.join('vanished'))])
+    assert isinstance(result.error, FileNotFoundError) and result.address is None
+
+
+def test_ingest_stopped_early(tree, fs):
+    fs.anonymous_tmp = False  # named temp files, to look for leftovers
+    results = ingest(fs, [str(tree)] * 20, recursive=True, workers=2, queue_size=2)
+    next(results)
+    results.close()  # hashed but uncommitted files are discarded
+    assert [files for _, _, files in os.walk(str(fs.tmproot)) if files] == []
+
+
+def test_ingest_federation(tree, tmpdir):
+    members = {'0': str(tmpdir.join('disk0')), '8': str(tmpdir.join('disk1'))}
+    federation = uHashFSFederation(root=str(tmpdir.join('federation')), members=members, algorithm='sha3_256', width=1, depth=2)
+    results = list(ingest(federation, [str(tree)], recursive=True))
+    assert len(results) == 3
+    for result in results:
+        assert result.address.fs is federation.member(result.address.hexdigest)
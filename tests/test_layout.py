@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+from uhashfs.layout import analyze, benchmark, knee, recommend, folder_count, percentile
+
+
+@pytest.fixture
+def fs(make_fs):
+    return make_fs(depth=1)
+
+
+def test_analyze(fs):
+    for i in range(100):
+        fs.putstr(str(i) * (i + 1))
+    report = analyze(fs, workers=2)
+    assert report.edge_count == 16
+    assert report.leaves_scanned == report.leaves_found
+    assert report.objects == 100
+    assert report.objects_estimate == 100
+    assert sum(report.size_histogram.values()) == 100
+    assert report.bytes == sum(len(str(i) * (i + 1)) for i in range(100))
+    assert report.p50 <= report.p99 <= report.max
+    assert report.inodes_used > 0
+    sampled = analyze(fs, sample=8, sizes=False)
+    assert sampled.leaves_scanned == 8
+    assert sampled.size_histogram == {}
+
+
+def test_analyze_empty(fs):
+    report = analyze(fs)
+    assert report.objects == 0
+    assert report.max == 0
+
+
+def test_analyze_deep(make_fs):
+    deep = make_fs('deep', width=2, depth=3)
+    deep.putstr('alone')
+    report = analyze(deep)  # 16 ** 6 leaves, never listed
+    assert report.edge_count == 16 ** 6
+    assert (report.p50, report.p99, report.max) == (0, 0, 1)
+    assert report.objects_estimate == report.objects == 1
+    assert percentile({0: 98, 1: 1, 10: 1}, 99) == pytest.approx(1.09)  # as numpy.percentile()
+    assert percentile({3: 1}, 50) == 3
+
+
+def test_benchmark(tmpdir):
+    results = benchmark(str(tmpdir), sizes=(4, 64), lookups=20)
+    assert sorted(results) == [4, 64]
+    assert os.listdir(str(tmpdir)) == []
+    assert knee(results, tolerance=float('inf')) == 64
+
+
+def test_benchmark_drop_caches(tmpdir, monkeypatch):
+    drops = []
+    monkeypatch.setattr('uhashfs.layout.drop_dentry_cache', lambda: drops.append(1))  # root only, and machine wide
+    results = benchmark(str(tmpdir), sizes=(4, 64), lookups=10, drop_caches=True)
+    assert sorted(results) == [4, 64]
+    assert len(drops) == 20  # before every lookup
+
+
+def test_recommend():
+    assert folder_count(2, 2) == 256 + 65536
+    assert recommend(1000, 4096) == (1, 1)
+    assert recommend(10 ** 6, 4096) == (2, 1)  # as many leaves as 1/2, fewer folders
+    assert recommend(10 ** 9, 4096) == (1, 5)
+    assert recommend(10 ** 9, 4096, max_depth=2) == (3, 2)
+    assert recommend(10 ** 30, 1, max_width=1, max_depth=2) == (1, 2)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from uhashfs import uHashFS
+
+
+@pytest.fixture
+def fs_a(make_fs):
+    return make_fs('a', merkle=True)
+
+
+@pytest.fixture
+def fs_b(make_fs):
+    return make_fs('b', merkle=True)
+
+
+def test_merkle_equal_and_diverging(fs_a, fs_b):
+    for i in range(50):
+        fs_a.putstr(str(i))
+        fs_b.putstr(str(i))
+    assert fs_a.merkle.update() == fs_b.merkle.update()
+    assert not list(fs_a.merkle.diverging(fs_b.merkle))
+
+    extra = fs_b.putstr('extra')
+    fs_b.merkle.update()
+    assert fs_a.merkle.summary() != fs_b.merkle.summary()
+    assert list(fs_a.merkle.diverging(fs_b.merkle)) == [extra.hexdigest[:2]]
+
+    fs_b.deletehexdigest(extra.hexdigest)
+    assert fs_b.merkle.update() == fs_a.merkle.summary()
+
+
+def test_merkle_incremental_matches_rebuild(tmpdir, fs_a):
+    fs_a.putstr('foo')
+    fs_a.merkle.update()
+    for i in range(10):
+        fs_a.putstr(str(i))
+    incremental = fs_a.merkle.update()
+    assert fs_a.merkle.update(rebuild=True) == incremental
+
+    reopened = uHashFS(root=str(tmpdir.join('a')))  # enabled by the _merkle file
+    assert reopened.merkle
+    reopened.putstr('bar')
+    assert reopened.merkle.update() != incremental
+    assert reopened.merkle.update(rebuild=True) == reopened.merkle.summary()
+
+
+def test_merkle_dirty_file_leftovers_and_concurrency(tmpdir, fs_a, monkeypatch):
+    fs_a.merkle.update()
+    for i in range(600):  # more than the 256 leaves
+        fs_a.putstr(str(i))
+    with open(str(fs_a.merkle.dirty_path)) as fh:
+        lines = fh.read().split()
+    assert len(lines) == len(set(lines)) < 600  # each leaf appended once
+
+    # an update() that died after taking the dirty file
+    with monkeypatch.context() as patched:
+        patched.setattr(fs_a.merkle, 'save', lambda: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            fs_a.merkle.update()
+    assert not fs_a.merkle.dirty_path.exists()
+    fs_a.putstr('after the crash')  # reopens a new dirty file
+    reopened = uHashFS(root=str(tmpdir.join('a')))
+    assert reopened.merkle.update() == reopened.merkle.update(rebuild=True)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda i: fs_a.putstr('concurrent' + str(i)), range(100)))
+        list(pool.map(lambda _: uHashFS(root=str(tmpdir.join('a'))).merkle.update(), range(4)))
+    assert fs_a.merkle.update() == reopened.merkle.update(rebuild=True)
+    assert not [name for name in os.listdir(str(fs_a.root)) if name.startswith('_merkle.dirty.')]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import fcntl
+import os
+import threading
+import time
+import pytest
+from uhashfs.objects import uHashFSObjects
+
+
+def test_objects_table(tmpdir, make_fs):
+    fs = make_fs(objects=True)
+    infile = tmpdir.join('infile')
+    infile.write('file contents')
+    os.utime(str(infile), (1000000000, 1000000000))
+    before = time.time()
+    from_file = fs.putfile(str(infile), content_type='text/plain')
+    from_str = fs.putstr('string')
+    assert fs.putstr('string').is_duplicate
+    fs.objects.flush()
+    reopened = make_fs()
+    assert reopened.objects  # enabled by the existing table
+    info = reopened.objects.get(from_file.hexdigest)
+    assert (info.size, info.mtime, info.content_type) == (13, 1000000000, 'text/plain')
+    assert info.ingest_time >= before
+    assert reopened.objects.get(from_str.hexdigest).size == 6
+    assert reopened.content_type(from_file.hexdigest) == 'text/plain'
+    assert reopened.objects.totals() == (2, 19)
+    assert [hexdigest for hexdigest, _ in reopened.objects.items()] == sorted([from_file.hexdigest, from_str.hexdigest])
+    assert reopened.estimate_tree_properites(variance=1) == (2, 19)
+    reopened.deletehexdigest(from_str.hexdigest)
+    assert reopened.objects.get(from_str.hexdigest) is None
+    reopened.objects.flush()
+    assert make_fs().objects.totals() == (1, 13)
+
+
+def test_objects_putfrom(make_fs):
+    src = make_fs(objects=True)
+    address = src.putstr('shared')
+    src.objects.add(address.digest, 6, content_type='application/x-test')
+    dst = make_fs('dst', objects=True)
+    dst.putfrom(src, address.hexdigest)
+    assert dst.objects.get(address.hexdigest).content_type == 'application/x-test'
+
+
+def test_objects_rebuild(make_fs):
+    fs = make_fs()
+    addresses = [fs.putstr(str(i) * i) for i in range(1, 6)]
+    table = uHashFSObjects(fs=fs)
+    assert table.rebuild() == (5, 0)
+    assert table.totals() == (5, sum(len(str(i) * i) for i in range(1, 6)))
+    fs.deletehexdigest(addresses[0].hexdigest)  # table not enabled on fs, so not recorded
+    assert table.rebuild() == (0, 1)
+    size = os.path.getsize(table.path)
+    assert size == 4 * (fs.digestlen + 25)
+    assert make_fs().objects.totals()[0] == 4
+
+
+def test_objects_torn_records(make_fs, monkeypatch):
+    fs = make_fs(objects=True)
+    kept = fs.putstr('kept')
+    torn = fs.putstr('torn')
+    fs.objects.flush()
+    size = os.path.getsize(str(fs.objects.path))
+    os.truncate(str(fs.objects.path), size - 3)  # a crash during the append
+    table = uHashFSObjects(fs=fs)
+    assert table.totals() == (1, 4)
+    assert os.path.getsize(str(fs.objects.path)) == fs.digestlen + 25  # the torn record is dropped
+    table.add(torn.digest, 4)
+    table.flush()
+    assert uHashFSObjects(fs=fs).totals() == (2, 8)  # appends after it stay aligned
+
+    write = os.write
+    monkeypatch.setattr(os, 'write', lambda fd, data: write(fd, data[:5]))  # out of space
+    table.add(b'\0' * fs.digestlen, 1)
+    with pytest.raises(OSError):
+        table.flush()
+    monkeypatch.setattr(os, 'write', write)
+    assert uHashFSObjects(fs=fs).totals() == (2, 8)
+    table.flush()  # retried
+    assert uHashFSObjects(fs=fs).totals() == (3, 9)
+    assert uHashFSObjects(fs=fs).get(kept.hexdigest).size == 4
+
+
+def test_objects_compact_keeps_appends(make_fs):
+    fs = make_fs(objects=True)
+    fs.putstr('before')
+    fs.objects.flush()
+    other = uHashFSObjects(fs=fs)  # another process, mid append
+    other.add(b'\1' * fs.digestlen, 5)
+    fd = other._open_log(fcntl.LOCK_SH)
+    compacting = threading.Thread(target=fs.objects.compact)
+    compacting.start()
+    time.sleep(0.1)
+    assert compacting.is_alive()  # waits for the append
+    os.write(fd, other.pending.pop())
+    os.close(fd)
+    compacting.join()
+    assert uHashFSObjects(fs=fs).totals() == (2, 11)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import io
+import os
+import pytest
+from uhashfs.pagecache import CACHE_MODES, READ_SIZE, scan_open
+from uhashfs.stream import export_stream
+
+
+@pytest.mark.parametrize('cache_mode', CACHE_MODES)
+def test_scan_open(fs, cache_mode):
+    data = os.urandom(READ_SIZE * 2 + 12345)  # not a multiple of the block size
+    address = fs.putstr(data)
+    with scan_open(str(address.abspath), cache_mode) as fh:
+        read = b''.join(iter(lambda: fh.read(65536), b''))
+    assert read == data
+    assert list(fs.check(fs.root, skip_cached=False, quiet=True, cache_mode=cache_mode)) == []
+    out = io.BytesIO()
+    assert export_stream(fs, out, hexdigests=[address.hexdigest], cache_mode=cache_mode) == (1, len(data))
+
+
+def test_scan_open_direct_fallback(fs, monkeypatch):
+    address = fs.putstr('no O_DIRECT here')
+    real_open = os.open
+
+    def refuse_direct(path, flags, *args, **kwargs):
+        if flags & os.O_DIRECT:
+            raise OSError(errno.EINVAL, 'Invalid argument')
+        return real_open(path, flags, *args, **kwargs)
+    monkeypatch.setattr(os, 'open', refuse_direct)
+    with scan_open(str(address.abspath), 'direct') as fh:
+        assert fh.read() == b'no O_DIRECT here'
+
+    path = fs.hexdigestpath(fs.putstr('corrupted').hexdigest)
+    os.chmod(str(path), 0o644)
+    with open(str(path), 'w') as fh:
+        fh.write('changed')
+    assert [str(bad) for bad, _ in fs.check(fs.root, skip_cached=False, quiet=True, cache_mode='direct')] == [str(path)]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+from uhashfs import uHashFS, uHashFSMetadata
+from uhashfs.garbage import mark, sweep
+from uhashfs.reshard import reshard, finish
+
+
+def test_reshard(tmpdir, fs):
+    addresses = [fs.putstr(str(i)) for i in range(40)]
+    assert reshard(fs, 2, 3, workers=4) == 40
+    assert (fs.width, fs.depth, fs.previous_layout) == (2, 3, None)
+    assert sorted(set(os.listdir(str(fs.root))) - {'_tmp'}) == ['_uhashfs', 'sha3_256']
+    reopened = uHashFS(root=str(tmpdir.join('data')))
+    assert (reopened.width, reopened.depth) == (2, 3)
+    for address in addresses:
+        path = reopened.hexdigestpath(address.hexdigest)
+        assert path.relative_to(reopened.root).parts[1] == address.hexdigest[:2]
+        assert reopened.existshexdigest(address.hexdigest)
+    assert len(list(reopened.files())) == 40
+    assert reshard(reopened, 2, 3) == 0
+
+
+def test_reshard_resume_and_fallback(tmpdir, fs):
+    first = fs.putstr('first')
+    reshard(fs, 2, 2, do_cutover=False)
+    late = fs.putstr('late')  # written to the old layout while resharding
+    reshard(fs, 2, 2, do_finish=False)
+    assert fs.previous_layout == (1, 2)
+    os.unlink(fs.hexdigestpath(late.hexdigest))  # as if written to the old tree during cutover
+    reopened = uHashFS(root=str(tmpdir.join('data')))
+    assert reopened.previous_layout == (1, 2)
+    assert reopened.existshexdigest(late.hexdigest)  # from _reshard.old
+    with reopened.openhexdigest(late.hexdigest) as fh:
+        assert fh.read() == b'late'
+    with pytest.raises(ValueError):
+        reshard(reopened, 1, 2)
+    assert finish(reopened) == 1
+    reopened = uHashFS(root=str(tmpdir.join('data')))
+    assert reopened.previous_layout is None
+    assert reopened.existshexdigest(late.hexdigest)
+    assert reopened.existshexdigest(first.hexdigest)
+
+
+def crash_on_rename(monkeypatch, destination):
+    '''makes the rename of the tree into destination fail, as if the process died there'''
+    rename = os.rename
+
+    def crashing(src, dst, *args, **kwargs):
+        if os.path.basename(str(dst)) == 'sha3_256' and os.path.basename(os.path.dirname(str(dst))) == destination:
+            raise KeyboardInterrupt
+        return rename(src, dst, *args, **kwargs)
+    monkeypatch.setattr(os, 'rename', crashing)
+    return rename
+
+
+@pytest.mark.parametrize('destination', ['_reshard.old', 'data'])
+def test_reshard_interrupted_cutover(tmpdir, fs, monkeypatch, destination):
+    addresses = [fs.putstr(str(i)) for i in range(10)]
+    writer = uHashFS(root=str(tmpdir.join('data')))  # opened before the cutover, not stopped
+    rename = crash_on_rename(monkeypatch, destination)
+    with pytest.raises(KeyboardInterrupt):
+        reshard(fs, 2, 2)
+    monkeypatch.setattr(os, 'rename', rename)
+    stray = writer.putstr('stray')  # recreates the tree folder if it was moved away
+    reopened = uHashFS(root=str(tmpdir.join('data')))
+    assert (reopened.width, reopened.depth, reopened.previous_layout) == (2, 2, (1, 2))  # the intent
+    with pytest.raises(ValueError):
+        reshard(reopened, 1, 3)
+    reshard(reopened, 2, 2)
+    reopened = uHashFS(root=str(tmpdir.join('data')))
+    assert (reopened.width, reopened.depth, reopened.previous_layout) == (2, 2, None)
+    for address in addresses + [stray]:
+        assert reopened.existshexdigest(address.hexdigest)
+        assert reopened.hexdigestpath(address.hexdigest).exists()
+
+
+def test_reshard_metadata_and_gc(tmpdir, fs):
+    metafs = uHashFSMetadata(root=str(tmpdir.join('meta')), uhashfs=fs, width=1, depth=2)
+    about = fs.putstr('http://example.com')
+    before = fs.putstr('before')
+    metafs.putrecord(about_hash=about, to_hash=before, link_name='body', data_source_name='test', timestamp='1.0')
+    reshard(fs, 2, 2, do_cutover=False)
+    late = fs.putstr('late')  # unreferenced
+    reshard(fs, 2, 2, do_finish=False)
+    os.unlink(fs.hexdigestpath(late.hexdigest))  # only in _reshard.old
+    address = fs.gethexdigest(late.hexdigest)
+    assert '_reshard.old' in str(address.abspath)
+    assert address.relative_path == fs.hexdigestpath(late.hexdigest).relative_to(fs.root)
+    finish(fs)
+
+    fs = uHashFS(root=str(tmpdir.join('data')))
+    metafs = uHashFSMetadata(root=str(tmpdir.join('meta')), uhashfs=fs)
+    assert (fs.width, fs.depth, metafs.width, metafs.depth) == (2, 2, 1, 2)
+    after = fs.putstr('after')
+    metafs.putrecord(about_hash=fs.gethexdigest(about.hexdigest), to_hash=after, link_name='body',
+                     data_source_name='test', timestamp='2.0')
+    assert metafs.aboutpath(about).relative_to(metafs.root).parts[1] == about.hexdigest[0]  # the metadata's layout
+    marked, _ = mark(metafs, processes=1)
+    assert len(marked) == 3
+    unreferenced = [address.hexdigest for address in sweep(fs, marked, min_age=-60)]
+    assert sorted(unreferenced) == [late.hexdigest]
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+import os
+import threading
+import pytest
+from uhashfs.server import uHashFSServer, uHashFSClient
+
+
+@pytest.fixture
+def client(tmpdir, fs):
+    socket_path = str(tmpdir.join('uhashfs.sock'))
+    server = uHashFSServer(fs, socket_path, putfile_roots=[str(tmpdir.join('inbox'))])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    with uHashFSClient(socket_path=socket_path) as client:
+        yield client
+    server.shutdown()
+    server.server_close()
+
+
+def test_server_put_get(fs, client):
+    data = b'x' * (256 * 128 * 2 * 3 + 7)  # several frames
+    hexdigest, is_duplicate = client.put(data)
+    assert not is_duplicate
+    assert hexdigest == fs.putstr(data).hexdigest
+    assert client.put(io.BytesIO(data)) == (hexdigest, True)
+    assert client.get(hexdigest) == data
+    out = io.BytesIO()
+    assert client.getfile(hexdigest, out) == len(data)
+    assert out.getvalue() == data
+    assert client.exists(hexdigest)
+    assert client.path(hexdigest) == str(fs.hexdigestpath(hexdigest))
+
+
+def test_server_putfile_delete_errors(tmpdir, fs, client):
+    infile = tmpdir.mkdir('inbox').join('infile')
+    infile.write(b'foo')
+    hexdigest, is_duplicate = client.putfile(str(infile))
+    assert not is_duplicate
+    assert fs.existshexdigest(hexdigest)
+    assert client.delete(hexdigest)
+    assert not client.exists(hexdigest)
+    with pytest.raises(FileNotFoundError):
+        client.get(hexdigest)
+    with pytest.raises(ValueError):
+        client.exists('invalid')
+    assert client.put(b'') == (fs.emptyhexdigest, False)  # connection still usable
+
+
+def test_server_verified_get(fs, client):
+    fs.verify = True
+    address = fs.putstr(b'y' * 100000)
+    assert client.get(address.hexdigest) == b'y' * 100000
+    os.chmod(address.abspath, 0o644)
+    with open(address.abspath, 'r+b') as fh:
+        fh.seek(99999)
+        fh.write(b'z')
+    with pytest.raises(ConnectionError):
+        client.get(address.hexdigest)  # cut short
+
+
+def test_server_putfile_allowed_roots(tmpdir, fs, client):
+    assert oct(os.stat(str(tmpdir.join('uhashfs.sock'))).st_mode & 0o777) == oct(0o600)
+    outside = tmpdir.join('outside')
+    outside.write(b'secret')
+    with pytest.raises(PermissionError):
+        client.putfile(str(outside))
+    inbox = tmpdir.mkdir('inbox')
+    with pytest.raises(PermissionError):
+        client.putfile(str(inbox.join('..', 'outside')))
+    os.symlink(str(outside), str(inbox.join('link')))
+    with pytest.raises(PermissionError):  # resolved, it is outside
+        client.putfile(str(inbox.join('link')))
+    os.mkfifo(str(inbox.join('fifo')))
+    with pytest.raises(ValueError):
+        client.putfile(str(inbox.join('fifo')))
+    assert not fs.existshexdigest(hashlib.sha3_256(b'secret').hexdigest())
+    assert client.exists(client.put(b'still usable')[0])
+
+
+def test_server_put_error_drains_frames(fs, client, monkeypatch):
+    def failing(frames):
+        next(frames)
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(fs, 'putstream', failing)
+    with pytest.raises(RuntimeError):
+        client.put(b'x' * (256 * 128 * 2 * 3))  # the frames after the first are not read as commands
+    monkeypatch.undo()
+    assert client.put(b'after') == (hashlib.sha3_256(b'after').hexdigest(), False)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import pytest
+from uhashfs import uHashFS
+from uhashfs.stream import export_stream, import_stream
+
+
+@pytest.fixture
+def src(make_fs):
+    return make_fs('src')
+
+
+@pytest.fixture
+def dst(make_fs):
+    return make_fs('dst')
+
+
+def test_export_import_all(src, dst):
+    addresses = [src.putstr(str(i) * i) for i in range(30)]
+    dst.putstr('1')
+    stream = io.BytesIO()
+    assert export_stream(src, stream) == (30, sum(len(str(i) * i) for i in range(30)))
+    stream.seek(0)
+    imported = list(import_stream(dst, stream, workers=4))
+    assert len(imported) == 29  # '1' already existed
+    for address in addresses:
+        with dst.openhexdigest(address.hexdigest) as fh:
+            assert fh.read() == open(address.abspath, 'rb').read()
+
+
+def test_export_subset_and_corruption(src, dst):
+    keep = src.putstr('keep')
+    src.putstr('leave')
+    stream = io.BytesIO()
+    export_stream(src, stream, hexdigests=[keep.hexdigest])
+    data = stream.getvalue()
+    assert list(address.hexdigest for address in import_stream(dst, io.BytesIO(data))) == [keep.hexdigest]
+    assert len(list(dst.files())) == 1
+
+    other = uHashFS(root=str(dst.root) + '_other', algorithm='sha3_256', width=1, depth=2)
+    corrupted = data[:-2] + b'X' + data[-1:]
+    with pytest.raises(ValueError):
+        list(import_stream(other, io.BytesIO(corrupted)))
+    assert not other.existshexdigest(keep.hexdigest)
+    with pytest.raises(EOFError):
+        list(import_stream(other, io.BytesIO(data[:-3])))
+    assert not [files for _, _, files in os.walk(str(other.tmproot)) if files]
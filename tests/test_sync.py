@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+from uhashfs.sync import sync
+
+
+@pytest.fixture
+def src(make_fs):
+    return make_fs('src')
+
+
+@pytest.fixture
+def dst(make_fs):
+    return make_fs('dst')
+
+
+def test_sync(src, dst):
+    addresses = [src.putstr(str(i)) for i in range(20)]
+    dst.putstr('0')
+    dst.putstr('only in dst')
+    results = list(sync(src, dst, workers=4))
+    assert sum(result.transferred for result in results) == 19
+    for address in addresses:
+        assert dst.existshexdigest(address.hexdigest)
+    assert len(list(dst.files())) == 21
+    assert sum(result.transferred for result in sync(src, dst)) == 0
+
+
+def test_sync_copy_verify_and_resume(tmpdir, src, dst):
+    good = src.putstr('good')
+    bad = src.putstr('bad')
+    os.chmod(bad.abspath, 0o644)
+    with open(bad.abspath, 'ab') as fh:
+        fh.write(b'rot')
+    state_file = str(tmpdir.join('state'))
+    with pytest.raises(ValueError):
+        list(sync(src, dst, link=False, state_file=state_file))
+    os.unlink(bad.abspath)
+    list(sync(src, dst, link=False, state_file=state_file))
+    assert dst.existshexdigest(good.hexdigest)
+    assert os.stat(dst.hexdigestpath(good.hexdigest)).st_nlink == 1  # copied, not linked
+    leaves = set(leaf.relative_to(src.root).as_posix() for leaf in src.leaf_folders())
+    assert set(open(state_file).read().splitlines()) == leaves
+    assert not list(sync(src, dst, state_file=state_file))  # every leaf done
+
+
+def test_sync_layout_mismatch(make_fs, src):
+    other = make_fs('other', width=2, depth=1)
+    with pytest.raises(ValueError):
+        list(sync(src, other))
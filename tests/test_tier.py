@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import pytest
+from uhashfs import uHashFS
+from uhashfs.tier import AccessLog, migrate, DAY, RECORD
+
+
+@pytest.fixture
+def fs(tmpdir, make_fs):
+    return make_fs('fast', access=True, cold_root=str(tmpdir.join('cold')))
+
+
+def age(fs, address, days):
+    '''backdates the object's last read or ingest, days=None drops it from the log'''
+    reads = fs.access.load()
+    reads.pop(address.digest)
+    if days is not None:
+        reads[address.digest] = int(time.time() - days * DAY)
+    fs.access.logged.pop(address.digest, None)
+    with open(str(fs.access.path), 'wb') as fh:
+        fh.write(b''.join(digest + RECORD.pack(when) for digest, when in reads.items()))
+
+
+def test_access_log(fs):
+    log = fs.access
+    address = fs.putstr('read me')
+    assert len(log.pending) == 1  # the ingest
+    fs.gethexdigest(address.hexdigest)  # within the resolution, not logged again
+    assert len(log.pending) == 1
+    log.flush()
+    assert os.path.getsize(str(log.path)) == fs.digestlen + 4
+    assert abs(log.load()[address.digest] - time.time()) < 5
+    assert uHashFS(root=str(fs.root)).access  # enabled by the _access file
+
+    sampled = AccessLog(fs, sample=0.01)
+    for i in range(100):
+        sampled.touch(bytes([i]) * fs.digestlen)
+    assert len(sampled.pending) < 20
+
+    log.resolution = 0  # everything logged is past it
+    log.flush()
+    assert log.logged == {}
+
+
+def test_tier_migrate(fs):
+    hot = fs.putstr('hot')
+    cold = fs.putstr('cold')
+    never_read = fs.putstr('never read')
+    untracked = fs.putstr('stored before the access log')
+    fresh = fs.putstr('just ingested')
+    age(fs, hot, 10)
+    age(fs, cold, 10)
+    age(fs, never_read, 10)
+    age(fs, untracked, None)
+    os.utime(str(untracked.abspath), (time.time() - 10 * DAY,) * 2)
+    fs.gethexdigest(hot.hexdigest)
+    os.link(str(hot.abspath), str(fs.root / 'relinked'))  # resets ctime, not the last read
+    moved = (3, len('cold') + len('never read') + len('stored before the access log'), 0)
+    assert migrate(fs, days=5, dry_run=True) == moved
+    assert fs.existshexdigest(cold.hexdigest) and os.path.exists(str(cold.abspath))
+    assert migrate(fs, days=5) == moved
+    assert os.path.exists(str(fresh.abspath))
+    assert not os.path.exists(str(untracked.abspath))
+    assert not os.path.exists(str(cold.abspath))
+    assert fs.cold.existshexdigest(cold.hexdigest)
+    assert fs.existshexdigest(cold.hexdigest)
+    assert dict(fs.existsmany([cold.hexdigest, hot.hexdigest])) == {cold.hexdigest: True, hot.hexdigest: True}
+    assert fs.gethexdigest(cold.hexdigest).fs is fs.cold
+    with fs.openhexdigest(never_read.hexdigest) as fh:
+        assert fh.read() == b'never read'
+    assert os.path.exists(str(hot.abspath))
+
+    reopened = uHashFS(root=str(fs.root))  # the cold tier is recorded in the root
+    assert reopened.cold.root == fs.cold.root
+    assert reopened.gethexdigest(cold.hexdigest).fs.root == fs.cold.root
+
+    assert migrate(fs, days=5, promote_days=1) == (0, 0, 2)  # both were read since
+    assert os.path.exists(str(never_read.abspath))
+    assert not fs.cold.existshexdigest(never_read.hexdigest)
+
+    assert fs.delete_many([cold.hexdigest, hot.hexdigest]) == [cold.hexdigest, hot.hexdigest]
+    assert not fs.existshexdigest(cold.hexdigest)
+
+
+def test_tier_bookkeeping(tmpdir, make_fs):
+    fs = make_fs('fast', access=True, objects=True, cold_root=str(tmpdir.join('cold')))
+    address = fs.putstr('demote me')
+    age(fs, address, 10)
+    assert fs.objects.get(address.hexdigest)
+    other = AccessLog(fs)  # another process appending while migrate runs
+    other.touch(b'\x01' * fs.digestlen)
+    other.flush()
+    assert migrate(fs, days=5) == (1, len('demote me'), 0)
+    assert fs.objects.get(address.hexdigest) is None  # gone from the fast tier's table
+    assert fs.cold.existshexdigest(address.hexdigest)
+    assert b'\x01' * fs.digestlen in fs.access.load()  # kept by compact()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import pytest
+from uhashfs import uHashFS
+from uhashfs.treehash import TreeHasher
+
+
+@pytest.fixture
+def fs(make_fs):
+    return make_fs(algorithm='blake2b_tree')
+
+
+def reference(data, leaf_size):
+    params = {'fanout': 0, 'depth': 2, 'leaf_size': leaf_size, 'inner_size': 64}
+    chunks = [data[offset:offset + leaf_size] for offset in range(0, len(data), leaf_size)] or [b'']
+    leaves = [hashlib.blake2b(chunk, node_offset=index, node_depth=0, last_node=index == len(chunks) - 1, **params).digest()
+              for index, chunk in enumerate(chunks)]
+    return hashlib.blake2b(b''.join(leaves), node_offset=0, node_depth=1, last_node=True, **params).digest()
+
+
+def test_treehash_matches_reference():
+    data = bytes(range(256)) * 10
+    for size in (0, 1, 16, 17, 100, len(data)):
+        assert TreeHasher('blake2b_tree', data[:size], leaf_size=16).digest() == reference(data[:size], 16)
+    hasher = TreeHasher('blake2b_tree', leaf_size=16)
+    for offset in range(0, len(data), 7):  # update() boundaries don't matter
+        hasher.update(data[offset:offset + 7])
+    assert hasher.digest() == reference(data, 16)
+    hasher.update(b'more')  # digest() does not finish the hasher
+    assert hasher.hexdigest() == reference(data + b'more', 16).hex()
+    assert TreeHasher('blake2b_tree', data).digest() != hashlib.blake2b(data).digest()
+    assert TreeHasher('blake2s_tree').digest_size == 32
+
+
+def test_treehash_root(fs, tmpdir):
+    infile = tmpdir.join('large')
+    data = os.urandom(3 * 1024 * 1024 + 5)
+    infile.write(data, mode='wb')
+    address = fs.putfile(str(infile))
+    assert address.hexdigest == reference(data, 1 << 20).hex()
+    assert address.relative_path.parts[0] == 'blake2b_tree'
+    assert len(address.hexdigest) == 128
+    assert fs.putstr('').hexdigest == fs.emptyhexdigest
+    assert list(fs.check(fs.root)) == []
+    assert uHashFS(root=str(fs.root)).algorithm == 'blake2b_tree'
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import time
+import pytest
+from uhashfs.verify import CorruptObjectError, VerifyingReader, VerificationLog
+
+
+def corrupt(address, data):
+    os.chmod(address.abspath, 0o644)
+    with open(address.abspath, 'wb') as fh:
+        fh.write(data)
+
+
+def test_verifying_reader(make_fs):
+    fs = make_fs(verify=True)
+    address = fs.putstr('x' * 100000)
+    with fs.openhexdigest(address.hexdigest) as fh:
+        assert isinstance(fh, VerifyingReader)
+        data = b''.join(iter(lambda: fh.read(4096), b''))
+        assert fh.verified
+    assert data == b'x' * 100000
+    with fs.openhexdigest(address.hexdigest) as fh:
+        assert len(io.BufferedReader(fh).read()) == 100000
+    corrupt(address, b'y' * 100000)
+    with fs.openhexdigest(address.hexdigest) as fh:
+        fh.read(4096)
+        with pytest.raises(CorruptObjectError):
+            fh.read()
+    with fs.openhexdigest(address.hexdigest, verify=False) as fh:
+        assert fh.read(1) == b'y'
+    empty = fs.putstr('')
+    with fs.openhexdigest(empty.hexdigest) as fh:
+        assert fh.read() == b''
+        assert fh.verified
+
+
+def test_seek_stops_verifying(make_fs):
+    fs = make_fs(verify=True)
+    address = fs.putstr('abcdef')
+    corrupt(address, b'abcdeX')
+    with fs.openhexdigest(address.hexdigest) as fh:
+        fh.seek(3)
+        assert fh.read() == b'deX'
+        assert not fh.verified
+
+
+def test_verify_days(make_fs):
+    fs = make_fs(verify_days=7)
+    address = fs.putstr('data')
+    with fs.openhexdigest(address.hexdigest) as fh:
+        assert isinstance(fh, VerifyingReader)
+        fh.read()
+    fs.verified.flush()
+    reopened = make_fs(verify_days=7)
+    assert reopened.verified.last_verified(address.digest) > time.time() - 60
+    with reopened.openhexdigest(address.hexdigest) as fh:
+        assert not isinstance(fh, VerifyingReader)  # verified recently
+    reopened.verified.record(address.digest, when=time.time() - 8 * 24 * 3600)
+    with reopened.openhexdigest(address.hexdigest) as fh:
+        assert isinstance(fh, VerifyingReader)
+
+
+def test_check_records(make_fs):
+    fs = make_fs(verify_days=1)
+    address = fs.putstr('checked')
+    assert list(fs.check(path=fs.root, quiet=True)) == []
+    assert fs.verified.last_verified(address.digest)
+
+
+def test_log_compaction(make_fs):
+    fs = make_fs()
+    log = VerificationLog(fs, flush_every=2)
+    digest = fs.putstr('a').digest
+    for _ in range(20):
+        log.record(digest)
+    log.flush()
+    assert os.path.getsize(log.path) < 20 * log.record_size
+    assert VerificationLog(fs).last_verified(digest) == log.last_verified(digest)
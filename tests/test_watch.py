@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import os
+from uhashfs.watch import watch
+
+
+def test_watch(fs, tmpdir):
+    drop = tmpdir.mkdir('drop')
+    drop.join('old').write('dropped while down')
+    os.utime(str(drop.join('old')), (0, 0))
+    drop.join('recent').write('maybe still being written')
+    drop.join('.hidden').write('a temp file')
+    events = watch(fs, str(drop), recursive=True, originals='remove', settle=0.2)
+
+    result, action = next(events)  # reconciled on startup
+    assert (os.path.basename(result.path), action) == ('old', 'removed')
+    assert fs.gethexdigest(result.address.hexdigest).abspath.read_text() == 'dropped while down'
+    result, action = next(events)  # once unchanged for settle seconds
+    assert os.path.basename(result.path) == 'recent'
+
+    drop.mkdir('sub').join('new').write('written in place')
+    result, action = next(events)
+    assert result.path == str(drop.join('sub', 'new')) and not result.address.is_duplicate
+    tmpdir.join('elsewhere').write('moved in')
+    os.rename(str(tmpdir.join('elsewhere')), str(drop.join('moved')))
+    result, action = next(events)
+    assert result.path == str(drop.join('moved'))
+    assert sorted(os.listdir(str(drop))) == ['.hidden', 'sub']
+    events.close()
+
+
+def test_watch_link(fs, tmpdir):
+    drop = tmpdir.mkdir('drop')
+    events = watch(fs, str(drop), originals='link', batch_seconds=0.01)
+    drop.join('a').write('same')
+    result, action = next(events)
+    assert action == 'linked'
+    assert os.path.samefile(str(drop.join('a')), str(result.address.abspath))
+    drop.join('b').write('different')  # the link's rename of a is not put again
+    result, action = next(events)
+    assert result.path == str(drop.join('b'))
+    events.close()
@@ -0,0 +1,157 @@
+"""Batched stat and read backends for bulk operations.
+
+Walking, scrubbing and bulk exists checks issue one blocking syscall per
+object, which leaves most of an NVMe device idle. A backend keeps up to
+depth requests in flight and yields results in input order:
+
+    sizes(paths)             -> (path, size or None if missing)
+    exists(paths)            -> (path, bool)
+    hashes(paths, algorithm) -> (path, digest or None if missing)
+
+hashes() takes a pagecache.py cache_mode, so a scrub can leave the page
+cache to the objects being served.
+
+ThreadPoolBackend runs the syscalls on a thread pool (they release the GIL).
+UringBackend submits statx() batches to io_uring with the liburing
+binding; it hashes on the thread pool, since the hashing itself has to
+happen in Python. It is only used when asked for by name: no test of it
+runs without the binding, so 'auto' stays on the thread pool.
+"""
+
+import os
+import stat
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .pagecache import scan_open
+from .uhashfs import hash_readable
+
+BACKENDS = ('auto', 'threads', 'io_uring')
+
+
+def lstat_size(path):
+    try:
+        st = os.lstat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return st.st_size
+
+
+def hash_or_none(path, algorithm, cache_mode='buffered'):
+    try:
+        with scan_open(path, cache_mode) as fh:
+            return hash_readable(fh, algorithm, tmp=None)
+    except FileNotFoundError:
+        return None
+
+
+class ThreadPoolBackend():
+    name = 'threads'
+
+    def __init__(self, depth=64):
+        assert depth > 0
+        self.depth = depth
+        self.pool = None
+
+    def _map(self, function, paths, *args):
+        '''like pool.map() in input order, but with at most depth calls in flight'''
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.depth)
+        in_flight = deque()
+        for path in paths:
+            in_flight.append((path, self.pool.submit(function, path, *args)))
+            if len(in_flight) >= self.depth:
+                path, future = in_flight.popleft()
+                yield path, future.result()
+        while in_flight:
+            path, future = in_flight.popleft()
+            yield path, future.result()
+
+    def sizes(self, paths):
+        return self._map(lstat_size, paths)
+
+    def exists(self, paths):
+        for path, size in self.sizes(paths):
+            yield path, size is not None
+
+    def hashes(self, paths, algorithm, cache_mode='buffered'):
+        return self._map(hash_or_none, paths, algorithm, cache_mode)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+class UringBackend(ThreadPoolBackend):
+    name = 'io_uring'
+
+    def __init__(self, depth=64):
+        import liburing  # deferred, optional
+        super().__init__(depth=depth)
+        self.liburing = liburing
+        self.ring = liburing.Ring()
+        self.cqe = liburing.Cqe()
+        liburing.io_uring_queue_init(depth, self.ring)
+        self.lock = threading.Lock()  # one ring, submitted to from one thread at a time
+
+    def _statx_batch(self, batch):
+        liburing = self.liburing
+        buffers = []
+        for index, path in enumerate(batch):
+            statx = liburing.Statx()
+            buffers.append(statx)
+            sqe = liburing.io_uring_get_sqe(self.ring)
+            liburing.io_uring_prep_statx(sqe, statx, str(path), liburing.AT_SYMLINK_NOFOLLOW)
+            liburing.io_uring_sqe_set_data64(sqe, index)
+        liburing.io_uring_submit(self.ring)
+        sizes = [None] * len(batch)
+        errors = []
+        for _ in batch:
+            liburing.io_uring_wait_cqe(self.ring, self.cqe)
+            entry = self.cqe[0]
+            index = entry.user_data
+            try:
+                entry.res  # raises the errno of a failed statx()
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            except OSError as error:  # raised once the whole batch is reaped
+                errors.append(error)
+            else:
+                if buffers[index].isreg:
+                    sizes[index] = buffers[index].size
+            finally:
+                liburing.io_uring_cqe_seen(self.ring, entry)
+        if errors:
+            raise errors[0]
+        return sizes
+
+    def sizes(self, paths):
+        batch = []
+        for path in paths:
+            batch.append(path)
+            if len(batch) == self.depth:
+                with self.lock:
+                    sizes = self._statx_batch(batch)
+                yield from zip(batch, sizes)
+                batch = []
+        if batch:
+            with self.lock:
+                sizes = self._statx_batch(batch)
+            yield from zip(batch, sizes)
+
+    def close(self):
+        super().close()
+        if self.ring is not None:
+            self.liburing.io_uring_queue_exit(self.ring)
+            self.ring = None
+
+
+def io_backend(name='auto', depth=64):
+    '''auto is the thread pool, io_uring raises ImportError or OSError if the binding or kernel lacks it'''
+    assert name in BACKENDS
+    if name == 'io_uring':
+        return UringBackend(depth=depth)
+    return ThreadPoolBackend(depth=depth)
@@ -0,0 +1,199 @@
+"""Bloom filter over the digests stored in a uHashFS root.
+
+Persisted in the _bloom file in the root and shared between processes with
+mmap, so existshexdigest() answers most misses from memory without building
+a path or stat()ing. Digests are already uniformly distributed, so the k bit
+positions come from the digest itself by double hashing.
+
+    header: b'UHBLOOM1' + <flags> + <k> + <8 byte bit count> + <8 byte capacity> + <8 byte count>
+    bits:   <bit count / 8 bytes>
+
+Bits are set under an flock() before the object is linked into place, so a
+reader never sees an object the filter says is missing. Deleted objects stay
+in the filter (as false positives) until rebuild(). rebuild() swaps in a new
+file flagged BUILDING, during which every lookup answers maybe, and flags the
+old file RETIRED so processes that have it mapped reopen it. A writer that
+added to the old file and links after the rebuild's walk passed its leaf
+adds the digest again with readd_if_retired() once linked.
+"""
+
+import fcntl
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import attr
+from .uhashfs import BLOOM
+
+MAGIC = b'UHBLOOM1'
+HEADER = struct.Struct('>8sBBQQQ')  # magic, flags, k, bits, capacity, count
+HEADER_SIZE = 64  # HEADER.size rounded up, the bits start here
+FLAGS_OFFSET = 8
+COUNT_OFFSET = 8 + 1 + 1 + 8 + 8
+BUILDING = 1  # being filled by rebuild(), lookups answer maybe
+RETIRED = 2  # replaced by a rebuild(), reopen
+DEFAULT_CAPACITY = 1000000
+DEFAULT_ERROR_RATE = 0.01
+
+
+def bloom_size(capacity, error_rate):
+    '''returns (bits, k) for capacity items at error_rate false positives'''
+    bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+    bits = max(64, (bits + 7) // 8 * 8)
+    k = max(1, round(bits / capacity * math.log(2)))
+    return bits, k
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class uHashFSBloom():
+    fs: object
+
+    def __attrs_post_init__(self):
+        self.path = self.fs.root / Path(BLOOM)
+        self.fd = None
+        self.map = None
+        self.lock = threading.Lock()  # flock() does not exclude threads sharing the fd
+        self._open()
+
+    def _open(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        try:
+            fd = os.open(self.path, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        self.map = mmap.mmap(fd, 0)  # the old map is left to other threads still reading it
+        self.fd = fd
+        magic, _, self.k, self.bits, self.capacity, _ = HEADER.unpack_from(self.map)
+        assert magic == MAGIC
+        return True
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def flags(self):
+        return self.map[FLAGS_OFFSET]
+
+    def count(self):
+        return struct.unpack_from('>Q', self.map, COUNT_OFFSET)[0]
+
+    def _positions(self, digest):
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.k)]
+
+    def might_contain(self, digest):
+        '''False only if digest is definitely not stored'''
+        if self.map is None:
+            return True
+        flags = self.map[FLAGS_OFFSET]
+        if flags & RETIRED:
+            with self.lock:
+                if self.map[FLAGS_OFFSET] & RETIRED and not self._open():
+                    return True
+            flags = self.map[FLAGS_OFFSET]
+        if flags & BUILDING:
+            return True
+        bloom_map = self.map
+        for position in self._positions(digest):
+            if not bloom_map[HEADER_SIZE + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def _locked_map(self):
+        '''flock()s the current file, reopening it if a rebuild() retired the mapped one'''
+        while True:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            if not self.map[FLAGS_OFFSET] & RETIRED:
+                return
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self._open()
+
+    def add_many(self, digests):
+        '''returns the map they were added to, for readd_if_retired()'''
+        if self.map is None:
+            return None
+        with self.lock:
+            return self._add_many(digests)
+
+    def _add_many(self, digests):
+        self._locked_map()
+        bloom_map = self.map
+        try:
+            added = 0
+            for digest in digests:
+                new = False
+                for position in self._positions(digest):
+                    offset = HEADER_SIZE + (position >> 3)
+                    bit = 1 << (position & 7)
+                    if not self.map[offset] & bit:
+                        self.map[offset] |= bit
+                        new = True
+                added += new  # duplicates (and false positives) are not counted
+            struct.pack_into('>Q', self.map, COUNT_OFFSET, self.count() + added)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return bloom_map
+
+    def add(self, digest):
+        return self.add_many([digest])
+
+    def readd_if_retired(self, digest, bloom_map):
+        '''adds digest again if a rebuild() retired bloom_map since it was added, call once the object is linked
+
+        the rebuild's walk may have passed the object's leaf before the link
+        '''
+        if bloom_map is not None and (bloom_map.closed or bloom_map[FLAGS_OFFSET] & RETIRED):
+            self.add(digest)
+
+    def _scan_leaf(self, leaf):
+        return [bytes.fromhex(name) for name in os.listdir(leaf) if len(name) == self.fs.hexdigestlen]
+
+    def rebuild(self, capacity=None, error_rate=DEFAULT_ERROR_RATE, workers=None):
+        '''replaces the filter with one sized for capacity (default twice what is stored) and fills it from a walk'''
+        if capacity is None:
+            capacity = max(DEFAULT_CAPACITY, self.count() * 2 if self.map is not None else 0)
+        bits, k = bloom_size(capacity, error_rate)
+        tmp_path = self.path.with_name(BLOOM + '.' + str(os.getpid()))
+        os.makedirs(self.fs.root, exist_ok=True)
+        with open(tmp_path, 'wb') as fh:
+            fh.write(HEADER.pack(MAGIC, BUILDING, k, bits, capacity, 0).ljust(HEADER_SIZE, b'\0'))
+            fh.truncate(HEADER_SIZE + bits // 8)
+        with self.lock:
+            if self.map is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+                os.rename(tmp_path, self.path)
+                self.map[FLAGS_OFFSET] |= RETIRED  # writers from now on add to the new file
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            else:
+                os.rename(tmp_path, self.path)
+            self._open()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for digests in pool.map(self._scan_leaf, self.fs.leaf_folders()):
+                self.add_many(digests)
+        with self.lock:
+            self._locked_map()
+            try:
+                self.map[FLAGS_OFFSET] &= ~BUILDING & 0xff
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        if self.fs.verbose:
+            print("bloom:", self.count(), "digests in", bits, "bits, k", k, file=sys.stderr)
+        return self.count()
+
+    def stats(self):
+        fill = 0
+        if self.map is not None:
+            fill = bin(int.from_bytes(self.map[HEADER_SIZE:], 'big')).count('1') / self.bits
+        return {'capacity': self.capacity, 'count': self.count(), 'bits': self.bits, 'k': self.k,
+                'fill': fill, 'false_positive_rate': fill ** self.k, 'building': bool(self.flags() & BUILDING)}
@@ -0,0 +1,159 @@
+"""Read-through cache tier for hot uHashFS objects.
+
+A second, smaller uHashFS root on fast storage. Objects are hardlinked (same
+filesystem) or copied (with their hash verified) into it on a miss, and the
+least recently used ones are evicted when it grows past max_bytes. Access
+order is kept in a fixed width append-only log in the cache root so it
+survives restarts. Objects never change, so there is nothing to invalidate.
+"""
+
+import atexit
+import io
+import os
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import attr
+from .uhashfs import CACHE_LOG
+from .uhashfs import HashAddress
+from .uhashfs import ROOT_DESCRIPTOR
+from .uhashfs import uHashFS
+
+RECORD = struct.Struct('>q')  # object size, -1 when evicted, follows the digest
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class uHashFSCache():
+    origin: object
+    root: str = attr.ib(converter=Path)
+    max_bytes: int
+    flush_every: int = 1024  # accesses buffered before appending them to the log
+    verbose: bool = False
+
+    def __attrs_post_init__(self):
+        assert self.max_bytes > 0
+        layout = {'width': self.origin.width, 'depth': self.origin.depth}
+        if os.path.exists(self.root / Path(ROOT_DESCRIPTOR)):
+            layout = {}  # keeps its own layout if the origin is resharded
+        self.fs = uHashFS(root=self.root,
+                          algorithm=self.origin.algorithm,
+                          **layout,
+                          fmode=self.origin.fmode,
+                          dmode=self.origin.dmode,
+                          verbose=self.verbose)
+        self.log_path = self.fs.root / Path(CACHE_LOG)
+        self.record_size = self.fs.digestlen + RECORD.size
+        self.lru = OrderedDict()  # digest -> size, oldest first
+        self.bytes = 0
+        self.pending = []
+        self.log_records = 0
+        self.lock = threading.RLock()
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        try:
+            with open(self.log_path, 'rb') as fh:
+                log = fh.read()
+        except FileNotFoundError:
+            return
+        for offset in range(0, len(log) - self.record_size + 1, self.record_size):
+            digest = log[offset:offset + self.fs.digestlen]
+            size, = RECORD.unpack_from(log, offset + self.fs.digestlen)
+            self._track(digest, size)
+        self.log_records = len(log) // self.record_size
+        if self.verbose:
+            print("cache:", self.fs.root, len(self.lru), "objects", self.bytes, "bytes", file=sys.stderr)
+
+    def _track(self, digest, size):
+        if size < 0:
+            self.bytes -= self.lru.pop(digest, 0)
+        elif digest in self.lru:
+            self.lru.move_to_end(digest)
+        else:
+            self.lru[digest] = size
+            self.bytes += size
+
+    def _record(self, digest, size):
+        with self.lock:
+            self._track(digest, size)
+            self.pending.append(digest + RECORD.pack(size))
+            if len(self.pending) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            os.makedirs(self.fs.root, exist_ok=True)
+            with open(self.log_path, 'ab') as fh:
+                fh.write(b''.join(self.pending))
+            self.log_records += len(self.pending)
+            self.pending = []
+            if self.log_records > (len(self.lru) * 4) + self.flush_every:
+                self._compact()
+
+    def _compact(self):
+        tmp_path = self.log_path.with_name(CACHE_LOG + '.' + str(os.getpid()))
+        with open(tmp_path, 'wb') as fh:
+            fh.write(b''.join(digest + RECORD.pack(size) for digest, size in self.lru.items()))
+        os.rename(tmp_path, self.log_path)
+        self.log_records = len(self.lru)
+
+    def _evict(self, keep):
+        with self.lock:
+            while self.bytes > self.max_bytes and len(self.lru) > 1:
+                digest, size = next(iter(self.lru.items()))
+                if digest == keep:
+                    self.lru.move_to_end(digest)
+                    continue
+                if digest != self.fs.emptydigest:
+                    try:
+                        os.unlink(self.fs.digestpath(digest))
+                    except FileNotFoundError:  # another process evicted it
+                        pass
+                if self.verbose:
+                    print("cache evict:", digest.hex(), size, file=sys.stderr)
+                self._record(digest, -1)
+
+    def populate(self, hexdigest):
+        '''copies (or hardlinks) hexdigest from the origin into the cache, returns its path'''
+        address = self.fs.putfrom(self.origin, hexdigest, verify=True)
+        self._record(address.digest, os.lstat(address.abspath).st_size)
+        if self.verbose:
+            print("cache populate:", hexdigest, file=sys.stderr)
+        self._evict(keep=address.digest)
+        self.flush()  # so populated objects are always in the log
+        return address.abspath
+
+    def open(self, hexdigest, mode='rb'):
+        path = self.fs.hexdigestpath(hexdigest)
+        try:
+            fh = io.open(path, mode)
+        except FileNotFoundError:
+            fh = io.open(self.populate(hexdigest), mode)
+        else:
+            self._record(bytes.fromhex(hexdigest), os.fstat(fh.fileno()).st_size)
+        return fh
+
+    def get(self, hexdigest):
+        path = self.fs.hexdigestpath(hexdigest)
+        try:
+            size = os.lstat(path).st_size
+        except FileNotFoundError:
+            path = self.populate(hexdigest)
+        else:
+            self._record(bytes.fromhex(hexdigest), size)
+        return HashAddress(bytes.fromhex(hexdigest), self.fs, path)
+
+    def discard(self, hexdigest):
+        digest = bytes.fromhex(hexdigest)
+        try:
+            os.unlink(self.fs.hexdigestpath(hexdigest))
+        except FileNotFoundError:
+            pass
+        with self.lock:
+            if digest in self.lru:
+                self._record(digest, -1)
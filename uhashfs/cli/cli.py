@@ -8,11 +8,11 @@ from pathlib import Path
 import click
 from uhashfs import uHashFS
 from uhashfs import uHashFSMetadata
-from uhashfs import Path_Iterator
-from uhashfs import really_is_file
-from uhashfs import really_is_dir
+from uhashfs.uhashfs import FEDERATION
+from uhashfs.uhashfs import TREE_ALGORITHMS
+from uhashfs.pagecache import CACHE_MODES
 
-ALGS = list(hashlib.algorithms_available)
+ALGS = list(hashlib.algorithms_available) + list(TREE_ALGORITHMS)
 ALGS.sort()
 
 
@@ -29,10 +29,23 @@ ALGS.sort()
 @click.option('--disable-redis', is_flag=True)
 @click.option('--verbose', is_flag=True)
 @click.option('--legacy', is_flag=True)
+@click.option('--index', is_flag=True, help="maintain the sqlite index of --metaroot records")
+@click.option('--cache-root', type=click.Path(file_okay=False, resolve_path=True), help="uhashfs root on fast storage to read through")
+@click.option('--cache-bytes', type=int, help="LRU size budget of --cache-root")
+@click.option('--verify', is_flag=True, help="hash objects as they are read and fail on a mismatch")
+@click.option('--verify-days', type=float, help="only verify objects not verified within this many days")
+@click.option('--objects', is_flag=True, help="record size, times and content type of new objects in the root's _objects table")
+@click.option('--bloom', is_flag=True, help="answer definite misses from the root's _bloom filter, building it if needed")
+@click.option('--access', is_flag=True, help="log reads to the root's _access log, for tier")
+@click.option('--access-sample', type=click.FloatRange(0, 1, min_open=True), help="fraction of reads the access log looks at")
+@click.option('--cold-root', type=click.Path(file_okay=False, resolve_path=True), help="uhashfs root on slower storage for tier, recorded in the root")
+@click.option('--io-backend', type=click.Choice(['auto', 'threads', 'io_uring']), help="for bulk stat and reads, auto is threads, io_uring needs liburing")
+@click.option('--io-depth', type=int, help="bulk requests kept in flight")
 @click.pass_context
 def cli(ctx, **kwargs):
     settings = {}
     meta_settings = {}
+    data_settings = {}
     for name, value in kwargs.items():
         #print(name, value)
         if name == 'disable_redis':
@@ -41,8 +54,10 @@ def cli(ctx, **kwargs):
             else:  # disable it
                 settings['redis'] = False
         elif value:
-            if name == "metaroot":
+            if name in ("metaroot", "index"):
                 meta_settings[name] = value
+            elif name in ("cache_root", "cache_bytes", "verify", "verify_days", "objects", "bloom", "access", "access_sample", "cold_root"):
+                data_settings[name] = value
             else:
                 settings[name] = value
     settings['root'] = Path(settings['root'])
@@ -50,12 +65,28 @@ def cli(ctx, **kwargs):
     #settings['tmproot'] = tmproot
     if 'verbose' not in settings.keys():
         settings['verbose'] = False
-    data_fs = uHashFS(**settings)
+    if (settings['root'] / Path(FEDERATION)).exists():
+        from uhashfs.federation import uHashFSFederation
+        if meta_settings:
+            print("a federation does not support --metaroot", file=sys.stderr)
+            quit(1)
+        layout = {name: settings.pop(name) for name in ('root', 'algorithm', 'width', 'depth', 'verbose') if name in settings}
+        try:
+            ctx.obj = uHashFSFederation(member_settings=dict(settings, **data_settings), **layout)
+        except ValueError as e:  # a root created with other settings
+            print(e, file=sys.stderr)
+            quit(1)
+        return
+    try:
+        data_fs = uHashFS(**settings, **data_settings)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        quit(1)
     if 'metaroot' in meta_settings.keys():
         settings['uhashfs'] = data_fs
         settings['root'] = Path(meta_settings['metaroot'])
         #meta_fs = uHashFSMetadata(root=meta_settings['metaroot'], uhashfs=data_fs, verbose=settings['verbose'])
-        meta_fs = uHashFSMetadata(**settings)
+        meta_fs = uHashFSMetadata(index=meta_settings.get('index', False), **settings)
         ctx.obj = meta_fs
     else:
         ctx.obj = data_fs
@@ -63,35 +94,78 @@ def cli(ctx, **kwargs):
         print(ctx.obj, file=sys.stderr)
 
 
+def read_nul_separated(readable, chunk_size=1 << 16):
+    '''yields the NUL separated paths on readable, as find -print0 writes them'''
+    rest = b''
+    for chunk in iter(lambda: readable.read(chunk_size), b''):
+        *paths, rest = (rest + chunk).split(b'\0')
+        yield from (os.fsdecode(path) for path in paths if path)
+    if rest:
+        yield os.fsdecode(rest)
+
+
+def print_ingested(result, json_lines, **extra):
+    '''prints an IngestResult as put and watch do, extra goes in the JSON object'''
+    import json
+    if json_lines:
+        record = {'path': result.path}
+        if result.error:
+            record['error'] = str(result.error)
+        else:
+            record.update(hexdigest=result.address.hexdigest, size=result.size, duplicate=result.address.is_duplicate, **extra)
+        print(json.dumps(record), flush=True)
+    elif result.error:
+        print("error:", result.error, file=sys.stderr)
+    else:
+        print(result.address.hexdigest, result.path, flush=True)
+
+
+def require_uhashfs(obj, command):
+    '''quits unless obj is a uHashFS root, not a federation or --metaroot'''
+    if isinstance(obj, uHashFS):
+        return
+    if isinstance(obj, uHashFSMetadata):
+        print(command, "does not support --metaroot", file=sys.stderr)
+    else:
+        print(command, "does not support a federation, run it on each member root", file=sys.stderr)
+    quit(1)
+
+
 @cli.command()
 @click.argument("infiles", type=click.Path(exists=True), nargs=-1)
-@click.option('--recursive', is_flag=True)
-@click.pass_obj
-def put(obj, infiles, recursive):
-    for infile in infiles:
-        path_iter = Path_Iterator(infile).go()
-        for infile in infiles:
-            print("infile:", infile)
-            if recursive:
-                for item in path_iter(infile):
-                    print(item.absolute)  # yep. that's ugly. you cant just print Path objects
-                    if really_is_file(item):
-                        newitem = obj.putfile(item)
-                    else:
-                        print("notafile item:", bytes(item))
-                        print("notafile item:", item.absolute)  # deliberate, dont "fix"
-                        try:
-                            assert really_is_dir(item)
-                        except AssertionError:
-                            try:
-                                item.is_symlink()
-                            except OSError as e:
-                                assert '[Errno 40] Too many levels of symbolic links:' in e.strerror
-            else:
-                print("else:", infile)
-                newitem = obj.putfile(infile)
-
-            print(newitem.hexdigest, infile)
+@click.option('--recursive', is_flag=True, help="put every regular file under directories, symlinks in them are skipped")
+@click.option('--stdin', is_flag=True, help="read NUL separated paths from stdin, as find -print0 writes them")
+@click.option('--workers', type=int, help="hashing threads, default the cpu count")
+@click.option('--json', 'json_lines', is_flag=True, help="print a JSON object per file instead of the hexdigest and path")
+@click.option('--no-progress', is_flag=True, help="progress is shown when stderr is a terminal")
+@click.pass_obj
+def put(obj, infiles, recursive, stdin, workers, json_lines, no_progress):
+    import time
+    from itertools import chain
+    from uhashfs.ingest import ingest, IngestSummary
+    if isinstance(obj, uHashFSMetadata):
+        print("put does not support --metaroot", file=sys.stderr)
+        quit(1)
+    paths = infiles
+    if stdin:
+        paths = chain(infiles, read_nul_separated(sys.stdin.buffer))
+    progress = not no_progress and sys.stderr.isatty()
+    summary = IngestSummary()
+    started = shown = time.monotonic()
+    for result in ingest(obj, paths, recursive=recursive, workers=workers):
+        summary.add(result)
+        print_ingested(result, json_lines)
+        if progress and time.monotonic() - shown > 0.5:
+            shown = time.monotonic()
+            total_bytes = summary.new_bytes + summary.duplicate_bytes
+            print(humanize.intcomma(summary.new + summary.duplicate), "files",
+                  humanize.naturalsize(total_bytes), humanize.naturalsize(total_bytes / (shown - started)) + "/s",
+                  end='\r', file=sys.stderr, flush=True)
+    print("new:", humanize.intcomma(summary.new), humanize.naturalsize(summary.new_bytes),
+          "duplicate:", humanize.intcomma(summary.duplicate), humanize.naturalsize(summary.duplicate_bytes),
+          "errors:", humanize.intcomma(summary.errors), file=sys.stderr)
+    if summary.errors:
+        quit(1)
 
 
 @cli.command()
@@ -105,14 +179,17 @@ def get(obj, digests):
 
 @cli.command()
 @click.argument("digests", type=str, nargs=-1)
+@click.option('--stdin', is_flag=True, help="read digests from stdin, one per line")
 @click.pass_obj
-def delete(obj, digests):
+def delete(obj, digests, stdin):
+    if isinstance(obj, uHashFSMetadata):
+        print("delete does not support --metaroot", file=sys.stderr)
+        quit(1)
+    if stdin:
+        digests = [line.strip() for line in sys.stdin if line.strip()]
+    deleted = set(obj.delete_many(digests))
     for digest in digests:
-        try:
-            ans = obj.delete(digest)
-        except FileNotFoundError:
-            ans = False
-        print("delete:", digest + ':', ans)
+        print("delete:", digest + ':', digest in deleted)
 
 
 @cli.command()
@@ -127,6 +204,7 @@ def iterate(obj):
 @click.option('--verbose', is_flag=True)
 @click.pass_obj
 def estimate_edge_properites(obj, variance, verbose):
+    require_uhashfs(obj, "estimate-edge-properites")
     if verbose:
         obj.verbose = True
     objects, size = obj.estimate_edge_properites(variance)
@@ -138,6 +216,7 @@ def estimate_edge_properites(obj, variance, verbose):
 @click.option('--verbose', is_flag=True)
 @click.pass_obj
 def estimate_tree_properites(obj, variance, verbose):
+    require_uhashfs(obj, "estimate-tree-properites")
     if verbose:
         obj.verbose = True
     objects, size = obj.estimate_tree_properites(variance)
@@ -157,8 +236,9 @@ def ipython(obj):
 @click.option('--dont-skip-cached', is_flag=True)
 @click.option('--quiet', is_flag=True)
 @click.option('--verbose', is_flag=True)
+@click.option('--cache-mode', type=click.Choice(CACHE_MODES), default='buffered', help="fadvise or direct to keep objects read from evicting the page cache")
 @click.pass_obj
-def check(obj, alt_root, delete_empty, dont_skip_cached, quiet, verbose):
+def check(obj, alt_root, delete_empty, dont_skip_cached, quiet, verbose, cache_mode):
     if verbose:
         obj.verbose = True
     if alt_root:
@@ -169,7 +249,7 @@ def check(obj, alt_root, delete_empty, dont_skip_cached, quiet, verbose):
     skip_cached = not dont_skip_cached
     if not skip_cached:
         print("Warning: not skipping hashes already cached in redis.", file=sys.stderr)
-    for path, expected_hash in obj.check(path=path, skip_cached=skip_cached, quiet=quiet):
+    for path, expected_hash in obj.check(path=path, skip_cached=skip_cached, quiet=quiet, cache_mode=cache_mode):
         path_size = os.stat(path).st_size
         print("bad:", path, path_size, end='')
         if expected_hash.hexdigest == expected_hash.fs.emptyhexdigest:
@@ -181,5 +261,400 @@ def check(obj, alt_root, delete_empty, dont_skip_cached, quiet, verbose):
             print()
 
 
+@cli.command()
+@click.option('--delete', is_flag=True)
+@click.option('--min-age', type=int, default=3600, help="seconds, skip objects written more recently than this")
+@click.option('--processes', type=int)
+@click.pass_obj
+def gc(obj, delete, min_age, processes):
+    import time
+    from uhashfs.garbage import mark  # numpy is slow to import
+    from uhashfs.garbage import sweep
+    if not isinstance(obj, uHashFSMetadata):
+        print("gc requires --metaroot", file=sys.stderr)
+        quit(1)
+    started = time.time()
+    marked, counts = mark(obj, processes=processes)
+    print("referenced:", humanize.intcomma(len(marked)), "links:", humanize.intcomma(int(counts.sum())), file=sys.stderr)
+    unreferenced = 0
+    unreferenced_bytes = 0
+    for address in sweep(obj.uhashfs, marked, min_age=min_age, delete=delete,
+                         metafs=obj, since=started, processes=processes):
+        unreferenced += 1
+        if not delete:
+            unreferenced_bytes += os.stat(address.abspath).st_size
+        if delete:
+            print(address.hexdigest, "(rm)")
+        else:
+            print(address.hexdigest)
+    if delete:
+        print("deleted:", humanize.intcomma(unreferenced), file=sys.stderr)
+    else:
+        print("unreferenced:", humanize.intcomma(unreferenced), humanize.naturalsize(unreferenced_bytes), file=sys.stderr)
+
+
+@cli.command()
+@click.option('--socket', 'socket_path', type=click.Path(dir_okay=False), required=True)
+@click.option('--putfile-root', 'putfile_roots', multiple=True, type=click.Path(file_okay=False, exists=True, resolve_path=True),
+              help="allow PUTFILE requests for files below this folder, the server reads them with its own privileges")
+@click.pass_obj
+def serve(obj, socket_path, putfile_roots):
+    from uhashfs.server import serve as serve_socket
+    require_uhashfs(obj, "serve")
+    serve_socket(obj, socket_path, putfile_roots=putfile_roots)
+
+
+@cli.command()
+@click.argument("destination", type=click.Path(file_okay=False, resolve_path=True), nargs=1)
+@click.option('--workers', type=int)
+@click.option('--no-link', is_flag=True, help="always copy, even on the same filesystem")
+@click.option('--no-verify', is_flag=True, help="do not hash copied objects")
+@click.option('--state', type=click.Path(dir_okay=False), help="file recording finished leaves, to resume")
+@click.option('--cache-mode', type=click.Choice(CACHE_MODES), default='buffered', help="how copied objects are read")
+@click.pass_obj
+def sync(obj, destination, workers, no_link, no_verify, state, cache_mode):
+    from uhashfs.sync import sync as sync_roots
+    require_uhashfs(obj, "sync")
+    dst = uHashFS(root=destination, algorithm=obj.algorithm, width=obj.width, depth=obj.depth,
+                  fmode=obj.fmode, dmode=obj.dmode, verbose=obj.verbose)
+    transferred = 0
+    transferred_bytes = 0
+    for result in sync_roots(obj, dst, workers=workers, link=not no_link, verify=not no_verify, state_file=state,
+                             cache_mode=cache_mode):
+        transferred += result.transferred
+        transferred_bytes += result.transferred_bytes
+        print(result.leaf, result.transferred, end='\r', file=sys.stderr, flush=True)
+    print("transferred:", humanize.intcomma(transferred), humanize.naturalsize(transferred_bytes), file=sys.stderr)
+
+
+@cli.command()
+@click.option('--rebuild', is_flag=True, help="recompute every summary instead of just the changed shards")
+@click.option('--compare', type=click.Path(file_okay=False, exists=True, resolve_path=True), help="print the leaves that differ from this root")
+@click.pass_obj
+def merkle(obj, rebuild, compare):
+    from uhashfs.merkle import uHashFSMerkle
+    require_uhashfs(obj, "merkle")
+    if not obj.merkle:
+        obj.merkle = uHashFSMerkle(fs=obj)
+    summary = obj.merkle.update(rebuild=rebuild)
+    print(summary.hex() if summary else None)
+    if compare:
+        other = uHashFS(root=compare, merkle=True, verbose=obj.verbose)
+        other.merkle.update()
+        for leaf in obj.merkle.diverging(other.merkle):
+            print(leaf)
+
+
+@cli.command()
+@click.argument("digests", type=str, nargs=-1)
+@click.option('--output', type=click.File('wb'), default='-')
+@click.option('--stdin', is_flag=True, help="read digests from stdin, one per line")
+@click.option('--cache-mode', type=click.Choice(CACHE_MODES), default='buffered', help="how exported objects are read")
+@click.pass_obj
+def export(obj, digests, output, stdin, cache_mode):
+    from uhashfs.stream import export_stream
+    require_uhashfs(obj, "export")
+    if stdin:
+        digests = (line.strip() for line in sys.stdin if line.strip())
+    elif not digests:
+        digests = None  # everything
+    count, size = export_stream(obj, output, hexdigests=digests, cache_mode=cache_mode)
+    print("exported:", humanize.intcomma(count), humanize.naturalsize(size), file=sys.stderr)
+
+
+@cli.command(name='import')
+@click.option('--input', 'infile', type=click.File('rb'), default='-')
+@click.option('--workers', type=int)
+@click.option('--no-verify', is_flag=True)
+@click.pass_obj
+def import_(obj, infile, workers, no_verify):
+    from uhashfs.stream import import_stream
+    require_uhashfs(obj, "import")
+    count = 0
+    for address in import_stream(obj, infile, workers=workers, verify=not no_verify):
+        count += 1
+        if obj.verbose:
+            print(address.hexdigest, file=sys.stderr)
+    print("imported:", humanize.intcomma(count), file=sys.stderr)
+
+
+@cli.command()
+@click.option('--width', type=click.IntRange(1, 3), help="required unless --finish")
+@click.option('--depth', type=click.IntRange(1, 6), help="required unless --finish")
+@click.option('--workers', type=int)
+@click.option('--no-cutover', is_flag=True, help="only link the new layout, run again to resume or cut over")
+@click.option('--no-finish', is_flag=True, help="keep the old layout around as a read fallback")
+@click.option('--finish', 'finish_only', is_flag=True, help="finish an earlier --no-finish reshard")
+@click.pass_obj
+def reshard(obj, width, depth, workers, no_cutover, no_finish, finish_only):
+    from uhashfs.reshard import reshard as reshard_root
+    from uhashfs.reshard import finish
+    require_uhashfs(obj, "reshard")
+    if finish_only:
+        if not obj.previous_layout:
+            print("reshard --finish: no reshard to finish in", obj.root, file=sys.stderr)
+            quit(1)
+        linked = finish(obj, workers=workers)
+    else:
+        if width is None or depth is None:
+            print("reshard requires --width and --depth", file=sys.stderr)
+            quit(1)
+        linked = reshard_root(obj, width, depth, workers=workers, do_cutover=not no_cutover, do_finish=not no_finish)
+    print("linked:", humanize.intcomma(linked), "width:", obj.width, "depth:", obj.depth, file=sys.stderr)
+
+
+@cli.command()
+@click.option('--sample', type=int, help="scan this many random leaves instead of all of them")
+@click.option('--no-sizes', is_flag=True, help="count entries only, skip the per object stat()")
+@click.option('--workers', type=int)
+@click.option('--target', type=int, help="recommend a width/depth for this many objects")
+@click.option('--max-leaf-entries', type=int, help="instead of benchmarking the filesystem")
+@click.option('--drop-caches', is_flag=True, help="benchmark cold lookups, drops the machine's dentry and inode caches before each (root only)")
+@click.option('--lookups', type=int, help="per directory size, default 2000 warm or 100 with --drop-caches")
+@click.pass_obj
+def analyze(obj, sample, no_sizes, workers, target, max_leaf_entries, drop_caches, lookups):
+    from uhashfs.layout import analyze as analyze_layout
+    from uhashfs.layout import benchmark, knee, recommend
+    require_uhashfs(obj, "analyze")
+    report = analyze_layout(obj, sample=sample, sizes=not no_sizes, workers=workers)
+    print("layout:", "width", report.width, "depth", report.depth, "leaves", humanize.intcomma(report.edge_count))
+    print("scanned:", humanize.intcomma(report.leaves_scanned), "leaves,", humanize.intcomma(report.leaves_found), "exist")
+    print("objects:", humanize.intcomma(report.objects), humanize.naturalsize(report.bytes), "estimate:", humanize.intcomma(report.objects_estimate))
+    print("entries per leaf:", "p50", report.p50, "p99", report.p99, "max", report.max)
+    print("inodes:", humanize.intcomma(report.inodes_used), "used", humanize.intcomma(report.inodes_free), "free")
+    for bucket, count in report.size_histogram.items():
+        print("  <=", humanize.naturalsize(bucket, binary=True), humanize.intcomma(count))
+    if target is None:
+        return
+    if not max_leaf_entries:
+        tmproot = obj.root / Path(obj.tmp)  # same filesystem as the objects
+        os.makedirs(tmproot, exist_ok=True)
+        try:
+            results = benchmark(tmproot, lookups=lookups or (100 if drop_caches else 2000), drop_caches=drop_caches)
+        except OSError as e:  # not root, or /proc/sys read-only in a container
+            print("--drop-caches needs root:", e, file=sys.stderr)
+            quit(1)
+        for size, seconds in results.items():
+            print("lookup:", humanize.intcomma(size), "entries", round(seconds * 1e6, 2), "us", "cold" if drop_caches else "warm")
+        if not drop_caches:
+            print("Warning: lookups were timed with the directories cached, a root larger than memory is slower. Time them cold with --drop-caches.", file=sys.stderr)
+        max_leaf_entries = knee(results)
+    width, depth = recommend(target, max_leaf_entries, max_width=obj.max_width, max_depth=obj.max_depth)
+    print("recommended:", "width", width, "depth", depth, "(at most", humanize.intcomma(max_leaf_entries), "entries per leaf)")
+
+
+@cli.command()
+@click.argument("digests", type=str, nargs=-1)
+@click.option('--stdin', is_flag=True, help="read digests from stdin, one per line")
+@click.option('--present', is_flag=True, help="print the digests that exist instead of the missing ones")
+@click.pass_obj
+def exists(obj, digests, stdin, present):
+    if isinstance(obj, uHashFSMetadata):
+        print("exists does not support --metaroot", file=sys.stderr)
+        quit(1)
+    if stdin:
+        digests = (line.strip() for line in sys.stdin if line.strip())
+    missing = 0
+    for hexdigest, found in obj.existsmany(digests):
+        if not found:
+            missing += 1
+        if found == present:
+            print(hexdigest)
+    if missing:
+        quit(1)
+
+
+@cli.command()
+@click.option('--rebuild', is_flag=True, help="add objects missing from the table by walking the root")
+@click.option('--compact', is_flag=True, help="rewrite the table without deleted and superseded records")
+@click.option('--total', is_flag=True, help="print only the object count and size")
+@click.option('--workers', type=int)
+@click.pass_obj
+def objects(obj, rebuild, compact, total, workers):
+    from uhashfs.objects import uHashFSObjects
+    require_uhashfs(obj, "objects")
+    if not obj.objects:
+        if not rebuild:
+            print("no objects table, create it with --rebuild", file=sys.stderr)
+            quit(1)
+        obj.objects = uHashFSObjects(fs=obj)
+    if rebuild:
+        added, dropped = obj.objects.rebuild(workers=workers)
+        print("added:", humanize.intcomma(added), "dropped:", humanize.intcomma(dropped), file=sys.stderr)
+    elif compact:
+        obj.objects.compact()
+    if total:
+        count, size = obj.objects.totals()
+        print(humanize.intcomma(count), humanize.naturalsize(size))
+        return
+    for hexdigest, info in obj.objects.items():
+        print(hexdigest, info.size, info.ingest_time, info.mtime, info.content_type)
+
+
+@cli.command(name='list')
+@click.option('--prefix', type=str, default='')
+@click.option('--start-after', type=str, default='', help="a cursor printed by a previous page")
+@click.option('--limit', type=int, help="print a page of this many and the cursor of the next one")
+@click.option('--sizes', is_flag=True, help="from the objects table when the root has one")
+@click.pass_obj
+def list_(obj, prefix, start_after, limit, sizes):
+    if limit:
+        hexdigests, cursor = obj.list_hexdigests(prefix=prefix, start_after=start_after, limit=limit)
+    else:
+        hexdigests, cursor = obj.sorted_hexdigests(prefix=prefix, start_after=start_after), None
+    for hexdigest in hexdigests:
+        if not sizes:
+            print(hexdigest)
+            continue
+        info = None
+        if getattr(obj, 'objects', None):
+            info = obj.objects.get(hexdigest)
+        if info:
+            print(hexdigest, info.size)
+        else:
+            print(hexdigest, os.lstat(obj.hexdigestpath(hexdigest)).st_size)
+    if cursor:
+        print("next:", cursor, file=sys.stderr)
+
+
+@cli.command()
+@click.option('--rebuild', is_flag=True, help="resize and refill the filter from a walk, drops deleted digests")
+@click.option('--capacity', type=int, help="digests to size the rebuilt filter for, default twice the current count")
+@click.option('--error-rate', type=click.FloatRange(0, 1, min_open=True, max_open=True), default=0.01)
+@click.option('--workers', type=int)
+@click.pass_obj
+def bloom(obj, rebuild, capacity, error_rate, workers):
+    from uhashfs.bloom import uHashFSBloom
+    require_uhashfs(obj, "bloom")
+    if not obj.bloom:
+        obj.bloom = uHashFSBloom(fs=obj)
+        rebuild = True
+    if rebuild:
+        obj.bloom.rebuild(capacity=capacity, error_rate=error_rate, workers=workers)
+    for name, value in obj.bloom.stats().items():
+        print(name + ':', value)
+
+
+@cli.command()
+@click.option('--member', 'members', multiple=True, required=True, help="START=ROOT, a member root owning digests from START up to the next START, the first is 0")
+@click.option('--workers', type=int)
+@click.pass_obj
+def federate(obj, members, workers):
+    '''creates a federation in ROOT, or rebalances it to the given members'''
+    from uhashfs.federation import uHashFSFederation
+    if isinstance(obj, uHashFSMetadata):
+        print("federate does not support --metaroot", file=sys.stderr)
+        quit(1)
+    try:
+        members = dict(member.split('=', 1) for member in members)
+    except ValueError:
+        print("--member takes START=ROOT", file=sys.stderr)
+        quit(1)
+    try:
+        if isinstance(obj, uHashFSFederation):
+            moved = obj.rebalance(members, workers=workers)
+            print("moved:", humanize.intcomma(moved), file=sys.stderr)
+        else:
+            obj = uHashFSFederation(root=obj.root, members=members, algorithm=obj.algorithm, width=obj.width, depth=obj.depth, verbose=obj.verbose)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        quit(1)
+    for start, root in obj.members.items():
+        print(start, root)
+
+
+@cli.command()
+@click.option('--days', type=float, required=True, help="move objects not read within this many days to the cold tier")
+@click.option('--promote-days', type=float, help="and move objects read in the cold tier within this many days back")
+@click.option('--workers', type=int)
+@click.option('--dry-run', is_flag=True, help="only count what would move")
+@click.pass_obj
+def tier(obj, days, promote_days, workers, dry_run):
+    from uhashfs.tier import migrate
+    require_uhashfs(obj, "tier")
+    if not obj.cold:
+        print("no cold tier, set one with --cold-root", file=sys.stderr)
+        quit(1)
+    if promote_days is not None and promote_days > days:
+        print("--promote-days can not be more than --days", file=sys.stderr)
+        quit(1)
+    if not obj.access:
+        print("Warning: no _access log, objects are judged by their mtime. Enable it with --access.", file=sys.stderr)
+    demoted, demoted_bytes, promoted = migrate(obj, days, promote_days=promote_days, workers=workers, dry_run=dry_run)
+    print("cold:", humanize.intcomma(demoted), humanize.naturalsize(demoted_bytes), "hot:", humanize.intcomma(promoted))
+
+
+@cli.command()
+@click.argument("folder", type=click.Path(file_okay=False, exists=True, resolve_path=True))
+@click.option('--recursive', is_flag=True, help="also watch the folders under folder")
+@click.option('--originals', type=click.Choice(['keep', 'remove', 'link']), default='keep', help="once stored, keep, delete, or replace originals with hardlinks to the objects")
+@click.option('--workers', type=int, help="hashing threads, default the cpu count")
+@click.option('--settle', type=float, default=1.0, help="seconds files found on startup must be unchanged for before they are put")
+@click.option('--json', 'json_lines', is_flag=True, help="print a JSON object per file instead of the hexdigest and path")
+@click.pass_obj
+def watch(obj, folder, recursive, originals, workers, settle, json_lines):
+    from uhashfs.ingest import IngestSummary
+    from uhashfs.watch import watch as watch_folder
+    if isinstance(obj, uHashFSMetadata):
+        print("watch does not support --metaroot", file=sys.stderr)
+        quit(1)
+    summary = IngestSummary()
+    try:
+        for result, action in watch_folder(obj, folder, recursive=recursive, originals=originals, workers=workers, settle=settle):
+            summary.add(result)
+            print_ingested(result, json_lines, original=action or 'kept')
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print("watch:", e, file=sys.stderr)
+        quit(1)
+    print("new:", humanize.intcomma(summary.new), humanize.naturalsize(summary.new_bytes),
+          "duplicate:", humanize.intcomma(summary.duplicate), humanize.naturalsize(summary.duplicate_bytes),
+          "errors:", humanize.intcomma(summary.errors), file=sys.stderr)
+
+
+def require_index(obj):
+    if not isinstance(obj, uHashFSMetadata) or not obj.index:
+        print("this command requires --metaroot and --index", file=sys.stderr)
+        quit(1)
+
+
+@cli.command()
+@click.pass_obj
+def rebuild_index(obj):
+    require_index(obj)
+    count = obj.index.rebuild(obj)
+    print("indexed:", humanize.intcomma(count), file=sys.stderr)
+
+
+@cli.command()
+@click.option('--to', 'to_hexdigest', type=str, help="records linking to this digest")
+@click.option('--about', 'about_hexdigest', type=str, help="records about this digest")
+@click.option('--source', type=str, help="records from this data source")
+@click.option('--start', type=float, help="timestamp >= start")
+@click.option('--end', type=float, help="timestamp < end")
+@click.option('--latest', is_flag=True, help="print the latest archive of --about")
+@click.pass_obj
+def lookup(obj, to_hexdigest, about_hexdigest, source, start, end, latest):
+    require_index(obj)
+    if latest and not about_hexdigest:
+        print("lookup --latest requires --about", file=sys.stderr)
+        quit(1)
+    if latest:
+        print(obj.index.latest(bytes.fromhex(about_hexdigest)))
+        return
+    if to_hexdigest:
+        records = obj.index.about(bytes.fromhex(to_hexdigest))
+    elif about_hexdigest:
+        records = obj.index.records(bytes.fromhex(about_hexdigest))
+    elif source:
+        records = obj.index.source(source, start=start, end=end)
+    else:
+        records = obj.index.timerange(start if start is not None else float('-inf'),
+                                      end if end is not None else float('inf'))
+    for record in records:
+        print(*record)
+
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,427 @@
+"""Federate several uHashFS roots, one per device, by digest prefix.
+
+The _federation descriptor in the federation's own folder lists the member
+roots, each owning the digests from its start prefix up to the next one's:
+
+    format=1
+    algorithm=sha3_256
+    width=1
+    depth=3
+    member=0 /mnt/disk0/uhashfs
+    member=8 /mnt/disk1/uhashfs
+
+Single object operations go to the owning member. Bulk operations (files(),
+check(), existsmany(), delete_many()) run on every member at once, a thread
+per member, so they get the bandwidth of all the devices. Streams are staged
+on the first member while they are hashed and moved to their owner if that
+is another member. Files are hashed once into a temp file on the first
+member, which is linked to their owner (copied, across filesystems).
+
+rebalance() changes the members: the descriptor keeps the old ones as
+previous= lines while the objects are moved to their new owners, and reads
+fall back to an object's previous owner until it finishes. Rerunning an
+interrupted rebalance() resumes it. Writers opened before a rebalance()
+must be restarted.
+"""
+
+import errno
+import os
+import queue
+import shutil
+import sys
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+import attr
+from .uhashfs import FEDERATION
+from .uhashfs import HashAddress
+from .uhashfs import get_amtime
+from .uhashfs import hash_file
+from .uhashfs import hash_file_handle
+from .uhashfs import path_is_parent
+from .uhashfs import uHashFS
+
+FEDERATION_FORMAT = 1
+
+
+def parse_members(lines):
+    '''returns {start prefix: root} from "start root" strings'''
+    members = {}
+    for line in lines:
+        start, root = line.split(' ', 1)
+        members[start.lower()] = root
+    return members
+
+
+def validate_members(members):
+    if not members:
+        raise ValueError("a federation needs at least one member")
+    starts = sorted(members)
+    if starts[0].strip('0'):
+        raise ValueError("the first member must start at 0, not {0}".format(starts[0]))
+    for start in starts:
+        try:
+            if start:
+                int(start, 16)
+        except ValueError:
+            raise ValueError('Invalid start: "{0}" is not hex'.format(start))
+    return {start: str(Path(members[start]).resolve()) for start in starts}
+
+
+def copy_tmp(tmp, fs):
+    '''a TempFile in fs with the contents of tmp, staged on another filesystem'''
+    copy = fs._mktemp()
+    try:
+        with open(tmp.name, 'rb') as fh:
+            shutil.copyfileobj(fh, copy, 256 * 128 * 2)
+        copy.close()
+    except BaseException:
+        copy.discard()
+        raise
+    return copy
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class uHashFSFederation():
+    root: str = attr.ib(converter=Path)  # holds the _federation descriptor
+    members: dict = attr.Factory(dict)  # start prefix -> member root, to create a new federation
+    algorithm: str = ''
+    width: int = 0
+    depth: int = 0
+    member_settings: dict = attr.Factory(dict)  # passed to every member uHashFS, e.g. bloom=True
+    verbose: bool = False
+
+    def __attrs_post_init__(self):
+        self.root = self.root.resolve()
+        self.descriptor = self.root / Path(FEDERATION)
+        self.previous = None  # members before an unfinished rebalance()
+        self.instances = {}  # root -> uHashFS, shared when a root is in both layouts
+        self.routing = {}  # hexdigest -> [puts routing it from a staging member, True if one of them created it]
+        self.routing_lock = threading.Lock()
+        members = self.members
+        if not self._read_descriptor():
+            if not members:
+                raise FileNotFoundError(self.descriptor)
+            if not (self.algorithm and self.width and self.depth):
+                raise ValueError("a new federation needs algorithm, width and depth")
+            self._write_descriptor(validate_members(members))
+        elif members and validate_members(members) != self.members:
+            raise ValueError("{0} has other members, use rebalance() to change them".format(self.root))
+
+    def _read_descriptor(self):
+        try:
+            with open(self.descriptor, 'r') as fh:
+                lines = fh.read().splitlines()
+        except FileNotFoundError:
+            return False
+        descriptor = dict(line.split('=', 1) for line in lines if '=' in line)
+        if int(descriptor['format']) != FEDERATION_FORMAT:
+            raise ValueError("{0} has format {1}, expected {2}".format(self.descriptor, descriptor['format'], FEDERATION_FORMAT))
+        for name, value in (('algorithm', descriptor['algorithm']), ('width', int(descriptor['width'])), ('depth', int(descriptor['depth']))):
+            if getattr(self, name) and getattr(self, name) != value:
+                raise ValueError("{0} was created with {1} {2} not {3}".format(self.root, name, value, getattr(self, name)))
+            setattr(self, name, value)
+        self._set_layout(parse_members(line[len('member='):] for line in lines if line.startswith('member=')),
+                         parse_members(line[len('previous='):] for line in lines if line.startswith('previous=')) or None)
+        return True
+
+    def _write_descriptor(self, members, previous=None):
+        descriptor = "format={0}\nalgorithm={1}\nwidth={2}\ndepth={3}\n".format(FEDERATION_FORMAT, self.algorithm, self.width, self.depth)
+        descriptor += ''.join("member={0} {1}\n".format(start, root) for start, root in members.items())
+        if previous:
+            descriptor += ''.join("previous={0} {1}\n".format(start, root) for start, root in previous.items())
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.descriptor.with_name(FEDERATION + '.' + str(os.getpid()))
+        with open(tmp_path, 'w') as fh:
+            fh.write(descriptor)
+        os.rename(tmp_path, self.descriptor)
+        self._set_layout(members, previous)
+
+    def _set_layout(self, members, previous):
+        self.members = dict(sorted(members.items()))
+        self.starts = list(self.members)
+        self.layout = [self._instance(root) for root in self.members.values()]
+        self.previous = dict(sorted(previous.items())) if previous else None
+        if self.previous:
+            self.previous_starts = list(self.previous)
+            self.previous_layout = [self._instance(root) for root in self.previous.values()]
+
+    def _instance(self, root):
+        if root not in self.instances:
+            self.instances[root] = uHashFS(root=root, algorithm=self.algorithm, width=self.width, depth=self.depth,
+                                           verbose=self.verbose, **self.member_settings)
+        return self.instances[root]
+
+    def roots(self):
+        '''the member uHashFS instances, each once'''
+        return list({fs.root: fs for fs in self.layout}.values())
+
+    def member(self, hexdigest):
+        '''the member owning hexdigest'''
+        self.layout[0].validate_hexdigest(hexdigest)
+        return self.layout[bisect_right(self.starts, hexdigest.lower()) - 1]
+
+    def hexdigestpath(self, hexdigest):
+        return self.member(hexdigest).hexdigestpath(hexdigest)
+
+    def previous_member(self, hexdigest):
+        '''the member that owned hexdigest before an unfinished rebalance(), None if it is the same'''
+        if not self.previous:
+            return None
+        previous = self.previous_layout[bisect_right(self.previous_starts, hexdigest.lower()) - 1]
+        if previous is self.member(hexdigest):
+            return None
+        return previous
+
+    def _route(self, address):
+        '''moves a put to the owning member if it was staged on another
+
+        concurrent puts of the same object share the staged copy, the last of
+        them in this process deletes it; if another process deleted it first,
+        the owner's copy is returned
+        '''
+        owner = self.member(address.hexdigest)
+        if owner is address.fs:
+            return address
+        hexdigest = address.hexdigest
+        with self.routing_lock:
+            routing = self.routing.setdefault(hexdigest, [0, False])
+            routing[0] += 1
+            routing[1] = routing[1] or not address.is_duplicate
+        moved = None
+        try:
+            try:
+                moved = owner.putfrom(address.fs, hexdigest, link=True, verify=False)  # just hashed
+            except FileNotFoundError:
+                if not owner.existshexdigest(hexdigest):
+                    raise
+                moved = HashAddress(address.digest, owner, owner.hexdigestpath(hexdigest), True)
+        finally:
+            with self.routing_lock:
+                routing[0] -= 1
+                if not routing[0]:
+                    del self.routing[hexdigest]
+                    if moved and routing[1] and hexdigest != address.fs.emptyhexdigest:
+                        try:
+                            address.fs.deletehexdigest(hexdigest)
+                        except FileNotFoundError:  # deleted by another process
+                            pass
+        return moved
+
+    def putfile(self, infile, preserve_mtime=True, content_type=None):
+        '''hashes infile once while staging it on the first member, then links it to its owner
+
+        or copies it there if the owner is on another filesystem, the staged temp file is always removed
+        '''
+        try:
+            path = Path(infile)
+        except TypeError:  # a file handle
+            path = Path(infile.name)
+        for fs in self.roots():
+            if path_is_parent(fs.root, path):
+                raise ValueError("Error: {0} exists within the federation member: {1}".format(repr(path), fs.root))
+        mtime = get_amtime(infile) if preserve_mtime else False
+        tmp = self.layout[0]._mktemp()
+        try:
+            try:
+                digest = hash_file(infile, self.algorithm, tmp)
+            except TypeError:  # a file handle
+                digest = hash_file_handle(infile, self.algorithm, tmp)
+            owner = self.member(digest.hex())
+        except BaseException:
+            tmp.discard()
+            raise
+        try:
+            return owner._commit(digest=digest, tmp=tmp, mtime=mtime, content_type=content_type)  # links and discards tmp
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise e
+        try:
+            return owner._commit(digest=digest, tmp=copy_tmp(tmp, owner), mtime=mtime, content_type=content_type)
+        finally:
+            tmp.discard()
+
+    def putstream(self, request, **kwargs):
+        return self._route(self.layout[0].putstream(request, **kwargs))
+
+    def putstr(self, string):
+        return self._route(self.layout[0].putstr(string))
+
+    def gethexdigest(self, hexdigest):
+        try:
+            return self.member(hexdigest).gethexdigest(hexdigest)
+        except FileNotFoundError as e:
+            previous = self.previous_member(hexdigest)
+            if previous is None:
+                raise e
+            return previous.gethexdigest(hexdigest)
+
+    def openhexdigest(self, hexdigest, mode='rb', verify=None):
+        try:
+            return self.member(hexdigest).openhexdigest(hexdigest, mode=mode, verify=verify)
+        except FileNotFoundError as e:
+            previous = self.previous_member(hexdigest)
+            if previous is None:
+                raise e
+            return previous.openhexdigest(hexdigest, mode=mode, verify=verify)
+
+    def existshexdigest(self, hexdigest):
+        if self.member(hexdigest).existshexdigest(hexdigest):
+            return True
+        previous = self.previous_member(hexdigest)
+        return previous is not None and previous.existshexdigest(hexdigest)
+
+    def __contains__(self, hexdigest):
+        return self.existshexdigest(hexdigest)
+
+    def _grouped(self, hexdigests, previous=False):
+        '''[(member, [hexdigest, ...]), ...], also grouping them under their previous member if previous is set'''
+        groups = {}  # root -> (member, hexdigests), uHashFS instances are not hashable
+        for hexdigest in hexdigests:
+            owners = [self.member(hexdigest)]
+            if previous and self.previous_member(hexdigest) is not None:
+                owners.append(self.previous_member(hexdigest))
+            for fs in owners:
+                groups.setdefault(fs.root, (fs, []))[1].append(hexdigest)
+        return list(groups.values())
+
+    def existsmany(self, hexdigests, chunk_size=4096):
+        '''yields (hexdigest, exists) in order, each chunk checked on every member at once'''
+        hexdigests = iter(hexdigests)
+        while True:
+            chunk = list(islice(hexdigests, chunk_size))
+            if not chunk:
+                return
+            found = set()
+            groups = self._grouped(chunk, previous=True)
+            with ThreadPoolExecutor(max_workers=len(groups) or 1) as pool:
+                for results in pool.map(lambda group: list(group[0].existsmany(group[1])), groups):
+                    found.update(hexdigest for hexdigest, exists in results if exists)
+            for hexdigest in chunk:
+                yield hexdigest, hexdigest in found
+
+    def deletehexdigest(self, hexdigest):
+        if not self.delete_many([hexdigest]):
+            raise FileNotFoundError(self.member(hexdigest).hexdigestpath(hexdigest))
+        return True
+
+    def delete_many(self, hexdigests):
+        '''deletes every object in hexdigests that exists, on every member at once, returns the list of those deleted'''
+        hexdigests = list(hexdigests)
+        groups = self._grouped(hexdigests, previous=True)
+        deleted = set()
+        with ThreadPoolExecutor(max_workers=len(groups) or 1) as pool:
+            for removed in pool.map(lambda group: group[0].delete_many(group[1]), groups):
+                deleted.update(removed)
+        return [hexdigest for hexdigest in dict.fromkeys(hexdigests) if hexdigest in deleted]
+
+    def _parallel(self, function, roots=None):
+        '''yields the items of function(member) for every member as they come, the members walked concurrently'''
+        results = queue.Queue(maxsize=1024)
+        finished = object()
+        stop = threading.Event()  # set if the caller stops iterating
+
+        def run(fs):
+            try:
+                for item in function(fs):
+                    if stop.is_set():
+                        return
+                    while True:
+                        try:
+                            results.put(item, timeout=0.1)
+                            break
+                        except queue.Full:
+                            if stop.is_set():
+                                return
+            finally:
+                results.put(finished)
+
+        roots = self.roots() if roots is None else roots
+        with ThreadPoolExecutor(max_workers=len(roots) or 1) as pool:
+            futures = [pool.submit(run, fs) for fs in roots]
+            try:
+                running = len(futures)
+                while running:
+                    item = results.get()
+                    if item is finished:
+                        running -= 1
+                        continue
+                    yield item
+            finally:
+                stop.set()
+                while any(not future.done() for future in futures):  # unblock any put(finished)
+                    try:
+                        results.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+            for future in futures:
+                future.result()  # raises what a member raised
+
+    def _written(self):
+        '''the members whose roots exist, those not written to yet have nothing to walk'''
+        return [fs for fs in self.roots() if fs.root.exists()]
+
+    def files(self):
+        return self._parallel(lambda fs: fs.files(), self._written())
+
+    def check(self, path=None, skip_cached=False, quiet=True, cache_mode='buffered'):
+        '''check() of every member, or of the one holding path'''
+        roots = self._written()
+        if path is not None and Path(path).resolve() == self.root:
+            path = None
+        if path is not None:
+            roots = [fs for fs in roots if path_is_parent(fs.root, Path(path))]
+        return self._parallel(lambda fs: fs.check(path or fs.root, skip_cached=skip_cached, quiet=quiet, cache_mode=cache_mode), roots)
+
+    def sorted_hexdigests(self, prefix='', start_after=''):
+        '''yields the hexdigests in order, the members are walked one after another in range order'''
+        prefix = prefix.lower()
+        start_after = start_after.lower()
+        for index, start in enumerate(self.starts):
+            end = self.starts[index + 1] if index + 1 < len(self.starts) else None
+            if end is not None and end <= max(prefix, start_after):
+                continue
+            if prefix and start >= prefix + 'g':  # past every digest starting with prefix
+                return
+            for hexdigest in self.layout[index].sorted_hexdigests(prefix=prefix, start_after=start_after):
+                if hexdigest < start:
+                    continue
+                if end is not None and hexdigest >= end:
+                    break
+                yield hexdigest
+
+    def list_hexdigests(self, prefix='', start_after='', limit=1000):
+        '''returns (up to limit hexdigests, cursor), pass the cursor as start_after for the next page, None at the end'''
+        page = list(islice(self.sorted_hexdigests(prefix=prefix, start_after=start_after), limit + 1))
+        if len(page) > limit:
+            return page[:limit], page[limit - 1]
+        return page, None
+
+    def _move_leaf(self, fs, leaf):
+        '''moves the objects in leaf that fs no longer owns, returns how many'''
+        moving = [name for name in os.listdir(leaf) if len(name) == fs.hexdigestlen and self.member(name) is not fs]
+        for hexdigest in moving:
+            try:
+                self.member(hexdigest).putfrom(fs, hexdigest, link=True)  # copied and verified across devices
+            except FileNotFoundError:  # deleted since the listing
+                continue
+        fs.delete_many(hexdigest for hexdigest in moving if hexdigest != fs.emptyhexdigest)
+        return len(moving)
+
+    def rebalance(self, members, workers=None):
+        '''changes the members to {start prefix: root}, moving objects to their new owners, returns how many moved'''
+        members = validate_members(members)
+        previous = self.previous or self.members  # resuming an interrupted rebalance()
+        self._write_descriptor(members, previous=previous)
+        sources = {fs.root: fs for fs in self.previous_layout}.values()
+        moved = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            tasks = ((fs, leaf) for fs in sources for leaf in fs.leaf_folders())
+            for count in pool.map(lambda task: self._move_leaf(*task), tasks):
+                moved += count
+                if self.verbose:
+                    print("moved:", moved, end='\r', file=sys.stderr, flush=True)
+        self._write_descriptor(members)
+        return moved
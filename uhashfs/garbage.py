@@ -0,0 +1,155 @@
+"""Mark-and-sweep garbage collection of uHashFS objects.
+
+A data object is referenced if a uHashFSMetadata tree has a record about it
+(the about_hash folder) or a link pointing at it (the to_hash symlinks under
+archive/<timestamp>/<source>/). Everything else, except the emptydigest used
+for autodetection, is garbage.
+
+Records can be written while gc runs. sweep() given the metafs and the time
+mark() started re-marks the about_hash folders changed since (putrecord()
+always replaces their latest_archive) before deleting anything, so an old
+object linked to meanwhile is kept. Only records written during that final
+re-mark and delete can still lose their object; pause writes for a strict
+guarantee.
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+from .uhashfs import HashAddress
+
+CLOCK_SLACK = 1.0  # seconds, directory ctimes come from a coarse kernel clock
+
+
+def digest_dtype(digestlen):
+    # fixed width bytes, 32 bytes per sha3_256 digest instead of a ~100 byte python str
+    return numpy.dtype('S' + str(digestlen))
+
+
+def is_hexdigest(name, hexdigestlen):
+    if len(name) != hexdigestlen:
+        return False
+    try:
+        int(name, 16)
+    except ValueError:
+        return False
+    return True
+
+
+def _scan_links(path, hexdigestlen, found):
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_symlink():
+                target = os.path.basename(os.readlink(entry.path))
+                if is_hexdigest(target, hexdigestlen):
+                    found.append(bytes.fromhex(target))
+            elif entry.is_dir(follow_symlinks=False):
+                _scan_links(entry.path, hexdigestlen, found)
+
+
+def _scan_shard(path, hexdigestlen, found, since):
+    # about_hash folders are found by name at any depth, shard folder names are never that long
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if not is_hexdigest(entry.name, hexdigestlen):
+                _scan_shard(entry.path, hexdigestlen, found, since)
+            elif since is None or entry.stat(follow_symlinks=False).st_ctime >= since:
+                found.append(bytes.fromhex(entry.name))  # the about_hash
+                _scan_links(entry.path, hexdigestlen, found)
+
+
+def mark_shard(path, digestlen, since=None):
+    '''returns a numpy array of digests referenced below a top level metadata shard, whatever its width/depth'''
+    found = []
+    try:
+        _scan_shard(path, digestlen * 2, found, since)
+    except FileNotFoundError:
+        pass
+    return numpy.array(found, dtype=digest_dtype(digestlen))
+
+
+def mark(metafs, processes=None, since=None):
+    '''returns (digests, counts), the sorted unique referenced digests and the number of references to each
+
+    with since (a time.time()), only the about_hash folders changed since then are read
+    '''
+    if since is not None:
+        since -= CLOCK_SLACK
+    hash_folder = metafs.root / metafs.algorithm
+    try:
+        shards = sorted(entry.path for entry in os.scandir(hash_folder)
+                        if entry.is_dir(follow_symlinks=False))
+    except FileNotFoundError:
+        shards = []
+    digestlen = metafs.digestlen
+    if processes == 1:
+        marked = [mark_shard(shard, digestlen, since) for shard in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            marked = list(pool.map(mark_shard, shards, [digestlen] * len(shards), [since] * len(shards)))
+    if metafs.verbose:
+        print("marked shards:", len(marked), file=sys.stderr)
+    marked.append(numpy.array([], dtype=digest_dtype(digestlen)))
+    return numpy.unique(numpy.concatenate(marked), return_counts=True)
+
+
+def is_marked(marked, digest):
+    digest = numpy.array(digest, dtype=marked.dtype)
+    index = numpy.searchsorted(marked, digest)
+    return bool(index < len(marked) and marked[index] == digest)
+
+
+def sweep(fs, marked, min_age=3600, delete=False, metafs=None, since=None, processes=None):
+    '''yields the HashAddress of every object in fs that is not in marked
+
+    objects whose inode changed less than min_age seconds ago are skipped,
+    they could have been written after mark() ran, before their metadata record.
+    With metafs and since (the time.time() taken before mark() started), the
+    unreferenced objects are collected first and those linked to by records
+    written since are dropped before any is deleted or yielded.
+    '''
+    assert not fs.legacy
+    assert marked.dtype == digest_dtype(fs.digestlen)
+    assert (metafs is None) == (since is None)
+    unreferenced = _unreferenced(fs, marked, min_age)
+    if metafs is not None:
+        unreferenced = list(unreferenced)
+        remarked, _ = mark(metafs, processes=processes, since=since)
+        if metafs.verbose:
+            print("re-marked since mark started:", len(remarked), file=sys.stderr)
+        unreferenced = [(hexdigest, path) for hexdigest, path in unreferenced
+                        if not is_marked(remarked, bytes.fromhex(hexdigest))]
+    for hexdigest, path in unreferenced:
+        address = HashAddress(bytes.fromhex(hexdigest), fs, path)
+        if delete:
+            try:
+                fs.deletehexdigest(hexdigest)
+            except FileNotFoundError:
+                pass
+        yield address
+
+
+def _unreferenced(fs, marked, min_age):
+    '''yields (hexdigest, path) of the objects in fs not in marked and older than min_age'''
+    cutoff = time.time() - min_age
+    for leaf in fs.leaf_folders():
+        names = [name for name in os.listdir(leaf) if is_hexdigest(name, fs.hexdigestlen)]
+        if not names:
+            continue
+        digests = numpy.array([bytes.fromhex(name) for name in names], dtype=marked.dtype)
+        unreferenced = ~numpy.isin(digests, marked, assume_unique=True)
+        for index in numpy.flatnonzero(unreferenced):
+            hexdigest = names[index]
+            if hexdigest == fs.emptyhexdigest:
+                continue
+            path = os.path.join(leaf, hexdigest)
+            try:
+                if os.lstat(path).st_ctime > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            yield hexdigest, path
@@ -0,0 +1,167 @@
+"""Optional sqlite index of uHashFSMetadata records.
+
+Mirrors the archive/<timestamp>/<source>/<link> symlinks so reverse lookups
+(to_hash -> about_hash), lookups by data source, time ranges and latest
+archives do not need a walk of the metadata tree.
+"""
+
+import os
+import sqlite3
+import sys
+from pathlib import Path
+import attr
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    about BLOB NOT NULL,
+    timestamp TEXT NOT NULL,
+    source TEXT NOT NULL,
+    link TEXT NOT NULL,
+    to_hash BLOB NOT NULL,
+    time REAL,
+    PRIMARY KEY (about, timestamp, source, link)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS records_to_hash ON records (to_hash);
+CREATE INDEX IF NOT EXISTS records_source ON records (source, time);
+CREATE INDEX IF NOT EXISTS records_time ON records (time);
+CREATE TABLE IF NOT EXISTS latest (
+    about BLOB PRIMARY KEY,
+    timestamp TEXT NOT NULL
+) WITHOUT ROWID;
+'''
+
+COLUMNS = 'about, to_hash, source, link, timestamp'
+
+
+def timestamp_to_time(timestamp):
+    try:
+        return float(timestamp)
+    except ValueError:
+        return None  # still indexed, just not range queryable
+
+
+def rows_to_records(rows):
+    for about, to_hash, source, link, timestamp in rows:
+        yield (about.hex(), to_hash.hex(), source, link, timestamp)
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class uHashFSIndex():
+    path: str = attr.ib(converter=Path)
+    verbose: bool = False
+
+    def __attrs_post_init__(self):
+        os.makedirs(self.path.parent, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)  # concurrent writers wait
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def add(self, records):
+        '''records is an iterable of (about_digest, to_digest, data_source_name, link_name, timestamp) tuples'''
+        rows = []
+        latest = {}
+        for about, to_hash, source, link, timestamp in records:
+            rows.append((about, timestamp, source, link, to_hash, timestamp_to_time(timestamp)))
+            latest[about] = timestamp
+        with self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.db.executemany('INSERT OR REPLACE INTO latest VALUES (?, ?)', latest.items())
+        return len(rows)
+
+    def clear(self):
+        with self.db:
+            self.db.execute('BEGIN')
+            self.db.execute('DELETE FROM records')
+            self.db.execute('DELETE FROM latest')
+
+    def about(self, to_digest):
+        '''yields records pointing at to_digest'''
+        rows = self.db.execute('SELECT ' + COLUMNS + ' FROM records WHERE to_hash = ?', (to_digest,))
+        yield from rows_to_records(rows)
+
+    def records(self, about_digest):
+        rows = self.db.execute('SELECT ' + COLUMNS + ' FROM records WHERE about = ?', (about_digest,))
+        yield from rows_to_records(rows)
+
+    def source(self, data_source_name, start=None, end=None):
+        '''yields records written by data_source_name, optionally limited to start <= timestamp < end'''
+        query = 'SELECT ' + COLUMNS + ' FROM records WHERE source = ?'
+        args = [data_source_name]
+        if start is not None:
+            query += ' AND time >= ?'
+            args.append(start)
+        if end is not None:
+            query += ' AND time < ?'
+            args.append(end)
+        yield from rows_to_records(self.db.execute(query, args))
+
+    def timerange(self, start, end):
+        '''yields records with start <= timestamp < end'''
+        rows = self.db.execute('SELECT ' + COLUMNS + ' FROM records WHERE time >= ? AND time < ?', (start, end))
+        yield from rows_to_records(rows)
+
+    def latest(self, about_digest):
+        '''returns the timestamp latest_archive points to, or None'''
+        row = self.db.execute('SELECT timestamp FROM latest WHERE about = ?', (about_digest,)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def rebuild(self, metafs, batch_size=10000):
+        '''replaces the index contents with the records found by walking metafs'''
+        self.clear()
+        count = 0
+        batch = []
+        for record in walk_records(metafs):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                count += self.add(batch)
+                batch = []
+                if self.verbose:
+                    print("indexed:", count, end='\r', file=sys.stderr, flush=True)
+        count += self.add(batch)
+        latest = []
+        for about_path in walk_about_folders(metafs):
+            try:
+                target = os.readlink(os.path.join(about_path, 'latest_archive'))
+            except FileNotFoundError:
+                continue
+            latest.append((bytes.fromhex(os.path.basename(about_path)), os.path.basename(target)))
+        with self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('INSERT OR REPLACE INTO latest VALUES (?, ?)', latest)
+        return count
+
+
+def walk_about_folders(metafs, path=None):
+    '''yields the about_hash folders by their hexdigest names at any depth, whatever width/depth wrote them'''
+    if path is None:
+        path = metafs.root / metafs.algorithm
+    try:
+        entries = sorted(entry.path for entry in os.scandir(path) if entry.is_dir(follow_symlinks=False))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if len(os.path.basename(entry)) == metafs.hexdigestlen:
+            yield entry
+        else:
+            yield from walk_about_folders(metafs, entry)
+
+
+def walk_records(metafs):
+    '''yields (about_digest, to_digest, data_source_name, link_name, timestamp) for every record in metafs'''
+    for about_path in walk_about_folders(metafs):
+        about = bytes.fromhex(os.path.basename(about_path))
+        archive = os.path.join(about_path, 'archive')
+        try:
+            timestamps = os.listdir(archive)
+        except FileNotFoundError:
+            continue
+        for timestamp in timestamps:
+            for source in os.listdir(os.path.join(archive, timestamp)):
+                source_path = os.path.join(archive, timestamp, source)
+                for link in os.listdir(source_path):
+                    to_hexdigest = os.readlink(os.path.join(source_path, link))
+                    yield (about, bytes.fromhex(to_hexdigest), source, link, timestamp)
@@ -0,0 +1,208 @@
+"""Streaming ingest of files and directory trees.
+
+ingest() runs three stages joined by bounded queues, so memory stays flat
+however large the tree is:
+
+    walker     one thread listing the paths given (recursing into
+               directories with recursive), regular files only, symlinks
+               and devices inside trees are skipped
+    hashers    workers threads, each copying a file into a temp file in the
+               root while hashing it
+    committer  the calling thread, linking each temp file under its digest
+
+A federation has no single root to stage temp files in, so there the
+hashers put the files themselves and the committer only collects them.
+"""
+
+import os
+import queue
+import stat
+import threading
+import attr
+from .uhashfs import get_amtime
+from .uhashfs import hash_file
+
+POLL = 0.1  # seconds blocked queue operations wait before looking at the stop event
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class IngestResult():
+    path: str
+    size: int = 0
+    address: object = None  # HashAddress, None on error
+    error: OSError = None
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class IngestSummary():
+    new: int = 0
+    new_bytes: int = 0
+    duplicate: int = 0
+    duplicate_bytes: int = 0
+    errors: int = 0
+
+    def add(self, result):
+        if result.error:
+            self.errors += 1
+        elif result.address.is_duplicate:
+            self.duplicate += 1
+            self.duplicate_bytes += result.size
+        else:
+            self.new += 1
+            self.new_bytes += result.size
+
+
+def walk(paths, recursive=False, skip=None):
+    '''yields (path, None) for each regular file under paths, (path, error) for those that cannot be read or listed
+
+    paths given are followed if they are symlinks, those found in directories
+    are not. Directories whose real path is skip (the root) are not entered.
+    '''
+    for path in paths:
+        path = os.fspath(path)
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            yield path, e
+            continue
+        if stat.S_ISREG(st.st_mode):
+            yield path, None
+        elif not stat.S_ISDIR(st.st_mode):
+            yield path, OSError("not a regular file: {0}".format(path))
+        elif not recursive:
+            yield path, IsADirectoryError("is a directory, see --recursive: {0}".format(path))
+        elif skip and os.path.realpath(path) == skip:
+            yield path, ValueError("is the root: {0}".format(path))
+        else:
+            yield from _walk_tree(path, skip)
+
+
+def _walk_tree(top, skip):
+    stack = [top]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not skip or os.path.realpath(entry.path) != skip:
+                                stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry.path, None
+                    except OSError as e:
+                        yield entry.path, e
+        except OSError as e:
+            yield folder, e
+
+
+def _put(q, item, stop):
+    '''q.put() that gives up once stop is set, returns False if it did'''
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    '''q.get() that gives up once stop is set, returning None'''
+    while not stop.is_set():
+        try:
+            return q.get(timeout=POLL)
+        except queue.Empty:
+            continue
+    return None
+
+
+def _hash(fs, path, preserve_mtime):
+    '''copies path into a temp file in fs while hashing it, returns (digest, tmp, mtime, size)'''
+    mtime = get_amtime(path) if preserve_mtime else False
+    tmp = fs._mktemp()
+    try:
+        digest = hash_file(path, fs.algorithm, tmp)
+        size = os.fstat(tmp.fileno()).st_size
+    except BaseException:
+        tmp.discard()
+        raise
+    return digest, tmp, mtime, size
+
+
+def ingest(fs, paths, recursive=False, workers=None, queue_size=None, preserve_mtime=True):
+    '''yields an IngestResult per file under paths, in the order they finish hashing
+
+    files that vanish or cannot be read are yielded with error set, errors
+    committing (the root's disk filling up) are raised.
+    '''
+    workers = workers or os.cpu_count() or 1
+    queue_size = queue_size or workers * 4
+    staged = hasattr(fs, '_commit')  # a uHashFS, not a federation
+    skip = os.path.realpath(fs.root)
+    todo = queue.Queue(queue_size)
+    done = queue.Queue(queue_size)
+    stop = threading.Event()
+
+    def walker():
+        try:
+            for item in walk(paths, recursive=recursive, skip=skip):
+                if not _put(todo, item, stop):
+                    return
+        finally:
+            for _ in range(workers):
+                _put(todo, None, stop)
+
+    def hasher():
+        try:
+            while True:
+                item = _get(todo, stop)
+                if item is None:
+                    return
+                path, error = item
+                result = IngestResult(path=path, error=error)
+                pending = None
+                if not error:
+                    try:
+                        if staged:
+                            pending = _hash(fs, path, preserve_mtime)
+                            result.size = pending[3]
+                        else:
+                            result.address = fs.putfile(path, preserve_mtime=preserve_mtime)
+                            result.size = os.lstat(result.address.abspath).st_size
+                    except (OSError, ValueError) as e:  # vanished, unreadable, or inside the root
+                        result.error = e
+                if not _put(done, (result, pending), stop):
+                    if pending:
+                        pending[1].discard()
+                    return
+        finally:
+            _put(done, None, stop)
+
+    threads = [threading.Thread(target=walker, daemon=True)]
+    threads += [threading.Thread(target=hasher, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    finished = 0
+    try:
+        while finished < workers:
+            item = done.get()
+            if item is None:
+                finished += 1
+                continue
+            result, pending = item
+            if pending:
+                digest, tmp, mtime, _ = pending
+                result.address = fs._commit(digest=digest, tmp=tmp, mtime=mtime)
+            yield result
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        while True:  # left behind when the caller stopped early
+            try:
+                item = done.get_nowait()
+            except queue.Empty:
+                break
+            if item and item[1]:
+                item[1][1].discard()
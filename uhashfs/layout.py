@@ -0,0 +1,211 @@
+"""Leaf folder fan-out analysis and width/depth recommendations.
+
+analyze() scans every leaf folder (or a random sample of them) with
+os.scandir and reports how the objects are spread over them. benchmark()
+measures lookup latency against directory size on the filesystem holding
+the root, and recommend() picks the layout with the fewest folders that
+keeps the expected entries per leaf below the size where lookups slow down.
+
+The benchmark directories were just written, so their dentries and inodes
+are cached and lookups are timed warm, as on a root whose leaves fit in
+memory. With drop_caches it writes to /proc/sys/vm/drop_caches (root only,
+and it empties the dentry and inode caches of the whole machine) before
+every lookup and times them cold, as on a root much larger than memory.
+"""
+
+import os
+import random
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import attr
+
+BENCHMARK_SIZES = (256, 1024, 4096, 16384, 65536)
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class LeafStats():
+    leaf: str
+    entries: int = 0
+    bytes: int = 0
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class LayoutReport():
+    width: int
+    depth: int
+    edge_count: int
+    leaves_scanned: int = 0
+    leaves_found: int = 0  # scanned leaves that exist
+    objects: int = 0  # in the scanned leaves
+    bytes: int = 0
+    objects_estimate: int = 0  # for the whole tree
+    p50: float = 0
+    p99: float = 0
+    max: int = 0
+    size_histogram: dict = attr.Factory(dict)  # power of two upper bound -> object count
+    inodes_used: int = 0  # on the whole filesystem holding the root
+    inodes_free: int = 0
+
+
+def scan_leaf(fs, leaf, sizes=True):
+    stats = LeafStats(leaf=str(leaf))
+    histogram = {}
+    try:
+        with os.scandir(leaf) as entries:
+            for entry in entries:
+                if len(entry.name) != fs.hexdigestlen:
+                    continue
+                stats.entries += 1
+                if sizes:
+                    size = entry.stat(follow_symlinks=False).st_size
+                    stats.bytes += size
+                    bucket = 1 << max(size - 1, 0).bit_length()
+                    histogram[bucket] = histogram.get(bucket, 0) + 1
+    except FileNotFoundError:
+        return None, histogram
+    return stats, histogram
+
+
+def sample_leaves(fs, sample):
+    '''yields sample random (possibly not existing) leaf folders'''
+    for _ in range(sample):
+        yield fs.random_edge_folder()
+
+
+def percentile(histogram, q):
+    '''numpy.percentile() (linear interpolation) of the values in {value: occurrences}'''
+    total = sum(histogram.values())
+    position = (total - 1) * q / 100
+    lower = int(position)
+    values = []  # the values at ranks lower and lower + 1
+    seen = 0
+    for value, occurrences in sorted(histogram.items()):
+        seen += occurrences
+        while len(values) < 2 and seen > lower + len(values):
+            values.append(value)
+        if len(values) == 2:
+            break
+    if len(values) == 1:  # lower is the last rank
+        return float(values[0])
+    return values[0] + (values[1] - values[0]) * (position - lower)
+
+
+def analyze(fs, sample=None, sizes=True, workers=None):
+    '''scans every leaf folder, or sample random ones, returns a LayoutReport
+
+    entries per leaf are kept as a histogram, leaves never created are
+    counted into it rather than listed, so the full scan of a deep layout
+    costs memory per distinct count, not per possible leaf
+    '''
+    if sample:
+        leaves = sample_leaves(fs, sample)
+    else:
+        leaves = fs.leaf_folders()
+    report = LayoutReport(width=fs.width, depth=fs.depth, edge_count=fs.edge_count)
+    counts = {}  # entries -> leaves with that many
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for stats, histogram in pool.map(lambda leaf: scan_leaf(fs, leaf, sizes=sizes), leaves):
+            report.leaves_scanned += 1
+            for bucket, count in histogram.items():
+                report.size_histogram[bucket] = report.size_histogram.get(bucket, 0) + count
+            if stats is None:
+                counts[0] = counts.get(0, 0) + 1  # a missing leaf is an empty one
+                continue
+            report.leaves_found += 1
+            report.objects += stats.entries
+            report.bytes += stats.bytes
+            counts[stats.entries] = counts.get(stats.entries, 0) + 1
+            if fs.verbose:
+                print(stats, file=sys.stderr)
+    leaves = report.leaves_scanned
+    if not sample and fs.edge_count > leaves:
+        counts[0] = counts.get(0, 0) + fs.edge_count - leaves  # leaves never created
+        leaves = fs.edge_count
+    if report.leaves_scanned:
+        report.p50 = percentile(counts, 50)
+        report.p99 = percentile(counts, 99)
+        report.max = max(counts)
+        report.objects_estimate = report.objects * fs.edge_count // leaves
+    report.size_histogram = dict(sorted(report.size_histogram.items()))
+    try:
+        vfs = os.statvfs(fs.root)
+        report.inodes_used = vfs.f_files - vfs.f_ffree
+        report.inodes_free = vfs.f_favail
+    except FileNotFoundError:
+        pass
+    return report
+
+
+def drop_dentry_cache():
+    '''evicts the kernel's dentry and inode caches, raises OSError unless root'''
+    os.sync()  # drop_caches only drops clean entries
+    with open('/proc/sys/vm/drop_caches', 'w') as fh:
+        fh.write('2\n')
+
+
+def benchmark(path, sizes=BENCHMARK_SIZES, lookups=2000, drop_caches=False):
+    '''returns {entries: seconds per stat()} for directories of each size created below path
+
+    lookups are warm unless drop_caches is set, see the module docstring
+    '''
+    results = {}
+    bench_root = Path(path) / ('_layout_benchmark.' + str(os.getpid()))
+    os.makedirs(bench_root)
+    try:
+        for size in sizes:
+            folder = bench_root / str(size)
+            os.makedirs(folder)
+            names = ['%064x' % random.getrandbits(256) for _ in range(size)]
+            for name in names:
+                os.close(os.open(folder / name, os.O_WRONLY | os.O_CREAT, 0o444))
+            probes = [folder / random.choice(names) for _ in range(lookups // 2)]
+            probes += [folder / ('%064x' % random.getrandbits(256)) for _ in range(lookups // 2)]  # misses too
+            random.shuffle(probes)
+            elapsed = 0
+            start = time.perf_counter()
+            for probe in probes:
+                if drop_caches:
+                    drop_dentry_cache()
+                    start = time.perf_counter()
+                try:
+                    os.stat(probe)
+                except FileNotFoundError:
+                    pass
+                if drop_caches:
+                    elapsed += time.perf_counter() - start
+            if not drop_caches:
+                elapsed = time.perf_counter() - start
+            results[size] = elapsed / len(probes)
+    finally:
+        shutil.rmtree(bench_root)
+    return results
+
+
+def knee(results, tolerance=2.0):
+    '''the largest benchmarked directory size whose lookups are at most tolerance times the fastest'''
+    fastest = min(results.values())
+    return max(size for size, seconds in results.items() if seconds <= fastest * tolerance)
+
+
+def folder_count(width, depth):
+    return sum(16 ** (width * level) for level in range(1, depth + 1))
+
+
+def recommend(target_objects, max_leaf_entries, max_width=3, max_depth=6):
+    '''returns (width, depth) with the fewest folders keeping target_objects / leaves under max_leaf_entries'''
+    assert target_objects >= 0
+    assert max_leaf_entries > 0
+    candidates = []
+    for width in range(1, max_width + 1):
+        for depth in range(1, max_depth + 1):
+            per_leaf = target_objects / (16 ** (width * depth))
+            candidates.append((per_leaf <= max_leaf_entries, folder_count(width, depth), depth, width))
+    fitting = [candidate for candidate in candidates if candidate[0]]
+    if fitting:
+        _, _, depth, width = min(fitting)
+    else:  # nothing is wide enough, take the most leaves
+        _, _, depth, width = max(candidates, key=lambda candidate: (16 ** (candidate[3] * candidate[2]), -candidate[1]))
+    return width, depth
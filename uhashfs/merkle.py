@@ -0,0 +1,205 @@
+"""Merkle summaries of a uHashFS tree, one per shard folder.
+
+A leaf folder's summary is the hash of its sorted child digests, a parent's
+is the hash of its sorted (name, child summary) pairs, up to a single root
+summary. Two replicas with equal summaries for a folder hold the same
+objects below it, so divergent leaves are found by descending only into
+folders whose summaries differ.
+
+Summaries are stored in the _merkle file in the root. Writers append the
+prefix of each leaf they change to _merkle.dirty, through an fd kept open
+and once per leaf until update() takes the file. update() recomputes only
+those leaves and their parents.
+
+update() holds an flock on _merkle.lock, so concurrent runs take turns. It
+renames _merkle.dirty to a _merkle.dirty.<n> file holding an exclusive
+flock on it, which waits for appends in progress (they hold a shared one)
+and makes later appends reopen a new _merkle.dirty. The renamed files are
+removed once the summaries are saved, so those left by a crashed update()
+are merged into the next one.
+"""
+
+import fcntl
+import os
+import sys
+import threading
+from pathlib import Path
+import attr
+from .uhashfs import MERKLE
+from .uhashfs import MERKLE_DIRTY
+from .uhashfs import MERKLE_LOCK
+from .uhashfs import new_hasher
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class uHashFSMerkle():
+    fs: object
+
+    def __attrs_post_init__(self):
+        assert not self.fs.legacy
+        self.path = self.fs.root / Path(MERKLE)
+        self.dirty_path = self.fs.root / Path(MERKLE_DIRTY)
+        self.dirty_fd = None  # kept open for mark_dirty()
+        self.dirty_ino = None
+        self.marked = set()  # leaf prefixes already appended to the file dirty_fd is open on
+        self.lock = threading.Lock()  # flock() does not exclude threads sharing the fd
+        self.summary_size = self.fs.digestlen
+        self.leaf_prefix_len = self.fs.width * self.fs.depth
+        self.nodes = None  # prefix -> summary, loaded on first use
+
+    def leaf_prefix(self, hexdigest):
+        return hexdigest[:self.leaf_prefix_len]
+
+    def leaf_path(self, prefix):
+        parts = [prefix[i:i + self.fs.width] for i in range(0, len(prefix), self.fs.width)]
+        return self.fs.root / Path(self.fs.algorithm) / Path(*parts)
+
+    def mark_dirty(self, hexdigest):
+        prefix = self.leaf_prefix(hexdigest)
+        with self.lock:
+            while True:
+                if self.dirty_fd is None:
+                    self.dirty_fd = os.open(self.dirty_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o644)
+                    self.dirty_ino = os.fstat(self.dirty_fd).st_ino
+                    self.marked = set()
+                if prefix in self.marked and self._is_current():  # update() takes the file after the caller's link
+                    return
+                fcntl.flock(self.dirty_fd, fcntl.LOCK_SH)
+                try:
+                    if self._is_current():
+                        os.write(self.dirty_fd, prefix.encode('ascii') + b'\n')  # one write, atomic with O_APPEND
+                        self.marked.add(prefix)
+                        return
+                finally:
+                    fcntl.flock(self.dirty_fd, fcntl.LOCK_UN)
+                os.close(self.dirty_fd)  # taken by update(), start the new file
+                self.dirty_fd = None
+
+    def _is_current(self):
+        try:
+            return os.stat(self.dirty_path).st_ino == self.dirty_ino
+        except FileNotFoundError:
+            return False
+
+    def _take_dirty(self):
+        '''renames _merkle.dirty out of the way of writers, once the appends in progress are done'''
+        try:
+            fd = os.open(self.dirty_path, os.O_RDONLY | os.O_CLOEXEC)
+        except FileNotFoundError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            n = 0
+            while os.path.exists(self.dirty_path.with_name(MERKLE_DIRTY + '.' + str(n))):
+                n += 1
+            os.rename(self.dirty_path, self.dirty_path.with_name(MERKLE_DIRTY + '.' + str(n)))
+        finally:
+            os.close(fd)
+
+    def _taken(self):
+        '''the renamed dirty files, this update()'s and any a crashed one left'''
+        return sorted(self.fs.root / Path(name) for name in os.listdir(self.fs.root) if name.startswith(MERKLE_DIRTY + '.'))
+
+    def load(self):
+        self.nodes = {}
+        try:
+            with open(self.path, 'rb') as fh:
+                data = fh.read()
+        except FileNotFoundError:
+            return False
+        offset = 0
+        while offset < len(data):
+            prefix_len = data[offset]
+            prefix = data[offset + 1:offset + 1 + prefix_len].decode('ascii')
+            offset += 1 + prefix_len
+            self.nodes[prefix] = data[offset:offset + self.summary_size]
+            offset += self.summary_size
+        return True
+
+    def save(self):
+        records = []
+        for prefix in sorted(self.nodes):
+            records.append(bytes([len(prefix)]) + prefix.encode('ascii') + self.nodes[prefix])
+        tmp_path = self.path.with_name(MERKLE + '.' + str(os.getpid()))
+        with open(tmp_path, 'wb') as fh:
+            fh.write(b''.join(records))
+        os.rename(tmp_path, self.path)
+
+    def _hash_leaf(self, prefix):
+        try:
+            names = os.listdir(self.leaf_path(prefix))
+        except FileNotFoundError:
+            names = []
+        digests = sorted(bytes.fromhex(name) for name in names if len(name) == self.fs.hexdigestlen)
+        if not digests:
+            self.nodes.pop(prefix, None)
+            return
+        self.nodes[prefix] = new_hasher(self.fs.algorithm, b''.join(digests)).digest()
+
+    def children(self, prefix):
+        return [prefix + name for name in sorted(self.fs.ns_width) if prefix + name in self.nodes]
+
+    def _hash_parent(self, prefix):
+        hasher = new_hasher(self.fs.algorithm)
+        children = self.children(prefix)
+        if not children:
+            self.nodes.pop(prefix, None)
+            return
+        for child in children:
+            hasher.update(child.encode('ascii') + self.nodes[child])
+        self.nodes[prefix] = hasher.digest()
+
+    def _rehash_parents(self, leaf_prefixes):
+        parents = set(leaf_prefixes)
+        for _ in range(self.fs.depth):
+            parents = set(prefix[:-self.fs.width] for prefix in parents)
+            for prefix in sorted(parents, key=len, reverse=True):
+                self._hash_parent(prefix)
+
+    def update(self, rebuild=False):
+        '''recomputes dirty (or with rebuild, all) summaries, saves them and returns the root summary'''
+        os.makedirs(self.fs.root, exist_ok=True)
+        lock_fd = os.open(self.fs.root / Path(MERKLE_LOCK), os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)  # one update() at a time, they would take each other's dirty files
+            return self._update(rebuild)
+        finally:
+            os.close(lock_fd)
+
+    def _update(self, rebuild):
+        self._take_dirty()
+        taken = self._taken()
+        if rebuild or not self.load():
+            self.nodes = {}
+            leaves = [''.join(leaf.relative_to(self.fs.root / Path(self.fs.algorithm)).parts)
+                      for leaf in self.fs.leaf_folders()]
+        else:
+            leaves = set()
+            for path in taken:
+                with open(path, 'r') as fh:
+                    leaves.update(fh.read().split())
+        for prefix in leaves:
+            self._hash_leaf(prefix)
+        self._rehash_parents(leaves)
+        if self.fs.verbose:
+            print("merkle: rehashed", len(leaves), "leaves", file=sys.stderr)
+        self.save()
+        for path in taken:
+            os.unlink(path)
+        return self.summary()
+
+    def summary(self, prefix=''):
+        if self.nodes is None:
+            self.load()
+        return self.nodes.get(prefix)
+
+    def diverging(self, other, prefix=''):
+        '''yields the leaf prefixes whose summaries differ between self and other'''
+        assert (self.fs.algorithm, self.fs.width, self.fs.depth) == (other.fs.algorithm, other.fs.width, other.fs.depth)
+        if self.summary(prefix) == other.summary(prefix):
+            return
+        if len(prefix) == self.leaf_prefix_len:
+            yield prefix
+            return
+        for child in sorted(set(self.children(prefix)) | set(other.children(prefix))):
+            yield from self.diverging(other, child)
@@ -0,0 +1,218 @@
+"""Per root object table: digest -> size, ingest time, original mtime, content type.
+
+Kept in the append-only _objects log in the root so listings with sizes and
+size reports read one file instead of stat()ing every object. _commit()
+buffers a record per new object and appends them in batches (and at exit),
+deletes append a record with size -1. Each record is
+
+    <digest> <8 byte size> <8 byte ingest time> <8 byte mtime> <1 byte length> <content type>
+
+Appends hold a shared flock on the log and compact() an exclusive one, so
+no append is lost to a compaction. A record torn by a crash or a full disk
+is dropped from the end of the log. Records still buffered when a process
+is killed are lost, so the table is an estimate; rebuild() recreates it
+from a walk of the root, also for roots that had objects before the table
+was enabled.
+"""
+
+import atexit
+import errno
+import fcntl
+import os
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import attr
+from .uhashfs import OBJECTS
+
+RECORD = struct.Struct('>qdd')  # size (-1 when deleted), ingest time, mtime
+
+
+@attr.s(auto_attribs=True, kw_only=True, slots=True)
+class ObjectInfo():
+    size: int
+    ingest_time: float
+    mtime: float
+    content_type: str = ''
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class uHashFSObjects():
+    fs: object
+    flush_every: int = 1024  # records buffered before appending them to the log
+
+    def __attrs_post_init__(self):
+        self.path = self.fs.root / Path(OBJECTS)
+        self.digestlen = self.fs.digestlen
+        self.table = None  # digest -> ObjectInfo, loaded on first query
+        self.pending = []
+        self.lock = threading.RLock()
+        atexit.register(self.flush)
+
+    def add(self, digest, size, mtime=None, content_type=None, ingest_time=None):
+        ingest_time = ingest_time or time.time()
+        content_type = (content_type or '').encode('ascii', 'replace')[:255].decode('ascii')
+        info = ObjectInfo(size=size, ingest_time=ingest_time, mtime=mtime or ingest_time, content_type=content_type)
+        self._append(digest, info)
+
+    def discard(self, digest):
+        self._append(digest, ObjectInfo(size=-1, ingest_time=time.time(), mtime=0))
+
+    def _append(self, digest, info):
+        content_type = info.content_type.encode('ascii')
+        record = digest + RECORD.pack(info.size, info.ingest_time, info.mtime) + bytes([len(content_type)]) + content_type
+        with self.lock:
+            self.pending.append(record)
+            if self.table is not None:
+                self._track(digest, info)
+            if len(self.pending) >= self.flush_every:
+                self.flush()
+
+    def _open_log(self, lock):
+        '''returns an fd of the current log holding lock, reopening it if compact() replaced it meanwhile'''
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            fcntl.flock(fd, lock)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            batch = b''.join(self.pending)
+            fd = self._open_log(fcntl.LOCK_SH)
+            try:
+                written = os.write(fd, batch)  # one write per batch, atomic with O_APPEND
+                if written != len(batch):  # out of space, drop the torn batch so later appends stay aligned
+                    end = os.lseek(fd, 0, os.SEEK_CUR)
+                    if os.fstat(fd).st_size == end:
+                        os.ftruncate(fd, end - written)
+                    raise OSError(errno.ENOSPC, "short write to " + str(self.path))  # pending kept for a retry
+            finally:
+                os.close(fd)
+            self.pending = []
+
+    def _track(self, digest, info):
+        if info.size < 0:
+            self.table.pop(digest, None)
+        else:
+            self.table[digest] = info
+
+    def _parse(self, log):
+        '''yields (digest, ObjectInfo) for the complete records in log, returns the length they take'''
+        offset = 0
+        fixed = self.digestlen + RECORD.size + 1
+        while offset + fixed <= len(log):
+            end = offset + fixed + log[offset + fixed - 1]
+            if end > len(log):
+                break
+            digest = log[offset:offset + self.digestlen]
+            size, ingest_time, mtime = RECORD.unpack_from(log, offset + self.digestlen)
+            content_type = log[offset + fixed:end].decode('ascii')
+            yield digest, ObjectInfo(size=size, ingest_time=ingest_time, mtime=mtime, content_type=content_type)
+            offset = end
+        return offset
+
+    def load(self, repair=True):
+        with self.lock:
+            self.flush()
+            self.table = {}
+            try:
+                with open(self.path, 'rb') as fh:
+                    log = fh.read()
+            except FileNotFoundError:
+                return
+            records = self._parse(log)
+            while True:
+                try:
+                    digest, info = next(records)
+                except StopIteration as done:
+                    complete = done.value
+                    break
+                self._track(digest, info)
+            if complete < len(log) and repair:
+                self._drop_torn(complete, len(log))
+            if self.fs.verbose:
+                print("objects:", len(self.table), "in", self.path, file=sys.stderr)
+
+    def _drop_torn(self, complete, size):
+        '''truncates a record torn by a crash off the end of the log, if nothing was appended after it'''
+        if self.fs.verbose:
+            print("objects: dropping", size - complete, "bytes of a torn record from", self.path, file=sys.stderr)
+        fd = self._open_log(fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size == size:
+                os.ftruncate(fd, complete)
+        finally:
+            os.close(fd)
+
+    def get(self, hexdigest):
+        if self.table is None:
+            self.load()
+        return self.table.get(bytes.fromhex(hexdigest))
+
+    def items(self, refresh=False):
+        '''yields (hexdigest, ObjectInfo) for every object, in digest order'''
+        if self.table is None or refresh:
+            self.load()
+        for digest in sorted(self.table):
+            yield digest.hex(), self.table[digest]
+
+    def totals(self):
+        '''returns (object count, bytes), an estimate, see the module docstring'''
+        if self.table is None:
+            self.load()
+        return len(self.table), sum(info.size for info in self.table.values())
+
+    def compact(self):
+        '''rewrites the log with only the live records, appends by other processes wait for it'''
+        with self.lock:
+            self.flush()
+            fd = self._open_log(fcntl.LOCK_EX)
+            try:
+                self.load(repair=False)  # a torn record is left out of the rewrite, and this holds the lock
+                tmp_path = self.path.with_name(OBJECTS + '.' + str(os.getpid()))
+                with open(tmp_path, 'wb') as fh:
+                    for digest in sorted(self.table):
+                        info = self.table[digest]
+                        content_type = info.content_type.encode('ascii')
+                        fh.write(digest + RECORD.pack(info.size, info.ingest_time, info.mtime) + bytes([len(content_type)]) + content_type)
+                os.rename(tmp_path, self.path)
+            finally:
+                os.close(fd)
+
+    def _scan_leaf(self, leaf):
+        found = []
+        with os.scandir(leaf) as entries:
+            for entry in entries:
+                if len(entry.name) == self.fs.hexdigestlen:
+                    st = entry.stat(follow_symlinks=False)
+                    found.append((bytes.fromhex(entry.name), st.st_size, st.st_ctime, st.st_mtime))
+        return found
+
+    def rebuild(self, workers=None):
+        '''adds the objects in the root missing from the table and drops the ones gone, returns (added, dropped)'''
+        with self.lock:
+            self.load()
+            added = 0
+            seen = set()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for found in pool.map(self._scan_leaf, self.fs.leaf_folders()):
+                    for digest, size, ctime, mtime in found:
+                        seen.add(digest)
+                        if digest not in self.table:
+                            self.add(digest, size, mtime=mtime, ingest_time=ctime)  # ctime is the closest to ingest left
+                            added += 1
+            gone = set(self.table).difference(seen)
+            for digest in gone:
+                self.discard(digest)
+            self.compact()
+            return added, len(gone)
@@ -0,0 +1,85 @@
+"""Bulk reads that leave the page cache to the foreground workload.
+
+check(), export_stream() and copies by putfrom() read every object once;
+through normal buffered I/O that evicts the hot objects being served.
+scan_open() opens an object for one sequential pass in one of CACHE_MODES:
+
+    buffered  plain open()
+    fadvise   POSIX_FADV_SEQUENTIAL (the kernel doubles its readahead) and
+              1 MiB reads, then POSIX_FADV_DONTNEED once read, unless the
+              object was already cached before the pass (probed with a
+              RWF_NOWAIT read), so hot objects stay cached
+    direct    O_DIRECT reads into a page aligned buffer, which never enter
+              the cache; falls back to fadvise where the filesystem refuses
+              O_DIRECT (tmpfs, for one)
+"""
+
+import errno
+import mmap
+import os
+from contextlib import contextmanager
+
+CACHE_MODES = ('buffered', 'fadvise', 'direct')
+READ_SIZE = 1 << 20
+
+
+def is_cached(fd):
+    '''True if the first page of fd is in the page cache'''
+    try:
+        os.preadv(fd, [bytearray(1)], 0, os.RWF_NOWAIT)  # fails instead of reading from the device
+    except BlockingIOError:
+        return False
+    except (AttributeError, OSError):  # no RWF_NOWAIT here, assume a cold object
+        return False
+    return True
+
+
+class DirectReader():
+    '''reads an O_DIRECT fd through an aligned buffer, read() returns up to READ_SIZE bytes whatever size is asked'''
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = mmap.mmap(-1, READ_SIZE)  # anonymous maps are page aligned
+
+    def read(self, size=-1):
+        count = os.readv(self.fd, [self.buffer])  # full aligned blocks, short only at the end
+        return self.buffer[:count]
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        self.buffer.close()
+        os.close(self.fd)
+
+
+@contextmanager
+def scan_open(path, cache_mode='buffered'):
+    '''yields a readable for one sequential pass over path, see CACHE_MODES'''
+    assert cache_mode in CACHE_MODES
+    if cache_mode == 'buffered':
+        with open(path, 'rb') as fh:
+            yield fh
+        return
+    if cache_mode == 'direct':
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise e
+        else:
+            reader = DirectReader(fd)
+            try:
+                yield reader
+            finally:
+                reader.close()
+            return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        cached = is_cached(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        with open(fd, 'rb', buffering=READ_SIZE, closefd=False) as fh:
+            yield fh
+        if not cached:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
@@ -0,0 +1,163 @@
+"""Change the width/depth of a uHashFS root in place.
+
+1. Every object is hardlinked (no data is copied) into a staging root,
+   _reshard/, with the new layout, one old leaf folder per thread pool task.
+   Readers and writers keep using the old layout meanwhile. Links that
+   already exist are skipped, so an interrupted pass is resumed by rerunning.
+2. cutover() rewrites the root descriptor with the new layout and the
+   previous one, then moves the old tree to _reshard.old/ and the staged
+   tree into place. Instances opened after the cutover fall back to
+   _reshard.old/ for anything not yet linked. The descriptor is written
+   first, so a cutover interrupted between the steps is finished by
+   rerunning reshard (or finish). Writers must be stopped for the cutover:
+   one writing between the two renames recreates the tree folder, whose
+   objects a rerun moves into the staged tree, but its writes after the
+   cutover go to the old layout until it is restarted.
+3. finish() links whatever was written to the old tree during the cutover,
+   then removes _reshard.old/ and the staging root.
+
+The emptydigest file used for width/depth autodetection is linked like any
+other object, so autodetection finds it at the new layout. uHashFSMetadata
+trees are not touched: their records are laid out by their own descriptor's
+width/depth, not the data root's.
+"""
+
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from .merkle import uHashFSMerkle
+from .uhashfs import MERKLE
+from .uhashfs import RESHARD
+from .uhashfs import RESHARD_OLD
+from .uhashfs import uHashFS
+
+
+def staging_root(fs, width, depth):
+    return uHashFS(root=fs.root / Path(RESHARD),
+                   algorithm=fs.algorithm,
+                   width=width,
+                   depth=depth,
+                   max_width=max(fs.max_width, width),
+                   max_depth=max(fs.max_depth, depth),
+                   fmode=fs.fmode,
+                   dmode=fs.dmode,
+                   verbose=fs.verbose)
+
+
+def link_leaf(fs, staging, leaf):
+    '''returns the number of objects newly linked from leaf'''
+    linked = 0
+    for name in os.listdir(leaf):
+        if len(name) != fs.hexdigestlen:
+            continue
+        try:
+            address = staging.putfrom(fs, name, link=True)
+        except FileNotFoundError:  # deleted since the listing
+            continue
+        if not address.is_duplicate:
+            linked += 1
+    return linked
+
+
+def link_all(fs, staging, workers=None):
+    '''hardlinks every object of fs into staging, returns the number newly linked'''
+    linked = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for count in pool.map(lambda leaf: link_leaf(fs, staging, leaf), fs.leaf_folders()):
+            linked += count
+            if fs.verbose:
+                print("linked:", linked, end='\r', file=sys.stderr, flush=True)
+    return linked
+
+
+def interrupted_cutover(fs):
+    '''True if the descriptor has the new layout but the staged tree is not in place yet'''
+    return bool(fs.previous_layout) and os.path.exists(fs.root / Path(RESHARD) / Path(fs.algorithm))
+
+
+def link_stray(tree, staging):
+    '''hardlinks the objects in tree, whatever its layout, into staging'''
+    for folder, _, names in os.walk(tree):
+        for name in names:
+            if len(name) != staging.hexdigestlen:
+                continue
+            filepath = staging.hexdigestpath(name)
+            os.makedirs(filepath.parent, exist_ok=True)
+            try:
+                os.link(os.path.join(folder, name), filepath)
+            except FileExistsError:
+                pass
+
+
+def cutover(fs, staging):
+    '''swaps the staged tree into place, finishing one interrupted at any step'''
+    if not fs.previous_layout:
+        fs.previous_layout = (fs.width, fs.depth)
+        fs.width = staging.width
+        fs.depth = staging.depth
+        fs._init_layout()
+        fs._write_descriptor(replace=True)  # the intent, a rerun finishes the swap from here
+    tree = fs.root / Path(fs.algorithm)
+    old_tree = fs.root / Path(RESHARD_OLD) / Path(fs.algorithm)
+    staged_tree = staging.root / Path(staging.algorithm)
+    if not os.path.exists(staged_tree):  # already swapped
+        return
+    os.makedirs(old_tree.parent, exist_ok=True)
+    if not os.path.exists(old_tree):
+        os.rename(tree, old_tree)
+    elif os.path.exists(tree):  # recreated by a writer between the renames
+        link_stray(tree, staging)
+        shutil.rmtree(tree)
+    os.rename(staged_tree, tree)
+
+
+def previous_root(fs):
+    '''the old tree after cutover, as a uHashFS'''
+    return uHashFS(root=fs.root / Path(RESHARD_OLD),
+                   algorithm=fs.algorithm,
+                   width=fs.previous_layout[0],
+                   depth=fs.previous_layout[1],
+                   max_width=max(fs.max_width, fs.previous_layout[0]),
+                   max_depth=max(fs.max_depth, fs.previous_layout[1]),
+                   verbose=fs.verbose)
+
+
+def finish(fs, workers=None):
+    assert fs.previous_layout
+    if interrupted_cutover(fs):
+        cutover(fs, staging_root(fs, fs.width, fs.depth))
+    old = previous_root(fs)
+    fs_without_fallback = uHashFS(root=fs.root, algorithm=fs.algorithm, width=fs.width, depth=fs.depth,
+                                  max_width=fs.max_width, max_depth=fs.max_depth, verbose=fs.verbose)
+    fs_without_fallback.previous_layout = None
+    linked = link_all(old, fs_without_fallback, workers=workers)
+    fs.previous_layout = None
+    fs._write_descriptor(replace=True)
+    shutil.rmtree(old.root)
+    shutil.rmtree(fs.root / Path(RESHARD), ignore_errors=True)
+    if os.path.exists(fs.root / Path(MERKLE)):  # summaries are per shard folder, the folders changed
+        fs.merkle = uHashFSMerkle(fs=fs)
+        fs.merkle.update(rebuild=True)
+    return linked
+
+
+def reshard(fs, width, depth, workers=None, do_cutover=True, do_finish=True):
+    '''returns the number of objects linked into the new layout'''
+    if fs.previous_layout:
+        if not interrupted_cutover(fs) or (width, depth) != (fs.width, fs.depth):
+            raise ValueError("{0} has an unfinished reshard, finish it first".format(fs.root))
+        staging = staging_root(fs, width, depth)  # resume the cutover
+        linked = 0
+    elif (width, depth) == (fs.width, fs.depth):
+        return 0
+    else:
+        staging = staging_root(fs, width, depth)
+        linked = link_all(fs, staging, workers=workers)
+        linked += link_all(fs, staging, workers=workers)  # catch up on objects written during the first pass
+    if do_cutover:
+        cutover(fs, staging)
+        if do_finish:
+            linked += finish(fs, workers=workers)
+    return linked
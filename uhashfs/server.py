@@ -0,0 +1,250 @@
+"""Long running uhashfs server on a unix domain socket, and its client.
+
+Keeps one uHashFS instance warm so short lived workers skip the import and
+root initialisation. The protocol is line based:
+
+    PUT\\n <frames>          -> OK <hexdigest> <is_duplicate>\\n
+    PUTFILE <path>\\n        -> OK <hexdigest> <is_duplicate>\\n
+    GET <hexdigest>\\n       -> OK <size>\\n <size bytes>, cut short if a verified read fails
+    PATH <hexdigest>\\n      -> OK <abspath>\\n
+    EXISTS <hexdigest>\\n    -> OK 0|1\\n
+    DELETE <hexdigest>\\n    -> OK 1\\n
+
+PUT bodies are streamed as frames, a 4 byte big endian length followed by
+that many bytes, terminated by a zero length frame. Errors are answered with
+ERR <exception name> <message>\\n and the connection stays usable, the rest
+of a failed PUT's frames are read and dropped first.
+
+The socket is created mode 0600, only its owner can connect. PUTFILE makes
+the server read a file with its own privileges, so it is refused unless the
+server is given putfile_roots, and then only regular files below them are
+read (a final symlink is not followed).
+"""
+
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+from pathlib import Path
+import attr
+from .uhashfs import path_is_parent
+from .verify import CorruptObjectError
+from .verify import VerifyingReader
+
+FRAME = struct.Struct('>I')
+FRAME_SIZE = 256 * 128 * 2  # same as hash_readable()
+ERRORS = {'FileNotFoundError': FileNotFoundError,
+          'ValueError': ValueError,
+          'PermissionError': PermissionError}
+
+
+def read_exactly(rfile, size):
+    data = rfile.read(size)
+    if len(data) != size:
+        raise ConnectionError("connection closed mid frame")
+    return data
+
+
+def read_frames(rfile):
+    while True:
+        size, = FRAME.unpack(read_exactly(rfile, FRAME.size))
+        if not size:
+            return
+        yield read_exactly(rfile, size)
+
+
+class uHashFSRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        fs = self.server.fs
+        for line in self.rfile:
+            command, _, argument = line.rstrip(b'\n').decode('UTF8').partition(' ')
+            try:
+                if command == 'PUT':
+                    frames = read_frames(self.rfile)
+                    try:
+                        address = fs.putstream(frames)
+                    except Exception:
+                        for _ in frames:  # the rest of the body, so it is not read as commands
+                            pass
+                        raise
+                    self.reply(address.hexdigest, int(address.is_duplicate))
+                elif command == 'PUTFILE':
+                    address = self.putfile(argument)
+                    self.reply(address.hexdigest, int(address.is_duplicate))
+                elif command == 'GET':
+                    with fs.openhexdigest(argument) as fh:
+                        size = os.fstat(fh.fileno()).st_size
+                        self.reply(size)
+                        self.wfile.flush()
+                        if isinstance(fh, VerifyingReader):
+                            self.send_verified(fh)
+                        else:
+                            self.send_file(fh, size)
+                elif command == 'PATH':
+                    self.reply(fs.gethexdigest(argument).abspath)
+                elif command == 'EXISTS':
+                    self.reply(int(fs.existshexdigest(argument)))
+                elif command == 'DELETE':
+                    self.reply(int(fs.deletehexdigest(argument)))
+                else:
+                    raise ValueError("unknown command: " + command)
+            except ConnectionError:
+                return
+            except Exception as e:  # reported to the client, the server keeps running
+                if fs.verbose:
+                    print("error:", command, argument, repr(e), file=sys.stderr)
+                self.wfile.write(' '.join(['ERR', type(e).__name__, str(e).replace('\n', ' ')]).encode('UTF8') + b'\n')
+            self.wfile.flush()
+
+    def putfile(self, path):
+        '''puts a regular file below one of the server's putfile_roots'''
+        path = Path(os.path.realpath(path))
+        if not any(path_is_parent(root, path) for root in self.server.putfile_roots):
+            raise PermissionError("PUTFILE is not allowed for {0}".format(path))
+        # O_NOFOLLOW in case path was replaced by a symlink since, O_NONBLOCK so a fifo does not hang the open
+        with open(path, 'rb', opener=lambda name, flags: os.open(name, flags | os.O_NOFOLLOW | os.O_NONBLOCK)) as fh:
+            if not stat.S_ISREG(os.fstat(fh.fileno()).st_mode):
+                raise ValueError("not a regular file: {0}".format(path))
+            return self.server.fs.putfile(fh)
+
+    def send_file(self, fh, size):
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(self.connection.fileno(), fh.fileno(), offset, size - offset)
+            if not sent:
+                break  # truncated underneath us, the client will notice
+            offset += sent
+
+    def send_verified(self, fh):
+        try:
+            for chunk in iter(lambda: fh.read(FRAME_SIZE), b''):
+                self.wfile.write(chunk)
+        except CorruptObjectError as e:  # the last chunk is never sent, the client sees a short reply
+            print("error: GET", repr(e), file=sys.stderr)
+            raise ConnectionError from e
+
+    def reply(self, *values):
+        self.wfile.write(' '.join(['OK'] + [str(value) for value in values]).encode('UTF8') + b'\n')
+
+
+class uHashFSServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, fs, socket_path, putfile_roots=()):
+        self.fs = fs
+        self.socket_path = str(socket_path)
+        self.putfile_roots = [Path(os.path.realpath(root)) for root in putfile_roots]
+        try:
+            os.unlink(self.socket_path)  # stale socket from a previous run
+        except FileNotFoundError:
+            pass
+        super().__init__(self.socket_path, uHashFSRequestHandler)
+
+    def server_bind(self):
+        super().server_bind()
+        os.chmod(self.socket_path, 0o600)  # before listen(), nobody can connect until then
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def serve(fs, socket_path, putfile_roots=()):
+    with uHashFSServer(fs, socket_path, putfile_roots=putfile_roots) as server:
+        if fs.verbose:
+            print("serving", fs.root, "on", socket_path, file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class uHashFSClient():
+    socket_path: str
+
+    def __attrs_post_init__(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(str(self.socket_path))
+        self.rfile = self.sock.makefile('rb')
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _request(self, command, argument=''):
+        self.sock.sendall((command + ' ' + str(argument)).rstrip().encode('UTF8') + b'\n')
+
+    def _response(self):
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("server closed the connection")
+        status, _, payload = line.rstrip(b'\n').decode('UTF8').partition(' ')
+        if status == 'ERR':
+            name, _, message = payload.partition(' ')
+            raise ERRORS.get(name, RuntimeError)(message)
+        return payload
+
+    def _address(self):
+        hexdigest, is_duplicate = self._response().split(' ')
+        return hexdigest, bool(int(is_duplicate))
+
+    def put(self, data):
+        '''data is bytes or a readable, returns (hexdigest, is_duplicate)'''
+        self._request('PUT')
+        if isinstance(data, bytes):
+            data = memoryview(data)
+            for offset in range(0, len(data), FRAME_SIZE):
+                chunk = data[offset:offset + FRAME_SIZE]
+                self.sock.sendall(FRAME.pack(len(chunk)) + chunk)
+        else:
+            for chunk in iter(lambda: data.read(FRAME_SIZE), b''):
+                self.sock.sendall(FRAME.pack(len(chunk)) + chunk)
+        self.sock.sendall(FRAME.pack(0))
+        return self._address()
+
+    def putfile(self, path):
+        '''the server reads path itself if it is below its putfile_roots, returns (hexdigest, is_duplicate)'''
+        self._request('PUTFILE', os.path.abspath(path))
+        return self._address()
+
+    def getfile(self, hexdigest, fh):
+        '''writes the object to fh, returns its size'''
+        self._request('GET', hexdigest)
+        size = int(self._response())
+        remaining = size
+        while remaining:
+            chunk = self.rfile.read(min(remaining, FRAME_SIZE))
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            fh.write(chunk)
+            remaining -= len(chunk)
+        return size
+
+    def get(self, hexdigest):
+        self._request('GET', hexdigest)
+        return read_exactly(self.rfile, int(self._response()))
+
+    def path(self, hexdigest):
+        self._request('PATH', hexdigest)
+        return self._response()
+
+    def exists(self, hexdigest):
+        self._request('EXISTS', hexdigest)
+        return self._response() == '1'
+
+    def delete(self, hexdigest):
+        self._request('DELETE', hexdigest)
+        return self._response() == '1'
@@ -0,0 +1,116 @@
+"""Single sequential stream format for moving objects between roots.
+
+    header:  b'UHASHFS\\x01' + <1 byte algorithm name length> + <algorithm name>
+    object:  b'O' + <digest> + <8 byte big endian size> + <size bytes>
+    end:     b'E'
+
+Exporting reads objects one after another into the stream. Importing writes
+each object to a temp file as it arrives and hands it to a thread pool that
+hashes it and commits it through the normal _commit()/_mvtemp() path.
+"""
+
+import os
+import shutil
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .pagecache import scan_open
+from .uhashfs import hash_file
+
+MAGIC = b'UHASHFS\x01'
+SIZE = struct.Struct('>Q')
+BLOCK_SIZE = 256 * 128 * 2
+
+
+def read_exactly(readable, size):
+    data = readable.read(size)
+    if len(data) != size:
+        raise EOFError("stream truncated")
+    return data
+
+
+def export_hexdigests(fs):
+    for leaf in fs.leaf_folders():
+        for name in sorted(os.listdir(leaf)):
+            if len(name) == fs.hexdigestlen:
+                yield name
+
+
+def export_stream(fs, writable, hexdigests=None, cache_mode='buffered'):
+    '''writes the objects named by hexdigests (default, the whole root) to writable, returns (count, bytes)
+
+    cache_mode is how objects are read, see pagecache.py.
+    '''
+    if hexdigests is None:
+        hexdigests = export_hexdigests(fs)
+    algorithm = fs.algorithm.encode('ascii')
+    writable.write(MAGIC + bytes([len(algorithm)]) + algorithm)
+    count = 0
+    total = 0
+    for hexdigest in hexdigests:
+        with scan_open(fs.hexdigestpath(hexdigest), cache_mode) as fh:  # not through the cache tier
+            size = os.fstat(fh.fileno()).st_size
+            writable.write(b'O' + bytes.fromhex(hexdigest) + SIZE.pack(size))
+            shutil.copyfileobj(fh, writable, BLOCK_SIZE)
+        count += 1
+        total += size
+        if fs.verbose:
+            print("exported:", hexdigest, size, file=sys.stderr)
+    writable.write(b'E')
+    writable.flush()
+    return count, total
+
+
+def _verify_commit(fs, digest, tmp, verify):
+    if verify:
+        actual = hash_file(tmp.name, fs.algorithm, tmp=None)
+        if actual != digest:
+            tmp.discard()
+            raise ValueError("stream object {0} hashes to {1}".format(digest.hex(), actual.hex()))
+    return fs._commit(digest=digest, tmp=tmp)
+
+
+def import_stream(fs, readable, workers=None, verify=True, skip_existing=True):
+    '''commits every object in readable to fs, yields a HashAddress per object as it is committed'''
+    if read_exactly(readable, len(MAGIC)) != MAGIC:
+        raise ValueError("not a uhashfs stream")
+    algorithm = read_exactly(readable, read_exactly(readable, 1)[0]).decode('ascii')
+    if algorithm != fs.algorithm:
+        raise ValueError("stream algorithm {0} does not match {1}".format(algorithm, fs.algorithm))
+    workers = workers or os.cpu_count()
+    in_flight = threading.BoundedSemaphore(workers * 2)  # temp files written but not yet committed
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        while True:
+            record_type = read_exactly(readable, 1)
+            if record_type == b'E':
+                break
+            if record_type != b'O':
+                raise ValueError("bad record type: {0}".format(record_type))
+            digest = read_exactly(readable, fs.digestlen)
+            size, = SIZE.unpack(read_exactly(readable, SIZE.size))
+            if skip_existing and fs.existshexdigest(digest.hex()):
+                remaining = size
+                while remaining:
+                    remaining -= len(read_exactly(readable, min(remaining, BLOCK_SIZE)))
+                continue
+            tmp = fs._mktemp()
+            try:
+                remaining = size
+                while remaining:
+                    chunk = read_exactly(readable, min(remaining, BLOCK_SIZE))
+                    tmp.write(chunk)
+                    remaining -= len(chunk)
+            finally:
+                tmp.close()
+                if remaining:
+                    tmp.discard()
+            in_flight.acquire()
+            future = pool.submit(_verify_commit, fs, digest, tmp, verify)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+            while futures and futures[0].done():
+                yield futures.pop(0).result()
+        for future in futures:
+            yield future.result()
@@ -0,0 +1,80 @@
+"""Replicate one uHashFS root into another by digest set difference.
+
+Objects are immutable and named by their hash, so a leaf folder is in sync
+when every name in the source listing is in the destination listing. Only
+directory listings are compared (no per-file stat), missing objects are
+hardlinked or copied by a thread pool, one leaf per task. Every object is
+committed atomically, so an interrupted sync is resumed by running it again;
+a state file additionally skips leaves already finished.
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import attr
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class LeafResult():
+    leaf: str
+    source_count: int = 0
+    transferred: int = 0
+    transferred_bytes: int = 0
+
+
+def listdir_or_empty(path):
+    try:
+        return os.listdir(path)
+    except FileNotFoundError:
+        return []
+
+
+def sync_leaf(src, dst, leaf, link=True, verify=True, cache_mode='buffered'):
+    relative_leaf = leaf.relative_to(src.root)
+    dst_leaf = dst.root / relative_leaf
+    result = LeafResult(leaf=relative_leaf.as_posix())
+    source_names = [name for name in listdir_or_empty(leaf) if len(name) == src.hexdigestlen]
+    result.source_count = len(source_names)
+    missing = set(source_names).difference(listdir_or_empty(dst_leaf))
+    for hexdigest in sorted(missing):
+        try:
+            address = dst.putfrom(src, hexdigest, link=link, verify=verify, cache_mode=cache_mode)
+        except FileNotFoundError:  # deleted from src since the listing
+            continue
+        if not address.is_duplicate:
+            result.transferred += 1
+            result.transferred_bytes += os.lstat(address.abspath).st_size
+    return result
+
+
+def read_state(state_file):
+    try:
+        with open(state_file, 'r') as fh:
+            return set(fh.read().splitlines())
+    except FileNotFoundError:
+        return set()
+
+
+def sync(src, dst, workers=None, link=True, verify=True, state_file=None, cache_mode='buffered'):
+    '''yields a LeafResult per leaf folder of src copied to dst'''
+    if (src.algorithm, src.width, src.depth, src.legacy) != (dst.algorithm, dst.width, dst.depth, dst.legacy):
+        raise ValueError("{0} and {1} have different layouts".format(src.root, dst.root))
+    done = set()
+    if state_file:
+        done = read_state(state_file)
+    leaves = (leaf for leaf in src.leaf_folders() if leaf.relative_to(src.root).as_posix() not in done)
+    state = None
+    if state_file:
+        state = open(state_file, 'a')
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(lambda leaf: sync_leaf(src, dst, leaf, link=link, verify=verify, cache_mode=cache_mode), leaves):
+                if state:
+                    state.write(result.leaf + '\n')
+                    state.flush()
+                if src.verbose:
+                    print(result, file=sys.stderr)
+                yield result
+    finally:
+        if state:
+            state.close()
@@ -0,0 +1,216 @@
+"""Access tracking and migration of cold objects to a slower root.
+
+With access enabled, gethexdigest() and openhexdigest() record reads in the
+_access log in the root: a fixed width append-only log of the digest and a
+4 byte read time. A digest is logged at most once per resolution seconds by
+each process, and only a sample of reads is looked at when sample < 1, so
+hot objects cost a dict lookup per read and cold ones a few bytes. Storing
+a new object logs it too, unsampled, so the log also holds ingest times.
+Records are appended in batches under a shared flock, and the log is
+compacted to one record per digest under an exclusive one.
+
+migrate() moves objects not read or ingested within days to the cold tier,
+a second uHashFS root named in the _tier file, and optionally moves objects
+read in the cold tier within promote_days back. Objects stored before the
+access log existed and never read since fall back to their mtime, which
+puts preserve from the original file, so old files may look cold right
+away. ctime is no use: every hardlink (reshard, sync, the cache tier)
+resets it. Reads that miss the fast tier look in the cold tier, so objects
+are found in either.
+"""
+
+import atexit
+import fcntl
+import os
+import random
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from .uhashfs import ACCESS
+
+RECORD = struct.Struct('>I')  # read time in seconds, follows the digest
+DAY = 24 * 60 * 60
+
+
+class AccessLog():
+    def __init__(self, fs, sample=1.0, resolution=60 * 60, flush_every=1024, flush_seconds=60):
+        assert 0 < sample <= 1
+        self.path = fs.root / Path(ACCESS)
+        self.digestlen = fs.digestlen
+        self.record_size = fs.digestlen + RECORD.size
+        self.sample = sample
+        self.resolution = resolution  # seconds a digest is not logged again for
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.logged = {}  # digest -> time last logged by this process, within resolution, pruned on flush
+        self.pending = []
+        self.flushed = time.time()
+        self.lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def touch(self, digest, always=False):
+        '''logs a read of digest, always=True skips sampling, as for ingests'''
+        if not always and self.sample < 1 and random.random() >= self.sample:
+            return
+        now = int(time.time())
+        if self.logged.get(digest, 0) > now - self.resolution:  # racy without the lock, at worst logged twice
+            return
+        with self.lock:
+            self.logged[digest] = now
+            self.pending.append(digest + RECORD.pack(now))
+            if len(self.pending) >= self.flush_every or now - self.flushed > self.flush_seconds:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.flushed = time.time()
+        horizon = self.flushed - self.resolution
+        self.logged = {digest: when for digest, when in self.logged.items() if when > horizon}  # read once, gone
+        if not self.pending:
+            return
+        fd = self._open_log(fcntl.LOCK_SH)
+        try:
+            os.write(fd, b''.join(self.pending))  # one write per batch, atomic with O_APPEND
+        finally:
+            os.close(fd)
+        self.pending = []
+
+    def _open_log(self, lock):
+        '''returns an fd of the current log holding lock, reopening it if compact() replaced it meanwhile'''
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            fcntl.flock(fd, lock)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def load(self):
+        '''returns {digest: last read time} from the log, this process's pending reads included'''
+        self.flush()
+        try:
+            with open(self.path, 'rb') as fh:
+                return self._parse(fh.read())
+        except FileNotFoundError:
+            return {}
+
+    def _parse(self, log):
+        reads = {}
+        for offset in range(0, len(log) - self.record_size + 1, self.record_size):
+            digest = log[offset:offset + self.digestlen]
+            when, = RECORD.unpack_from(log, offset + self.digestlen)
+            if when > reads.get(digest, 0):
+                reads[digest] = when
+        return reads
+
+    def compact(self):
+        '''rewrites the log with the last read of each digest
+
+        holds an exclusive flock from reading the log to replacing it, so
+        batches appended by other processes are either in the rewrite or go
+        to the new log.
+        '''
+        with self.lock:
+            self._flush()
+            fd = self._open_log(fcntl.LOCK_EX)
+            try:
+                with open(self.path, 'rb') as fh:  # the locked inode, checked by _open_log()
+                    reads = self._parse(fh.read())
+                tmp_path = self.path.with_name(ACCESS + '.' + str(os.getpid()))
+                with open(tmp_path, 'wb') as fh:
+                    fh.write(b''.join(digest + RECORD.pack(when) for digest, when in reads.items()))
+                os.rename(tmp_path, self.path)
+            finally:
+                os.close(fd)
+
+
+def demote(fs, hexdigest):
+    '''moves hexdigest from fs to its cold tier, returns False if it was deleted meanwhile'''
+    try:
+        fs.cold.putfrom(fs, hexdigest, link=True, verify=True)
+    except FileNotFoundError:
+        return False
+    fs.delete_many([hexdigest], cold=False)  # readers that miss now find it in the cold tier
+    return True
+
+
+def promote(fs, hexdigest):
+    '''moves hexdigest from the cold tier back to fs, returns False if it was deleted meanwhile'''
+    try:
+        fs.putfrom(fs.cold, hexdigest, link=True, verify=True)
+    except FileNotFoundError:
+        return False
+    fs.cold.delete_many([hexdigest])
+    return True
+
+
+def _scan_leaf(fs, leaf):
+    found = []
+    try:
+        with os.scandir(leaf) as entries:
+            for entry in entries:
+                if len(entry.name) == fs.hexdigestlen:
+                    st = entry.stat(follow_symlinks=False)
+                    found.append((entry.name, st.st_size, st.st_mtime))  # for objects the access log has no ingest of
+    except FileNotFoundError:
+        pass
+    return found
+
+
+def migrate(fs, days, promote_days=None, workers=None, dry_run=False):
+    '''moves objects not read within days to fs.cold, and those read in fs.cold within promote_days back
+
+    returns (demoted count, demoted bytes, promoted count)
+    '''
+    assert fs.cold
+    assert promote_days is None or promote_days <= days  # or objects would move back and forth
+    reads = fs.access.load() if fs.access else {}
+    now = time.time()
+    demoted = demoted_bytes = promoted = 0
+
+    def demote_leaf(leaf):
+        moved = []
+        for hexdigest, size, mtime in _scan_leaf(fs, leaf):
+            if hexdigest == fs.emptyhexdigest:
+                continue  # used for width/depth autodetection
+            if reads.get(bytes.fromhex(hexdigest), mtime) >= now - (days * DAY):
+                continue
+            if dry_run or demote(fs, hexdigest):
+                moved.append((hexdigest, size))
+        return moved
+
+    def promote_leaf(leaf):
+        moved = []
+        for hexdigest, size, _ in _scan_leaf(fs.cold, leaf):
+            if hexdigest == fs.cold.emptyhexdigest:
+                continue
+            if reads.get(bytes.fromhex(hexdigest), 0) < now - (promote_days * DAY):
+                continue
+            if dry_run or promote(fs, hexdigest):
+                moved.append((hexdigest, size))
+        return moved
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for moved in pool.map(demote_leaf, fs.leaf_folders()):
+            demoted += len(moved)
+            demoted_bytes += sum(size for _, size in moved)
+            if fs.verbose:
+                for hexdigest, size in moved:
+                    print("cold:", hexdigest, size, file=sys.stderr)
+        if promote_days is not None:
+            for moved in pool.map(promote_leaf, fs.cold.leaf_folders()):
+                promoted += len(moved)
+                if fs.verbose:
+                    for hexdigest, size in moved:
+                        print("hot:", hexdigest, size, file=sys.stderr)
+    if fs.access and not dry_run:
+        fs.access.compact()
+    return demoted, demoted_bytes, promoted
@@ -0,0 +1,69 @@
+"""Tree hashes of large objects, with the leaves hashed in parallel.
+
+hash_readable() feeds an object to one hasher, so a multi-GB object is hashed
+at one core's speed. The algorithms here are BLAKE2 in its tree mode (fanout
+0, depth 2): the object is split into LEAF_SIZE leaves, each hashed with its
+node_offset on a shared thread pool (hashlib releases the GIL), and the root
+node hashes the concatenated leaf digests.
+
+    leaf i: blake2b(chunk i, node_offset=i, node_depth=0, last_node=<i is the last leaf>)
+    root:   blake2b(leaf 0 + leaf 1 + ..., node_offset=0, node_depth=1, last_node=True)
+
+The digests differ from the flat blake2b/blake2s ones, so these roots keep
+their objects under their own algorithm folder (blake2b_tree/...).
+TreeHasher has the hashlib interface the rest of uhashfs uses.
+"""
+
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+LEAF_SIZE = 1 << 20  # part of the digest, changing it changes every digest
+TREE_BASES = {'blake2b_tree': hashlib.blake2b, 'blake2s_tree': hashlib.blake2s}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def leaf_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix='treehash')
+        return _pool
+
+
+class TreeHasher():
+    def __init__(self, algorithm, data=b'', leaf_size=LEAF_SIZE):
+        self.name = algorithm
+        self.base = TREE_BASES[algorithm]
+        self.digest_size = self.base.MAX_DIGEST_SIZE
+        self.leaf_size = leaf_size
+        self.params = {'digest_size': self.digest_size, 'fanout': 0, 'depth': 2,
+                       'leaf_size': leaf_size, 'inner_size': self.digest_size}
+        self.buffer = bytearray()  # not yet hashed, always holds the last leaf
+        self.leaves = []  # futures of the leaf digests, in node_offset order
+        self.in_flight = threading.BoundedSemaphore((os.cpu_count() or 1) * 2)  # bounds the buffered leaves
+        self.update(data)
+
+    def _leaf(self, chunk, offset, last):
+        return self.base(chunk, node_offset=offset, node_depth=0, last_node=last, **self.params).digest()
+
+    def update(self, data):
+        self.buffer += data
+        while len(self.buffer) > self.leaf_size:  # more follows, so this is not the last leaf
+            chunk = self.buffer[:self.leaf_size]
+            del self.buffer[:self.leaf_size]
+            self.in_flight.acquire()
+            future = leaf_pool().submit(self._leaf, chunk, len(self.leaves), False)
+            future.add_done_callback(lambda _: self.in_flight.release())
+            self.leaves.append(future)
+
+    def digest(self):
+        leaves = [future.result() for future in self.leaves]
+        leaves.append(self._leaf(bytes(self.buffer), len(self.leaves), True))  # not appended, update() may follow
+        return self.base(b''.join(leaves), node_offset=0, node_depth=1, last_node=True, **self.params).digest()
+
+    def hexdigest(self):
+        return self.digest().hex()
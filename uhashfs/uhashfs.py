@@ -8,12 +8,15 @@ import os
 import sys
 import time
 import random
+import threading
+from itertools import islice
 from itertools import product
-from tempfile import NamedTemporaryFile
+from tempfile import mkstemp
 import binascii
-import redis
+import errno
+import shutil
+import atexit
 import attr
-import numpy
 from kcl.printops import eprint
 from kcl.symlinkops import create_relative_symlink
 
@@ -21,6 +24,25 @@ from kcl.symlinkops import create_relative_symlink
 #IPython.embed()
 # todo fix alg duplicates
 
+ROOT_DESCRIPTOR = "_uhashfs"  # algorithm, width and depth, read on open instead of autodetecting
+ROOT_DESCRIPTOR_FORMAT = 1
+CACHE_LOG = "_lru"  # access log of a uHashFSCache root
+MERKLE = "_merkle"  # shard folder summaries, see merkle.py
+MERKLE_DIRTY = "_merkle.dirty"
+MERKLE_LOCK = "_merkle.lock"  # held by update()
+RESHARD = "_reshard"  # new layout staging root, see reshard.py
+RESHARD_OLD = "_reshard.old"  # previous layout after cutover, until the reshard is finished
+VERIFIED = "_verified"  # last hash verification time per object, see verify.py
+OBJECTS = "_objects"  # size, ingest time, mtime and content type per object, see objects.py
+BLOOM = "_bloom"  # filter of the stored digests, see bloom.py
+FEDERATION = "_federation"  # member roots of a federation by digest prefix, see federation.py
+ACCESS = "_access"  # last read time per object, see tier.py
+TIER = "_tier"  # path of the cold tier root, see tier.py
+TOMBSTONE = "_tombstone."  # in _tmp while an object is being deleted, see deletehexdigest()
+TOMBSTONE_STALE = 60  # seconds, tombstones older than this were left by a crashed delete
+O_TMPFILE = getattr(os, 'O_TMPFILE', 0)  # Linux only
+TREE_ALGORITHMS = ('blake2b_tree', 'blake2s_tree')  # leaves hashed in parallel, see treehash.py
+
 
 def really_is_file(path):
     assert isinstance(path, Path)
@@ -112,9 +134,17 @@ def unshard(path):
     return path.name
 
 
+def new_hasher(algorithm, data=b''):
+    '''hashlib.new(), or a treehash.TreeHasher for TREE_ALGORITHMS'''
+    if algorithm in TREE_ALGORITHMS:
+        from .treehash import TreeHasher  # deferred, starts a thread pool on first use
+        return TreeHasher(algorithm, data)
+    return hashlib.new(algorithm, data)
+
+
 def hash_readable(handle, algorithm, tmp):
     block_size = 256 * 128 * 2
-    hasher = hashlib.new(algorithm)
+    hasher = new_hasher(algorithm)
     for chunk in iter(lambda: handle.read(block_size), b''):
         hasher.update(chunk)
         if tmp:
@@ -137,6 +167,43 @@ def hash_file_handle(handle, algorithm, tmp):
     return digest
 
 
+class TempFile():
+    '''an object being written before it is linked into the tree under its digest
+
+    anonymous ones are O_TMPFILE inodes that have no name until link() (via
+    /proc/self/fd) and vanish with the fd if they never get one. The fd stays
+    open after close() until link() or discard().
+    '''
+    def __init__(self, fd, name, anonymous):
+        self.fd = fd
+        self.name = name  # /proc/self/fd/<fd> for anonymous ones, usable with open() and stat()
+        self.anonymous = anonymous
+        self.handle = open(fd, 'wb', closefd=False)
+
+    def write(self, data):
+        return self.handle.write(data)
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        self.handle.close()
+
+    def link(self, filepath):
+        if self.anonymous:
+            # linkat(AT_SYMLINK_FOLLOW) on the /proc magic link; any src_dir_fd makes
+            # os.link() call linkat() rather than link(), it is ignored for absolute paths
+            os.link(self.name, filepath, src_dir_fd=self.fd, follow_symlinks=True)
+        else:
+            os.link(self.name, filepath, follow_symlinks=False)
+
+    def discard(self):
+        self.handle.close()
+        if not self.anonymous:
+            os.unlink(self.name)
+        os.close(self.fd)
+
+
 def path_is_parent(parent, child):
     parent = parent.expanduser().resolve()
     child = child.expanduser().resolve()
@@ -166,46 +233,19 @@ class uHashFSBase():
     verbose: bool = False
     redis: bool = False
     legacy: bool = False
+    io_backend: str = 'auto'  # batched stat/read backend for bulk operations, see batchio.py
+    io_depth: int = 64  # requests it keeps in flight
+    sidecars = (ROOT_DESCRIPTOR, CACHE_LOG, MERKLE, RESHARD, VERIFIED, OBJECTS, BLOOM, ACCESS, TIER)  # prefixes of extra files allowed in root
 
     def __attrs_post_init__(self):
         self.tmp = "_tmp"
         self.root = self.root.resolve()
         if self.verbose:
             print("self.root:", self.root, file=sys.stderr)
-        try:
-            root_item_count = len(os.listdir(self.root))
-        except FileNotFoundError:
-            # thats fine, it has not been written to yet
-            root_item_count = 0
-        if not self.algorithm:
-            if hasattr(self, "uhashfs"):
-                self.algorithm = self.uhashfs.algorithm
-
-            if self.legacy:
-                print("Specify --algorithm to use --legacy", file=sys.stderr)
-                quit(1)  # todo
-
-            if root_item_count == 0:
-                if self.depth is 0 or self.width is 0:  # a new root can be created if these are specified, default_algoritm will be used
-                    print(self.root, "is empty. Specify --algorithm --width and --depth to create a new root.", file=sys.stderr)
-                    quit(1)  # todo: should be raising something
-            elif root_item_count == 2:
-                if not really_is_dir(self.root / Path(self.tmp)):
-                    print(self.root, "has 2 items in it, and one is not", self.tmp, "Specify --algorithm --width and --depth to create a new root in a empty folder.", file=sys.stder)
-                    quit(1)  # todo
-                else:
-                    for alg in list(hashlib.algorithms_available):
-                        if really_is_dir(self.root / Path(alg)):
-                            self.algorithm = alg
-                            break
-                    if not self.algorithm:
-                        print("self.root:", self.root, "does not contain a hash folder. Specify --algorithm --width and --depth to create a new root in a empty folder", file=sys.stderr)
-                        quit(1)  # todo
-
-        if not self.legacy:
-            if root_item_count > 2:
-                print(self.root, "has more than 2 items in it. Specify --algorithm --width and --depth to create a new root in a empty folder.", file=sys.stderr)
-                quit(1)  # todo
+        self.previous_layout = None  # (width, depth) reads fall back to during a reshard
+        self.has_descriptor = self._read_descriptor()
+        if not self.has_descriptor:
+            self._detect_algorithm()
 
         if not self.algorithm:
             self.algorithm = self.default_algorithm
@@ -213,9 +253,9 @@ class uHashFSBase():
         if self.verbose:
             print("self.algorithm:", self.algorithm, file=sys.stderr)
 
-        self.digestlen = hashlib.new(self.algorithm).digest_size
+        self.digestlen = new_hasher(self.algorithm).digest_size
         self.hexdigestlen = self.digestlen * 2
-        self.emptydigest = getattr(hashlib, self.algorithm)(b'').digest()
+        self.emptydigest = new_hasher(self.algorithm, b'').digest()
         # this record is created when _tmp is created (todo!)
         # its used to autodetect the width and depth if a tree
         # it also makes autodetection of the algorithm possible
@@ -223,6 +263,7 @@ class uHashFSBase():
         assert len(self.emptydigest) == self.digestlen
         assert len(self.emptyhexdigest) == self.hexdigestlen
         if self.redis:  # create emptydigest in redis and then do width/depth autodetection
+            import redis  # deferred, only needed when enabled
             self.redis = redis.StrictRedis(host='127.0.0.1')
             app_name = type(self).__module__ + '.' + type(self).__name__
             self.rediskey = ':'.join([app_name, str(self.root), self.algorithm]) + '#'
@@ -258,10 +299,110 @@ class uHashFSBase():
             print("self.width:", self.width, file=sys.stderr)
             print("self.depth:", self.depth, file=sys.stderr)
 
+        self._init_layout()
+
+    def batchio(self):
+        if getattr(self, '_batchio', None) is None:
+            from .batchio import io_backend  # deferred, io_uring imports liburing
+            self._batchio = io_backend(self.io_backend, depth=self.io_depth)
+            if self.verbose:
+                print("batchio:", self._batchio.name, file=sys.stderr)
+        return self._batchio
+
+    def _init_layout(self):
         self.ns = set(['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'a', 'b', 'c', 'd', 'e', 'f'])  # dont make generator or can only be called once
         self.ns_width = set([''.join(comb) for comb in product(self.ns, repeat=self.width)])  # ditto
         self.edge_count = len(self.ns_width) ** self.depth
 
+    def _detect_algorithm(self):
+        # fallback for roots without a descriptor, costs a listdir() and a stat() per algorithm
+        try:
+            root_item_count = len([name for name in os.listdir(self.root) if not name.startswith(self.sidecars)])
+        except FileNotFoundError:
+            # thats fine, it has not been written to yet
+            root_item_count = 0
+        if not self.algorithm:
+            if hasattr(self, "uhashfs"):
+                self.algorithm = self.uhashfs.algorithm
+
+            if self.legacy:
+                print("Specify --algorithm to use --legacy", file=sys.stderr)
+                quit(1)  # todo
+
+            if root_item_count == 0:
+                if self.depth is 0 or self.width is 0:  # a new root can be created if these are specified, default_algoritm will be used
+                    print(self.root, "is empty. Specify --algorithm --width and --depth to create a new root.", file=sys.stderr)
+                    quit(1)  # todo: should be raising something
+            elif root_item_count == 2:
+                if not really_is_dir(self.root / Path(self.tmp)):
+                    print(self.root, "has 2 items in it, and one is not", self.tmp, "Specify --algorithm --width and --depth to create a new root in a empty folder.", file=sys.stderr)
+                    quit(1)  # todo
+                else:
+                    for alg in list(hashlib.algorithms_available) + list(TREE_ALGORITHMS):
+                        if really_is_dir(self.root / Path(alg)):
+                            self.algorithm = alg
+                            break
+                    if not self.algorithm:
+                        print("self.root:", self.root, "does not contain a hash folder. Specify --algorithm --width and --depth to create a new root in a empty folder", file=sys.stderr)
+                        quit(1)  # todo
+
+        if not self.legacy:
+            if root_item_count > 2:
+                print(self.root, "has more than 2 items in it. Specify --algorithm --width and --depth to create a new root in a empty folder.", file=sys.stderr)
+                quit(1)  # todo
+
+    def _read_descriptor(self):
+        '''returns True if the root has a descriptor, its algorithm, width and depth are used'''
+        try:
+            with open(self.root / Path(ROOT_DESCRIPTOR), 'r') as fh:
+                descriptor = dict(line.split('=', 1) for line in fh.read().splitlines() if '=' in line)
+        except FileNotFoundError:  # new root, or one created before descriptors existed
+            return False
+        try:
+            descriptor_format = int(descriptor['format'])
+            settings = {'algorithm': descriptor['algorithm'],
+                        'width': int(descriptor['width']),
+                        'depth': int(descriptor['depth'])}
+        except (KeyError, ValueError):  # being written by another process, or damaged
+            return False
+        if descriptor_format != ROOT_DESCRIPTOR_FORMAT:
+            raise ValueError('{0} has descriptor format {1}, expected {2}'.format(self.root, descriptor_format, ROOT_DESCRIPTOR_FORMAT))
+        for name, value in settings.items():
+            if getattr(self, name) and getattr(self, name) != value:
+                raise ValueError('{0} was created with {1} {2}, not {3}'.format(self.root, name, value, getattr(self, name)))
+            setattr(self, name, value)
+        if 'previous_width' in descriptor:
+            self.previous_layout = (int(descriptor['previous_width']), int(descriptor['previous_depth']))
+        if self.verbose:
+            print("read descriptor:", self.root / Path(ROOT_DESCRIPTOR), file=sys.stderr)
+        return True
+
+    def _write_descriptor(self, replace=False):
+        # called after the first write creates the root (or upgrades an older root)
+        if (self.has_descriptor and not replace) or self.legacy:
+            return
+        descriptor = "format={0}\nalgorithm={1}\nwidth={2}\ndepth={3}\n".format(ROOT_DESCRIPTOR_FORMAT, self.algorithm, self.width, self.depth)
+        if self.previous_layout:
+            descriptor += "previous_width={0}\nprevious_depth={1}\n".format(*self.previous_layout)
+        if replace:
+            tmp_path = self.root / Path(ROOT_DESCRIPTOR + '.' + str(os.getpid()))
+            with open(tmp_path, 'w') as fh:
+                fh.write(descriptor)
+            os.chmod(tmp_path, 0o444)
+            os.rename(tmp_path, self.root / Path(ROOT_DESCRIPTOR))
+            self.has_descriptor = True
+            return
+        try:
+            fd = os.open(self.root / Path(ROOT_DESCRIPTOR), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o444)
+        except FileExistsError:  # another process won the race
+            pass
+        else:
+            try:
+                os.write(fd, descriptor.encode('UTF8'))
+            finally:
+                os.close(fd)
+        self.has_descriptor = True
+
     def _commit_redis(self, digest, filepath):
         if filepath:
             _, mtime = get_amtime(filepath)  # backwards
@@ -270,17 +411,26 @@ class uHashFSBase():
             mtime = str(time.time())
         self.redis.zadd(name=self.rediskey, mapping={digest: mtime})
 
-    def shard(self, hexdigest):
-        return compact([hexdigest[i * self.width:self.width * (i + 1)]
-                        for i in range(self.depth)] + [hexdigest])
+    def shard(self, hexdigest, width=None, depth=None):
+        width = width or self.width
+        depth = depth or self.depth
+        return compact([hexdigest[i * width:width * (i + 1)]
+                        for i in range(depth)] + [hexdigest])
 
-    def hexdigestpath(self, hexdigest):
+    def previoushexdigestpath(self, hexdigest):
+        '''where hexdigest was before the cutover of an unfinished reshard'''
+        return self.root / Path(RESHARD_OLD) / Path(self.algorithm) / Path(*self.shard(hexdigest, *self.previous_layout))
+
+    def validate_hexdigest(self, hexdigest):
         if len(hexdigest) != self.hexdigestlen:
             raise ValueError('Invalid ID: "{0}" is not {1} digits long'.format(hexdigest, self.hexdigestlen))
         try:
             int(hexdigest, 16)
         except ValueError:
             raise ValueError('Invalid ID: "{0}" is not hex'.format(hexdigest))
+
+    def hexdigestpath(self, hexdigest):
+        self.validate_hexdigest(hexdigest)
         paths = self.shard(hexdigest)
         rel_path = Path(os.path.join(*paths))
 
@@ -299,7 +449,13 @@ class uHashFSBase():
             yield thing
 
     def files(self):
-        fiterator = self.paths(path=self.root, return_dirs=False, return_symlinks=False)
+        if self.legacy:
+            path = self.root
+        else:
+            path = self.root / Path(self.algorithm)  # skip _tmp and the root descriptor
+            if not really_is_dir(path) and really_is_dir(self.root):
+                return iter(())  # nothing written yet
+        fiterator = self.paths(path=path, return_dirs=False, return_symlinks=False)
         return fiterator
 
     def edges(self):
@@ -307,8 +463,83 @@ class uHashFSBase():
         leaf_paths = ('/'.join(list(comb)) for comb in ns_depth)
         return leaf_paths
 
+    def leaf_folders(self, path=None, depth=None):
+        '''yields the existing leaf (edge) folders in lexicographic order, listing directories only'''
+        if path is None:
+            if self.legacy:
+                path = self.root
+            else:
+                path = self.root / Path(self.algorithm)
+            depth = self.depth
+        if not depth:
+            yield path
+            return
+        try:
+            with os.scandir(path) as entries:
+                subfolders = sorted(entry.name for entry in entries
+                                    if entry.is_dir(follow_symlinks=False) and len(entry.name) == self.width)
+        except FileNotFoundError:
+            return
+        for subfolder in subfolders:
+            yield from self.leaf_folders(path / subfolder, depth - 1)
+
+    def sorted_hexdigests(self, prefix='', start_after=''):
+        '''yields the hexdigests in the tree in order, only those starting with prefix and after start_after
+
+        shard folders sort like the digests they hold, so only the folders on
+        the way to prefix/start_after are pruned and only each leaf listing is sorted
+        '''
+        if self.legacy:
+            path = self.root
+        else:
+            path = self.root / Path(self.algorithm)
+        yield from self._sorted_hexdigests(path, 0, prefix.lower(), start_after.lower())
+
+    def _sorted_hexdigests(self, path, level, prefix, start_after):
+        if level == self.depth:
+            try:
+                names = os.listdir(path)
+            except FileNotFoundError:
+                return
+            yield from sorted(name for name in names
+                              if len(name) == self.hexdigestlen and name.startswith(prefix) and name > start_after)
+            return
+        begin = level * self.width
+        part_prefix = prefix[begin:begin + self.width]
+        part_start = start_after[begin:begin + self.width]
+        try:
+            with os.scandir(path) as entries:
+                subfolders = sorted(entry.name for entry in entries
+                                    if entry.is_dir(follow_symlinks=False) and len(entry.name) == self.width)
+        except FileNotFoundError:
+            return
+        for subfolder in subfolders:
+            if not subfolder.startswith(part_prefix):
+                continue
+            if subfolder < part_start[:len(subfolder)]:
+                continue
+            if subfolder == part_start:  # still on the path to start_after
+                yield from self._sorted_hexdigests(path / subfolder, level + 1, prefix, start_after)
+            else:  # entirely after it
+                yield from self._sorted_hexdigests(path / subfolder, level + 1, prefix, '')
+
+    def list_hexdigests(self, prefix='', start_after='', limit=1000):
+        '''returns (up to limit hexdigests, cursor), pass the cursor as start_after for the next page, None at the end'''
+        page = list(islice(self.sorted_hexdigests(prefix=prefix, start_after=start_after), limit + 1))
+        if len(page) > limit:
+            return page[:limit], page[limit - 1]
+        return page, None
+
+    def listbatch(self, prefix='', start_after='', limit=None):
+        '''sorted_hexdigests() as a HashBatch, up to limit digests'''
+        batch = HashBatch(self)
+        for hexdigest in islice(self.sorted_hexdigests(prefix=prefix, start_after=start_after), limit):
+            batch.append(bytes.fromhex(hexdigest))
+        return batch
+
     def random_edge_folder(self):
-        random_edge = random.sample(self.ns_width, self.depth)
+        ns_width = sorted(self.ns_width)  # sample() does not take sets since 3.11
+        random_edge = [random.choice(ns_width) for _ in range(self.depth)]  # levels may repeat
         random_edge = os.path.join(*random_edge)
         if self.legacy:
             path = self.root / Path(random_edge)
@@ -317,6 +548,7 @@ class uHashFSBase():
         return path
 
     def estimate_edge_properites(self, variance):
+        import numpy  # deferred, slow to import
         assert variance >= 0
         cnf = 100
         samples = []
@@ -326,8 +558,8 @@ class uHashFSBase():
             random_edge_folder = self.random_edge_folder()
             try:
                 sample = list(self.paths(path=random_edge_folder))
-                for thing in sample:
-                    sample_total_bytes += os.stat(thing).st_size
+                for thing, size in self.batchio().sizes(sample):
+                    sample_total_bytes += size or 0
                 sample = len(sample)
             except FileNotFoundError:
                 sample = 0  # valid and true
@@ -347,6 +579,8 @@ class uHashFSBase():
         return (int(mean), numpy.mean(samples_total_bytes))  # ugly
 
     def estimate_tree_properites(self, variance):
+        if getattr(self, 'objects', None):  # without a walk, misses records buffered by killed processes
+            return self.objects.totals()
         object_count_per_edge, bytes_per_edge = self.estimate_edge_properites(variance=variance)
         if self.verbose:
             print("object_count_per_edge:", object_count_per_edge, file=sys.stderr)
@@ -356,7 +590,36 @@ class uHashFSBase():
         byte_count_estimate = self.edge_count * bytes_per_edge
         return (int(object_count_estimate), byte_count_estimate)
 
-    def check(self, path, skip_cached=False, quiet=False, debug=False):  # todo verify perms and attrs
+    def check(self, path, skip_cached=False, quiet=False, debug=False, cache_mode='buffered'):  # todo verify perms and attrs
+        # objects are hashed by the batchio backend, depth of them ahead of the walk
+        # cache_mode 'fadvise' or 'direct' keeps the scrub from evicting hot objects, see pagecache.py
+        to_hash = self._check_paths(path, skip_cached=skip_cached, quiet=quiet, debug=debug)
+        for path, digest in self.batchio().hashes(to_hash, self.algorithm, cache_mode=cache_mode):
+            try:
+                if digest is None:  # deleted since the walk
+                    continue
+                hexdigest = digest.hex()
+                if self.verbose:
+                    print(path, "(hashed)")
+                try:
+                    assert len(hexdigest) == len(path.name)
+                except AssertionError as e:
+                    eprint("path:", path)
+                    raise e
+                expected_path = self.hexdigestpath(hexdigest)
+                if expected_path != path:
+                    yield (path, HashAddress(digest, self, expected_path))
+                else:
+                    if self.redis:
+                        self._commit_redis(digest, filepath=path)
+                    if getattr(self, 'verified', None):
+                        self.verified.record(digest)
+            except Exception as e:  # bare exception to catch every case and always print the offending file
+                print("Exception on path:", path)
+                raise e
+
+    def _check_paths(self, path, skip_cached=False, quiet=False, debug=False):
+        '''validates the tree below path, yields the object paths that need hashing'''
         #import IPython
         #IPython.embed()
         # todo find broken latest_archive symlinks
@@ -378,10 +641,12 @@ class uHashFSBase():
                     eprint("path:", path)
                     eprint("rel_root:", rel_root)
                 if not self.legacy:
-                    assert rel_root.parts[0] in (self.algorithm, self.tmp)
+                    assert rel_root.parts[0] in (self.algorithm, self.tmp) or rel_root.parts[0].startswith(self.sidecars)
+                if rel_root.parts[0].startswith(self.sidecars):
+                    continue
                 if really_is_file(path):
                     if hasattr(self, "tmproot"):
-                        if path.parts[-2] == self.tmp:
+                        if rel_root.parts[:1] == (self.tmp,):  # in _tmp or a worker folder in it
                             continue
                         if self.redis and skip_cached:
                             if self.redis.zscore(self.rediskey, binascii.unhexlify(path.name)):
@@ -389,29 +654,15 @@ class uHashFSBase():
                                     print(path, "(redis)")
                                 continue
 
-                        digest = hash_file(path, self.algorithm, tmp=None)
-                        hexdigest = digest.hex()
-                        if self.verbose:
-                            print(path, "(hashed)")
-                        try:
-                            assert len(hexdigest) == len(path.name)
-                        except AssertionError as e:
-                            eprint("path:", path)
-                            raise e
-                        expected_path = self.hexdigestpath(hexdigest)
-                        if expected_path != path:
-                            yield (path, HashAddress(digest, self, expected_path))
-                        else:
-                            if self.redis:
-                                self._commit_redis(digest, filepath=path)
+                        yield path
                     else:
                         assert path.lstat().st_size == 0
                 elif really_is_dir(path):
                     try:
+                        if rel_root.parts[:1] == (self.tmp,):
+                            continue
                         if hasattr(self, "tmproot"):
                             assert (len(rel_root.parts) - 1) <= self.depth
-                        if rel_root == Path(self.tmp):
-                            continue
                         if self.legacy:
                             tree_path = rel_root
                         else:
@@ -448,16 +699,35 @@ class uHashFSBase():
 @attr.s(auto_attribs=True, kw_only=True)
 class uHashFSMetadata(uHashFSBase):
     uhashfs: object
+    index: bool = False
+    sidecars = uHashFSBase.sidecars + ("_index.sqlite",)  # and its -wal and -shm files
 
     def __attrs_post_init__(self):
         super().__attrs_post_init__()
         assert isinstance(self.uhashfs, uHashFS)
+        if self.index:
+            from .index import uHashFSIndex
+            self.index = uHashFSIndex(path=self.root / Path("_index.sqlite"), verbose=self.verbose)
+
+    def _replace_latest_archive(self, dest_about, dest_archive):
+        # symlink() to a temp name then rename() over latest_archive, so it never goes missing
+        tmp_link = dest_about / Path(".latest_archive." + str(os.getpid()) + "." + str(threading.get_ident()))
+        try:
+            os.unlink(tmp_link)
+        except FileNotFoundError:
+            pass
+        create_relative_symlink(dest_archive, tmp_link)
+        os.rename(tmp_link, dest_about / Path("latest_archive"))
+
+    def aboutpath(self, about_hash):
+        # this tree's own width/depth, not the data root's, which a reshard changes
+        return self.hexdigestpath(about_hash.hexdigest)
 
     def putrecord(self, about_hash: object, to_hash: object, link_name: str, data_source_name: str, timestamp: str):
         assert isinstance(about_hash, HashAddress)
         assert isinstance(to_hash, HashAddress)
         assert isinstance(link_name, str)
-        dest_about = self.root / about_hash.relative_path
+        dest_about = self.aboutpath(about_hash)
         dest_archive = dest_about / Path("archive") / Path(timestamp)  # todo generalize
         dest = dest_archive / Path(data_source_name)
         try:
@@ -478,15 +748,50 @@ class uHashFSMetadata(uHashFSBase):
         except FileNotFoundError as e:  # I dont really want to, but python wants an except here
             raise e  # shouldnt be possible, unless something deletes the dest dir... TODO
         else:  # only do this stuff if the inner try/except did not throw an exception out
-            try:
-                os.unlink(dest_about / Path("latest_archive"))
-            except FileNotFoundError:  # other process already deleted it, but has not re-created it yet
-                pass
-            try:
-                create_relative_symlink(dest_archive, dest_about / Path("latest_archive"))
-            except FileExistsError:
-                # another process won the race
-                pass
+            self._replace_latest_archive(dest_about, dest_archive)
+            self._write_descriptor()
+            if self.index:
+                self.index.add([(about_hash.digest, to_hash.digest, data_source_name, link_name, timestamp)])
+
+    def putrecords(self, records):
+        '''records is an iterable of (about_hash, to_hash, link_name, data_source_name, timestamp) tuples
+
+        same result as calling putrecord() on each, but each archive folder is created once
+        and latest_archive is replaced once per about_hash, returns the number of records written
+        '''
+        groups = {}
+        latest = {}
+        indexed = []
+        count = 0
+        for about_hash, to_hash, link_name, data_source_name, timestamp in records:
+            assert isinstance(about_hash, HashAddress)
+            assert isinstance(to_hash, HashAddress)
+            assert isinstance(link_name, str)
+            dest_about = self.aboutpath(about_hash)
+            groups.setdefault((dest_about, timestamp), []).append((data_source_name, link_name, to_hash.hexdigest))
+            latest[dest_about] = timestamp  # last one wins, like putrecord()
+            if self.index:
+                indexed.append((about_hash.digest, to_hash.digest, data_source_name, link_name, timestamp))
+            count += 1
+
+        for (dest_about, timestamp), links in groups.items():
+            dest_archive = dest_about / Path("archive") / Path(timestamp)
+            for data_source_name in set(link[0] for link in links):
+                os.makedirs(dest_archive / Path(data_source_name), exist_ok=True)
+            for data_source_name, link_name, to_hexdigest in links:
+                try:
+                    os.symlink(to_hexdigest, dest_archive / Path(data_source_name) / Path(link_name))
+                except FileExistsError:
+                    # another process won the symlink race
+                    pass
+
+        for dest_about, timestamp in latest.items():
+            self._replace_latest_archive(dest_about, dest_about / Path("archive") / Path(timestamp))
+        if latest:
+            self._write_descriptor()
+        if self.index:
+            self.index.add(indexed)
+        return count
 
 
 @attr.s(auto_attribs=True, kw_only=True)
@@ -495,43 +800,167 @@ class uHashFS(uHashFSBase):
 
     Attributes:
         root (str): Directory path used as root of storage space.
-        tmproot (str): Optional directory used for NamedTemporaryFile storage
-            space. Defaults to the hashfs root. Must be on the same filesystem.
+        tmproot (str): Directory holding named temp files (one subfolder per worker
+            thread) where O_TMPFILE is not supported. Must be on the same filesystem.
         depth (int, optional): Depth of subfolders to create when saving a file.
         width (int, optional): Width of each subfolder to create when saving a file.
         algorithm (str): Hash algorithm to use when computing file hash.
-            Algorithm should be available in ``hashlib`` module.
+            Algorithm should be available in ``hashlib`` module, or one of
+            TREE_ALGORITHMS.
         fmode (int, optional): File mode permission to set when adding files to a directory.
         dmode (int, optional): Directory mode permission to set for subdirectories.
+        cache_root (str, optional): uHashFS root on faster storage, consulted first by
+            gethexdigest() and openhexdigest() and populated on a miss.
+        cache_bytes (int, optional): Size the cache root is kept under by LRU eviction.
+        merkle (bool, optional): Track changed shard folders for merkle.py summaries,
+            enabled automatically once the root has a _merkle file.
+        verify (bool, optional): openhexdigest() returns readers that raise
+            CorruptObjectError at EOF if the object does not hash to its name.
+        verify_days (float, optional): Only verify objects not verified within this
+            many days, according to the root's _verified log.
+        objects (bool, optional): Record size, ingest time, mtime and content type of
+            new objects in the objects.py table, enabled automatically once the root
+            has an _objects file.
+        bloom (bool, optional): Answer definite misses from the bloom.py filter, built
+            by a walk if the root has no _bloom file yet, enabled automatically once
+            it has one.
+        access (bool, optional): Log reads by gethexdigest() and openhexdigest() for
+            tier.py, enabled automatically once the root has an _access file.
+        access_sample (float, optional): Fraction of reads looked at by the access log.
+        cold_root (str, optional): uHashFS root on slower storage that tier.py moves
+            objects not read recently to, and that reads missing this root fall back
+            to. Recorded in the root's _tier file, so only needed once.
     """
+    cache_root: str = ''
+    cache_bytes: int = 0
+    merkle: bool = False
+    verify: bool = False
+    verify_days: float = 0
+    objects: bool = False
+    bloom: bool = False
+    access: bool = False
+    access_sample: float = 1.0
+    cold_root: str = ''
 
     def __attrs_post_init__(self):
         super().__attrs_post_init__()
         self.tmproot = self.root / Path(self.tmp)
+        self.anonymous_tmp = bool(O_TMPFILE) and os.path.isdir('/proc/self/fd')  # cleared if the filesystem refuses O_TMPFILE
+        self.tmp_workers = set()
+        self.cache = None
+        if self.cache_root:
+            from .cache import uHashFSCache
+            self.cache = uHashFSCache(origin=self, root=self.cache_root, max_bytes=self.cache_bytes, verbose=self.verbose)
+        if self.merkle or os.path.exists(self.root / Path(MERKLE)):
+            from .merkle import uHashFSMerkle
+            self.merkle = uHashFSMerkle(fs=self)
+        self.verified = None
+        if self.verify or self.verify_days or os.path.exists(self.root / Path(VERIFIED)):
+            from .verify import VerificationLog
+            self.verified = VerificationLog(self)
+            atexit.register(self.verified.flush)
+        if self.objects or os.path.exists(self.root / Path(OBJECTS)):
+            from .objects import uHashFSObjects
+            self.objects = uHashFSObjects(fs=self)
+        if self.bloom or os.path.exists(self.root / Path(BLOOM)):
+            from .bloom import uHashFSBloom
+            bloom = uHashFSBloom(fs=self)
+            if bloom.map is None:
+                bloom.rebuild()
+            self.bloom = bloom
+        if self.access or os.path.exists(self.root / Path(ACCESS)):
+            from .tier import AccessLog
+            self.access = AccessLog(fs=self, sample=self.access_sample)
+        self.cold = None
+        self._init_cold_tier()
+
+    def _init_cold_tier(self):
+        tier_path = self.root / Path(TIER)
+        if self.cold_root:
+            self.cold_root = str(Path(self.cold_root).resolve())
+            try:
+                with open(tier_path, 'r') as fh:
+                    recorded = fh.read().strip()
+            except FileNotFoundError:
+                recorded = None
+            if recorded != self.cold_root:
+                os.makedirs(self.root, exist_ok=True)
+                with open(tier_path.with_name(TIER + '.' + str(os.getpid())), 'w') as fh:
+                    fh.write(self.cold_root + '\n')
+                os.rename(tier_path.with_name(TIER + '.' + str(os.getpid())), tier_path)
+        else:
+            try:
+                with open(tier_path, 'r') as fh:
+                    self.cold_root = fh.read().strip()
+            except FileNotFoundError:
+                return
+        layout = {'width': self.width, 'depth': self.depth}
+        if os.path.exists(Path(self.cold_root) / Path(ROOT_DESCRIPTOR)):
+            layout = {}  # keeps its own layout if this root is resharded
+        self.cold = uHashFS(root=self.cold_root,
+                            algorithm=self.algorithm,
+                            **layout,
+                            fmode=self.fmode,
+                            dmode=self.dmode,
+                            verbose=self.verbose)
 
     def _mktemp(self):
+        tmp = None
+        if self.anonymous_tmp:
+            try:
+                tmp = self._mktemp_anonymous()
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL):
+                    raise e
+                self.anonymous_tmp = False  # kernel or filesystem without O_TMPFILE
+        if tmp is None:
+            tmp = self._mktemp_named()
+        if not self.has_descriptor:
+            self._write_descriptor()
+        if self.fmode is not None:
+            os.fchmod(tmp.fd, self.fmode)
+        return tmp
+
+    def _mktemp_anonymous(self):
+        # no directory entry until _mvtemp() links it, nothing is left behind by a crash
         try:
-            tmp = NamedTemporaryFile(delete=False, dir=self.tmproot, prefix='_tmp')
+            fd = os.open(self.root, O_TMPFILE | os.O_RDWR, 0o600)
         except FileNotFoundError:
-            os.makedirs(self.tmproot)
-            tmp = NamedTemporaryFile(delete=False, dir=self.tmproot, prefix='_tmp')
-
-        if self.fmode is not None:
-            oldmask = os.umask(0)
-            os.chmod(tmp.name, self.fmode)
-            os.umask(oldmask)
+            os.makedirs(self.root, exist_ok=True)
+            fd = os.open(self.root, O_TMPFILE | os.O_RDWR, 0o600)
+        return TempFile(fd, '/proc/self/fd/' + str(fd), anonymous=True)
 
-        return tmp
+    def _mktemp_named(self):
+        # a folder per worker thread, so concurrent writers don't all create and unlink in one folder
+        worker = self.tmproot / Path(str(os.getpid()) + '.' + str(threading.get_ident()))
+        try:
+            fd, name = mkstemp(dir=worker, prefix='_tmp')
+        except FileNotFoundError:
+            os.makedirs(worker, exist_ok=True)
+            if not self.tmp_workers:
+                atexit.register(self._remove_tmp_workers)
+            self.tmp_workers.add(worker)
+            fd, name = mkstemp(dir=worker, prefix='_tmp')
+        return TempFile(fd, name, anonymous=False)
+
+    def _remove_tmp_workers(self):
+        for worker in self.tmp_workers:
+            try:
+                os.rmdir(worker)
+            except OSError:  # not empty, or already gone
+                pass
 
     def _mvtemp(self, tmp, filepath, mtime=False):  # todo add test for mtime=False
-        '''returns True if file existed, False if new'''
+        '''links the TempFile tmp to filepath, returns True if file existed, False if new'''
         # if filepath does not exist, rename now
         try:
-            os.link(tmp, filepath, follow_symlinks=False)
+            tmp.link(filepath)
             if mtime:
                 os.utime(filepath, ns=mtime, follow_symlinks=False)  # purpose fail if this throws an exception
         except FileExistsError:
-            os.unlink(tmp)
+            if self._deleted_meanwhile(filepath):
+                return self._mvtemp(tmp, filepath, mtime)  # store it again
+            tmp.discard()
             return True
             # link() returned -1 EEXIST (File exists)
             # at this point a special case could be checked
@@ -559,16 +988,16 @@ class uHashFS(uHashFSBase):
             try:
                 os.makedirs(os.path.dirname(filepath), self.dmode)
             except FileExistsError:  # another process won the mkdir race
-                assert really_is_dir(os.path.dirname(filepath))  # rare, no harm checking assumptions
+                assert really_is_dir(filepath.parent)  # rare, no harm checking assumptions
 
             try:
-                os.link(tmp, filepath, follow_symlinks=False)  # rare, another process could win this race too
+                tmp.link(filepath)  # rare, another process could win this race too
                 if mtime:
                     os.utime(filepath, ns=mtime, follow_symlinks=False)  # purpose fail if this throws an exception
             except FileExistsError:
                 pass  # could verify hash, but cant think of a reason it could be more likely wrong (due to this code) other than those covered by check()
 
-        os.unlink(tmp)  # only if link() didnt throw exception, it should not be possible for this to throw an exception due to a race by virtue of tmp file uniqueness per-process
+        tmp.discard()  # only if link() didnt throw exception, it should not be possible for this to throw an exception due to a race by virtue of tmp file uniqueness per-process
         return False  # file did not already exist
 
     def putstr(self, string):
@@ -578,12 +1007,21 @@ class uHashFS(uHashFSBase):
             string = io.BytesIO(string)
         return self.putstream(string)
 
-    def putstream(self, request, progress=False):
+    def putstream(self, request, progress=False, content_type=None):
+        if content_type is None:
+            try:
+                content_type = request.headers.get('Content-Type')
+            except AttributeError:
+                pass
         tmp = self._mktemp()
-        digest = self.computehash(request, tmp, progress=progress)
-        return self._commit(digest=digest, tmp=tmp)
+        try:
+            digest = self.computehash(request, tmp, progress=progress)
+        except BaseException:
+            tmp.discard()
+            raise
+        return self._commit(digest=digest, tmp=tmp, content_type=content_type)
 
-    def putfile(self, infile, preserve_mtime=True):
+    def putfile(self, infile, preserve_mtime=True, content_type=None):
         if preserve_mtime:
             mtime = get_amtime(infile)
         else:
@@ -599,22 +1037,138 @@ class uHashFS(uHashFSBase):
                              "root: {1}".format(str(infile.__repr__()), self.root))  # cant just print Path's
         tmp = self._mktemp()
         try:
-            digest = hash_file(infile, self.algorithm, tmp)
-        except TypeError:
-            digest = hash_file_handle(infile, self.algorithm, tmp)  # bug, could get passed False and "work"
-        return self._commit(digest=digest, tmp=tmp, mtime=mtime)
-
-    def _commit(self, digest, tmp, mtime=False):
+            try:
+                digest = hash_file(infile, self.algorithm, tmp)
+            except TypeError:
+                digest = hash_file_handle(infile, self.algorithm, tmp)  # bug, could get passed False and "work"
+        except BaseException:
+            tmp.discard()  # the input vanished or could not be read
+            raise
+        return self._commit(digest=digest, tmp=tmp, mtime=mtime, content_type=content_type)
+
+    def putbatch(self, infiles, preserve_mtime=True):
+        '''putfile() of each of infiles, returns a HashBatch flagged if the object was a duplicate'''
+        batch = HashBatch(self)
+        for infile in infiles:
+            address = self.putfile(infile, preserve_mtime=preserve_mtime)
+            batch.append(address.digest, address.is_duplicate)
+        return batch
+
+    def _commit(self, digest, tmp, mtime=False, content_type=None):
         assert isinstance(digest, bytes)
         filepath = self.digestpath(digest)
-        is_duplicate = self._mvtemp(tmp.name, filepath, mtime)
+        if self.bloom:
+            bloom_map = self.bloom.add(digest)  # before it is visible, the filter must never miss a stored object
+        is_duplicate = self._mvtemp(tmp, filepath, mtime)
+        if self.bloom:
+            self.bloom.readd_if_retired(digest, bloom_map)
+        if self.merkle and not is_duplicate:
+            self.merkle.mark_dirty(digest.hex())
+        if self.access and not is_duplicate:
+            self.access.touch(digest, always=True)  # the ingest time tier.py goes by
+        if self.objects and not is_duplicate:
+            self._record_object(digest, filepath, mtime, content_type)
         if self.redis:
             self._commit_redis(digest=digest, filepath=filepath)
         return HashAddress(digest, self, filepath, is_duplicate)
 
+    def _record_object(self, digest, filepath, mtime=False, content_type=None):
+        if mtime:
+            mtime = mtime[1] / 1e9  # (atime_ns, mtime_ns) from get_amtime()
+        self.objects.add(digest, os.lstat(filepath).st_size, mtime=mtime, content_type=content_type)
+
+    def putfrom(self, fs, hexdigest, link=True, verify=True, cache_mode='buffered'):
+        '''copies hexdigest from another uHashFS root without rehashing it under a new name
+
+        hardlinks when link is set and both roots are on the same filesystem,
+        otherwise copies, raising ValueError if verify is set and the source
+        does not hash to its name, whether linked or copied. cache_mode is how
+        the source is read, see pagecache.py.
+        '''
+        assert fs.algorithm == self.algorithm
+        source = fs.hexdigestpath(hexdigest)
+        filepath = self.hexdigestpath(hexdigest)
+        digest = bytes.fromhex(hexdigest)
+        if not really_is_file(source) and fs.previous_layout:
+            source = fs.previoushexdigestpath(hexdigest)
+        if not really_is_file(source):
+            raise FileNotFoundError(source)
+        from .pagecache import scan_open  # deferred
+        if link:
+            if verify:
+                with scan_open(source, cache_mode) as fh:
+                    if hash_readable(fh, self.algorithm, None) != digest:
+                        raise ValueError("{0} does not hash to its name".format(source))
+            if self.bloom:
+                bloom_map = self.bloom.add(digest)
+            try:
+                while True:
+                    try:
+                        try:
+                            os.link(source, filepath, follow_symlinks=False)
+                        except FileNotFoundError:
+                            os.makedirs(filepath.parent, self.dmode, exist_ok=True)
+                            os.link(source, filepath, follow_symlinks=False)
+                        break
+                    except FileExistsError:
+                        if not self._deleted_meanwhile(filepath):
+                            return HashAddress(digest, self, filepath, True)
+                        # link it again, as _mvtemp() does
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):  # not linkable, copy it
+                    raise e
+            else:
+                if self.bloom:
+                    self.bloom.readd_if_retired(digest, bloom_map)
+                if not self.has_descriptor:
+                    self._write_descriptor()
+                if self.merkle:
+                    self.merkle.mark_dirty(hexdigest)
+                if self.access:
+                    self.access.touch(digest, always=True)
+                if self.objects:
+                    self._record_object(digest, filepath, get_amtime(filepath), fs.content_type(hexdigest))
+                if self.redis:
+                    self._commit_redis(digest=digest, filepath=filepath)
+                return HashAddress(digest, self, filepath, False)
+
+        tmp = self._mktemp()
+        with scan_open(source, cache_mode) as fh:
+            if verify:
+                copied = hash_readable(fh, self.algorithm, tmp)  # closes tmp
+            else:
+                shutil.copyfileobj(fh, tmp, 256 * 128 * 2)
+                tmp.close()
+                copied = digest
+        if copied != digest:
+            tmp.discard()
+            raise ValueError("{0} does not hash to its name".format(source))
+        return self._commit(digest=digest, tmp=tmp, mtime=get_amtime(source), content_type=fs.content_type(hexdigest))
+
+    def content_type(self, hexdigest):
+        '''from the objects table, None if unknown'''
+        if self.objects:
+            info = self.objects.get(hexdigest)
+            if info and info.content_type:
+                return info.content_type
+        return None
+
     def gethexdigest(self, hexdigest):
         realpath = self.hexdigestpath(hexdigest)
         digest = binascii.unhexlify(hexdigest)
+        if self.access:
+            self.access.touch(digest)
+        if self.bloom and not self.bloom.might_contain(digest):
+            if self.cold:
+                return self.cold.gethexdigest(hexdigest)
+            raise FileNotFoundError(realpath)
+        if self.cache:
+            try:
+                return self.cache.get(hexdigest)
+            except FileNotFoundError as e:
+                if not self.cold:
+                    raise e
+                return self.cold.gethexdigest(hexdigest)
 
         if self.redis:
             if self.redis.zscore(self.rediskey, digest):
@@ -630,6 +1184,10 @@ class uHashFS(uHashFSBase):
 
         if really_is_file(realpath):
             return HashAddress(digest, self, realpath)  # todo
+        if self.previous_layout and really_is_file(self.previoushexdigestpath(hexdigest)):
+            return HashAddress(digest, self, self.previoushexdigestpath(hexdigest))
+        if self.cold:
+            return self.cold.gethexdigest(hexdigest)
         raise FileNotFoundError
 
     def getdigest(self, digest):
@@ -650,44 +1208,213 @@ class uHashFS(uHashFSBase):
         raise FileNotFoundError
 
     def opendigest(self, digest, mode='rb'):
-        hexdigest = binascii.unhexlify(digest)
-        return self.openhexdigest(hexdigest)
-
-    def openhexdigest(self, hexdigest, mode='rb'):
+        hexdigest = digest.hex()
+        return self.openhexdigest(hexdigest, mode)
+
+    def openhexdigest(self, hexdigest, mode='rb', verify=None):
+        '''verify, default from the verify/verify_days fields, wraps the handle in a VerifyingReader'''
+        fh = self._openhexdigest(hexdigest, mode)
+        if verify is None:
+            verify = self.verify or self.verify_days
+            if verify and self.verify_days and not self.verified.is_due(bytes.fromhex(hexdigest), self.verify_days):
+                verify = False
+        if not verify or mode != 'rb':
+            return fh
+        from .verify import VerifyingReader
+        on_verified = None
+        if self.verified:
+            on_verified = self.verified.record
+        return VerifyingReader(fh, bytes.fromhex(hexdigest), self.algorithm, on_verified=on_verified)
+
+    def _openhexdigest(self, hexdigest, mode='rb'):
         realpath = self.hexdigestpath(hexdigest)
-        return io.open(realpath, mode)
+        if self.access:
+            self.access.touch(bytes.fromhex(hexdigest))
+        try:
+            return self._openhot(hexdigest, realpath, mode)
+        except FileNotFoundError as e:
+            if not self.cold:
+                raise e
+        return self.cold._openhexdigest(hexdigest, mode)
+
+    def _openhot(self, hexdigest, realpath, mode):
+        if self.bloom and not self.bloom.might_contain(bytes.fromhex(hexdigest)):
+            raise FileNotFoundError(realpath)
+        if self.cache:
+            return self.cache.open(hexdigest, mode)
+        try:
+            return io.open(realpath, mode)
+        except FileNotFoundError as e:
+            if not self.previous_layout:
+                raise e
+        return io.open(self.previoushexdigestpath(hexdigest), mode)
 
     def deletedigest(self, digest):
         assert isinstance(digest, bytes)
-        hexdigest = binascii.unhexlify(digest)
+        hexdigest = digest.hex()
         return self.deletehexdigest(hexdigest)
 
     def deletehexdigest(self, hexdigest):
-        realpath = self.hexdigestpath(hexdigest)
-        assert path_is_parent(self.root, realpath)
-        assert hexdigest != self.emptyhexdigest  # used for depth, width and algorithm auto-detection
-        os.remove(realpath)
-        if self.redis:
-            digest = binascii.unhexlify(hexdigest)
-            self.redis.srem(self.rediskey, digest)
+        if not self.delete_many([hexdigest]):
+            raise FileNotFoundError(self.hexdigestpath(hexdigest))
         return True
 
+    def delete_many(self, hexdigests, chunk_size=1000, cold=True):
+        '''deletes every object in hexdigests that exists, returns the list of those deleted
+
+        cold=False leaves the cold tier alone, as tier.demote() needs.
+
+        redis entries are removed before the files, so readers stop trusting
+        them, and again after, since a concurrent put of the same object that
+        found the file before its tombstone existed adds it back in between;
+        redis may then miss an object, but never claims a deleted one.
+        merkle, the cache tier and the objects table are updated after.
+        '''
+        deleted = []
+        hexdigests = iter(hexdigests)
+        while True:
+            chunk = list(islice(hexdigests, chunk_size))
+            if not chunk:
+                return deleted
+            for hexdigest in chunk:
+                assert path_is_parent(self.root, self.hexdigestpath(hexdigest))  # also validates it
+                assert hexdigest != self.emptyhexdigest  # used for depth, width and algorithm auto-detection
+            if self.redis:
+                self.redis.zrem(self.rediskey, *[bytes.fromhex(hexdigest) for hexdigest in chunk])
+            removed = [hexdigest for hexdigest in chunk if self._remove(hexdigest)]
+            if self.redis and removed:
+                self.redis.zrem(self.rediskey, *[bytes.fromhex(hexdigest) for hexdigest in removed])
+            if self.cold and cold:
+                removed = set(removed).union(self.cold.delete_many(chunk))
+                removed = [hexdigest for hexdigest in chunk if hexdigest in removed]
+            for hexdigest in removed:
+                if self.merkle:
+                    self.merkle.mark_dirty(hexdigest)
+                if self.cache:
+                    self.cache.discard(hexdigest)
+                if self.objects:
+                    self.objects.discard(bytes.fromhex(hexdigest))
+            deleted.extend(removed)
+
+    def _tombstone(self, hexdigest):
+        return self.tmproot / Path(TOMBSTONE + hexdigest)
+
+    def _wait_for_tombstone(self, tombstone):
+        '''returns True if a delete was in progress, after waiting for it to finish'''
+        waited = False
+        while True:
+            try:
+                age = time.time() - os.lstat(tombstone).st_mtime
+            except FileNotFoundError:
+                return waited
+            if age > TOMBSTONE_STALE:
+                try:
+                    os.unlink(tombstone)
+                except FileNotFoundError:
+                    pass
+                return waited
+            waited = True
+            time.sleep(0.001)
+
+    def _remove(self, hexdigest):
+        '''removes the object file (and its previous layout path), returns False if there was none
+
+        a tombstone in _tmp marks the delete as in progress, so a concurrent put
+        of the same object that found it already stored waits for the delete and
+        stores it again, see _deleted_meanwhile()
+        '''
+        tombstone = self._tombstone(hexdigest)
+        while True:
+            try:
+                os.close(os.open(tombstone, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+                break
+            except FileExistsError:
+                self._wait_for_tombstone(tombstone)  # another delete of the same object
+            except FileNotFoundError:
+                os.makedirs(self.tmproot, exist_ok=True)
+        try:
+            paths = [self.hexdigestpath(hexdigest)]
+            if self.previous_layout:
+                paths.append(self.previoushexdigestpath(hexdigest))
+            removed = False
+            for path in paths:
+                try:
+                    os.remove(path)
+                    removed = True
+                except FileNotFoundError:
+                    pass
+            return removed
+        finally:
+            os.unlink(tombstone)
+
+    def _deleted_meanwhile(self, filepath):
+        '''after link() found filepath, True if a delete in progress could have removed it since'''
+        if self._wait_for_tombstone(self._tombstone(filepath.name)):
+            return True
+        return not os.path.lexists(filepath)  # a whole delete could have run between link() and the check
+
     def existsdigest(self, digest):
-        if self.redis:
-            if self.redis.zscore(self.rediskey, digest):
-                return True
-            #return False  # hm, assume redis is consistent?
-        hexdigest = binascii.unhexlify(digest)
+        hexdigest = digest.hex()
         return self.existshexdigest(hexdigest)
 
     def existshexdigest(self, hexdigest):
+        if self._existshot(hexdigest):
+            return True
+        return self.cold is not None and self.cold.existshexdigest(hexdigest)
+
+    def _existshot(self, hexdigest):
+        if self.bloom:
+            self.validate_hexdigest(hexdigest)
+            if not self.bloom.might_contain(bytes.fromhex(hexdigest)):
+                return False
         if self.redis:
             digest = binascii.unhexlify(hexdigest)
             if self.redis.zscore(self.rediskey, digest):
                 return True
             #return False  # hm, assume redis is consistent?
         hexdigestpath = self.hexdigestpath(hexdigest)
-        return really_is_file(hexdigestpath)
+        if really_is_file(hexdigestpath):
+            return True
+        if self.previous_layout:
+            return really_is_file(self.previoushexdigestpath(hexdigest))
+        return False
+
+    def existsmany(self, hexdigests):
+        '''yields (hexdigest, exists) in order, with io_depth stat()s in flight, skips redis'''
+        if self.bloom:
+            results = self._existsmany_filtered(hexdigests)
+        else:
+            results = self._existsmany_unfiltered(hexdigests)
+        if self.cold:
+            return ((hexdigest, exists or self.cold.existshexdigest(hexdigest)) for hexdigest, exists in results)
+        return results
+
+    def existsbatch(self, hexdigests):
+        '''existsmany() as a HashBatch, flagged if the object exists'''
+        batch = HashBatch(self)
+        for hexdigest, exists in self.existsmany(hexdigests):
+            batch.append(bytes.fromhex(hexdigest), exists)
+        return batch
+
+    def _existsmany_filtered(self, hexdigests):
+        '''existsmany() that only stat()s the digests the bloom filter might contain'''
+        hexdigests = iter(hexdigests)
+        while True:
+            chunk = list(islice(hexdigests, self.io_depth * 4))
+            if not chunk:
+                return
+            maybe = [hexdigest for hexdigest in chunk if self.bloom.might_contain(bytes.fromhex(hexdigest))]
+            found = dict(self._existsmany_unfiltered(maybe))
+            for hexdigest in chunk:
+                self.validate_hexdigest(hexdigest)
+                yield hexdigest, found.get(hexdigest, False)
+
+    def _existsmany_unfiltered(self, hexdigests):
+        paths = (self.hexdigestpath(hexdigest) for hexdigest in hexdigests)
+        for path, exists in self.batchio().exists(paths):
+            if not exists and self.previous_layout:
+                exists = really_is_file(self.previoushexdigestpath(path.name))
+            yield path.name, exists
 
     def digestpath(self, digest):
         assert isinstance(digest, bytes)  # todo test
@@ -706,7 +1433,7 @@ class uHashFS(uHashFSBase):
             print("", file=sys.stderr)
 
     def computehash(self, stream, tmp, progress=False):
-        hashobj = hashlib.new(self.algorithm)
+        hashobj = new_hasher(self.algorithm)
         try:
             header_size = int(stream.headers['Content-Length'])
         except (KeyError, AttributeError):
@@ -718,15 +1445,15 @@ class uHashFS(uHashFSBase):
             hashobj.update(chunk)
             if tmp:
                 tmp.write(chunk)
-                file_size = int(os.path.getsize(tmp.name))
                 if progress:
+                    file_size = int(os.path.getsize(tmp.name))
                     self._print_status(name=tmp.name,
                                        current_size=file_size,
                                        expected_size=header_size, end=False)
         if tmp:
             tmp.close()
-            file_size = int(os.path.getsize(tmp.name))
             if progress:
+                file_size = int(os.path.getsize(tmp.name))
                 self._print_status(name=tmp.name,
                                    current_size=file_size,
                                    expected_size=header_size, end=True)
@@ -739,14 +1466,89 @@ class uHashFS(uHashFSBase):
         return self.files()
 
 
-@attr.s(auto_attribs=True)
+@attr.s(auto_attribs=True, slots=True)
 class HashAddress():  # todo, let open() call this
+    '''slotted, hexdigest and the paths are computed when asked for, abspath from the layout if not given'''
     digest: bytes
     fs: uHashFS
-    abspath: str = attr.ib(converter=Path)
+    _abspath: object = attr.ib(default=None, eq=False)  # str or Path, converted on first use, derived from the digest
     is_duplicate: bool = False
 
-    def __attrs_post_init__(self):
-        #self.abspath.resolve()  # todo, see if this stat()'s
-        self.hexdigest = self.digest.hex()
-        self.relative_path = self.abspath.relative_to(self.fs.root)
+    @property
+    def hexdigest(self):
+        return self.digest.hex()
+
+    @property
+    def abspath(self):
+        if self._abspath is None:
+            self._abspath = self.fs.digestpath(self.digest)
+        elif not isinstance(self._abspath, Path):
+            self._abspath = Path(self._abspath)
+        return self._abspath
+
+    @property
+    def relative_path(self):
+        # from the digest and the current layout, abspath can be in an unfinished reshard's old tree
+        return self.fs.digestpath(self.digest).relative_to(self.fs.root)
+
+
+POPCOUNT = bytes(bin(byte).count('1') for byte in range(256))
+
+
+@attr.s(auto_attribs=True, slots=True, eq=False)
+class HashBatch():
+    '''the digests of a bulk put/exists/list in one buffer with one flag bit each
+
+    flags are is_duplicate for putbatch() and exists for existsbatch(), unset
+    for listbatch(). Millions of results cost digestlen bytes and a bit each,
+    HashAddress objects are only built by indexing or iterating.
+    '''
+    fs: uHashFS
+    digests: bytearray = attr.Factory(bytearray)
+    flags: bytearray = attr.Factory(bytearray)  # bit i is item i, least significant first
+
+    def append(self, digest, flag=False):
+        assert len(digest) == self.fs.digestlen
+        index = len(self)
+        if index % 8 == 0:
+            self.flags.append(0)
+        if flag:
+            self.flags[index // 8] |= 1 << (index % 8)
+        self.digests += digest
+
+    def __len__(self):
+        return len(self.digests) // self.fs.digestlen
+
+    def digest(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = index * self.fs.digestlen
+        return bytes(self.digests[start:start + self.fs.digestlen])
+
+    def hexdigest(self, index):
+        return self.digest(index).hex()
+
+    def flag(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return bool(self.flags[index // 8] & (1 << (index % 8)))
+
+    def count(self):
+        '''the number of items flagged'''
+        return sum(self.flags.translate(POPCOUNT))
+
+    def hexdigests(self, flag=None):
+        '''yields the hexdigests in order, only those with flag set (or unset) if flag is given'''
+        view = memoryview(self.digests)
+        digestlen = self.fs.digestlen
+        for index in range(len(self)):
+            if flag is None or self.flag(index) == flag:
+                yield view[index * digestlen:(index + 1) * digestlen].hex()
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return HashAddress(self.digest(index), self.fs, None, self.flag(index))
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
@@ -0,0 +1,161 @@
+"""Hash verified reads.
+
+VerifyingReader wraps an object's file handle and hashes every byte the
+caller reads; when the last byte is read it compares the hash with the
+object's name and raises CorruptObjectError on a mismatch. Reading in large
+chunks costs one hasher.update() per read on top of the read itself.
+
+Successful verifications (by a reader or by check()) are recorded in the
+fixed width append-only _verified log in the root, so with verify_days set
+openhexdigest() only wraps objects not verified within that many days.
+"""
+
+import io
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from .uhashfs import VERIFIED
+from .uhashfs import new_hasher
+
+RECORD = struct.Struct('>d')  # verification time, follows the digest
+DAY = 24 * 60 * 60
+
+
+class CorruptObjectError(ValueError):
+    pass
+
+
+class VerifyingReader(io.BufferedIOBase):
+    def __init__(self, handle, digest, algorithm, on_verified=None):
+        super().__init__()
+        self.handle = handle
+        self.digest = digest
+        self.hasher = new_hasher(algorithm)
+        self.size = os.fstat(handle.fileno()).st_size
+        self.position = 0
+        self.verified = False
+        self.on_verified = on_verified  # called with the digest once it matched
+
+    def _hashed(self, data):
+        if self.verified or self.position < 0:
+            return data
+        self.hasher.update(data)
+        self.position += len(data)
+        if self.position >= self.size or not data:
+            self._verify()
+        return data
+
+    def _verify(self):
+        actual = self.hasher.digest()
+        if actual != self.digest:
+            raise CorruptObjectError("{0} hashes to {1}".format(self.digest.hex(), actual.hex()))
+        self.verified = True
+        if self.on_verified:
+            self.on_verified(self.digest)
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        return self._hashed(self.handle.read(size))
+
+    def read1(self, size=-1):
+        return self._hashed(self.handle.read1(size))
+
+    def readinto(self, buffer):
+        count = self.handle.readinto(buffer)
+        self._hashed(memoryview(buffer)[:count])
+        return count
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.handle.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        position = self.handle.seek(offset, whence)
+        if position != self.position:  # reads are no longer sequential, stop verifying
+            self.position = -1
+        return position
+
+    def tell(self):
+        return self.handle.tell()
+
+    def fileno(self):
+        return self.handle.fileno()
+
+    def close(self):
+        self.handle.close()
+        super().close()
+
+    @property
+    def name(self):
+        return self.handle.name
+
+
+class VerificationLog():
+    def __init__(self, fs, flush_every=1024):
+        self.path = fs.root / Path(VERIFIED)
+        self.digestlen = fs.digestlen
+        self.record_size = fs.digestlen + RECORD.size
+        self.flush_every = flush_every
+        self.verified = None  # digest -> time, loaded on first use
+        self.pending = []
+        self.log_records = 0
+        self.lock = threading.Lock()
+
+    def _load(self):
+        self.verified = {}
+        try:
+            with open(self.path, 'rb') as fh:
+                log = fh.read()
+        except FileNotFoundError:
+            return
+        for offset in range(0, len(log) - self.record_size + 1, self.record_size):
+            digest = log[offset:offset + self.digestlen]
+            self.verified[digest], = RECORD.unpack_from(log, offset + self.digestlen)
+        self.log_records = len(log) // self.record_size
+
+    def last_verified(self, digest):
+        with self.lock:
+            if self.verified is None:
+                self._load()
+            return self.verified.get(digest, 0)
+
+    def is_due(self, digest, days):
+        return self.last_verified(digest) < time.time() - (days * DAY)
+
+    def record(self, digest, when=None):
+        with self.lock:
+            if self.verified is None:
+                self._load()
+            self.verified[digest] = when or time.time()
+            self.pending.append(digest + RECORD.pack(self.verified[digest]))
+            if len(self.pending) >= self.flush_every:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, b''.join(self.pending))
+        finally:
+            os.close(fd)
+        self.log_records += len(self.pending)
+        self.pending = []
+        if self.log_records > (len(self.verified) * 4) + self.flush_every:
+            self._compact()
+
+    def _compact(self):
+        tmp_path = self.path.with_name(VERIFIED + '.' + str(os.getpid()))
+        with open(tmp_path, 'wb') as fh:
+            fh.write(b''.join(digest + RECORD.pack(when) for digest, when in self.verified.items()))
+        os.rename(tmp_path, self.path)
+        self.log_records = len(self.verified)
@@ -0,0 +1,236 @@
+"""Ingest of files dropped into a folder as soon as they are complete.
+
+watch() sets inotify watches on the folder (and with recursive, the folders
+under it) for IN_CLOSE_WRITE and IN_MOVED_TO, so files written in place are
+put once the writer closes them and files renamed in are put on arrival.
+Events are collected until the folder is quiet for batch_seconds (or
+batch_size files are waiting) and each batch goes through the ingest.py
+pipeline.
+
+On startup, and after the kernel's event queue overflows, the folders are
+listed and the files found are put too, so files dropped while nothing was
+watching are not missed. Files modified within settle seconds of the
+listing may still be being written; they are put once unchanged for settle
+seconds, or on their close event.
+
+originals are kept, removed, or replaced with hardlinks to the stored
+objects once stored, unless they changed since they were hashed. Hidden
+files (editors' and rsync's temp files) are skipped. inotify is called
+through libc, so this is Linux only.
+"""
+
+import ctypes
+import errno
+import os
+import select
+import struct
+import time
+from .ingest import ingest
+
+ORIGINALS = ('keep', 'remove', 'link')
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+EVENT = struct.Struct('iIII')  # struct inotify_event: wd, mask, cookie, len, then len bytes of name
+POLL = 0.5  # seconds between looks at the stop event
+
+
+class Inotify():
+    '''an inotify instance, read() returns (folder, name, mask) events'''
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        try:
+            self.fd = self._check(self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC))
+        except AttributeError:
+            raise OSError(errno.ENOSYS, "inotify is Linux only")
+        self.folders = {}  # watch descriptor -> folder
+
+    def _check(self, result):
+        if result < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return result
+
+    def add(self, folder, mask=MASK):
+        wd = self._check(self.libc.inotify_add_watch(self.fd, os.fsencode(folder), mask))
+        self.folders[wd] = folder
+
+    def read(self, timeout):
+        '''returns the events queued, waiting up to timeout seconds for the first; overflows are (None, None, IN_Q_OVERFLOW)'''
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, None, mask))
+            elif mask & IN_IGNORED:  # the folder was removed
+                self.folders.pop(wd, None)
+            elif wd in self.folders:
+                events.append((self.folders[wd], os.fsdecode(name), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _key(st):
+    '''what changes when a file is rewritten'''
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _settle_original(address, path, key, originals):
+    '''removes path or replaces it with a hardlink to address, returns the action taken or None
+
+    nothing is done if path changed since key was taken (its close event
+    follows), or when linking across filesystems.
+    '''
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return None
+    if _key(st) != key:
+        return None
+    if originals == 'remove':
+        os.unlink(path)
+        return 'removed'
+    if os.lstat(address.abspath).st_ino == st.st_ino:
+        return 'linked'  # already is the object
+    tmp_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.uhashfs')
+    try:
+        os.link(address.abspath, tmp_path)
+    except FileExistsError:  # left by a crash
+        os.unlink(tmp_path)
+        os.link(address.abspath, tmp_path)
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            return None
+        raise e
+    os.rename(tmp_path, path)
+    return 'linked'
+
+
+def watch(fs, folder, recursive=False, originals='keep', workers=None, batch_seconds=0.05, batch_size=1024,
+          settle=1.0, stop=None):
+    '''yields (IngestResult, action) for each file completed in folder, until stop (a threading.Event) is set
+
+    action is 'removed' or 'linked' if the original was, None if it was kept.
+    Files that vanish before they are put (renamed temp files) are not yielded.
+    '''
+    assert originals in ORIGINALS
+    folder = os.path.realpath(folder)
+    skip = os.path.realpath(fs.root)
+    inotify = Inotify()
+    pending = {}  # path -> None, the files to put in the next batch in order
+    deferred = {}  # path -> (key, deadline), recently modified when listed
+    replaced = {}  # path -> inode, renamed over by a link, whose IN_MOVED_TO is ours
+
+    def watch_tree(top):
+        '''watches top (and the folders under it, with recursive), queueing the files in them'''
+        now = time.time()
+        stack = [top]
+        while stack:
+            current = stack.pop()
+            try:
+                inotify.add(current)  # before listing, so no file falls between the two
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and entry.path != skip:
+                                stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            if st.st_mtime > now - settle:
+                                deferred[entry.path] = (_key(st), now + settle)
+                            else:
+                                pending[entry.path] = None
+            except (FileNotFoundError, NotADirectoryError):  # removed meanwhile
+                continue
+
+    def handle(parent, name, mask):
+        if mask & IN_Q_OVERFLOW:  # events were lost
+            watch_tree(folder)
+            return
+        if name.startswith('.'):
+            return
+        path = os.path.join(parent, name)
+        if mask & IN_ISDIR:
+            if recursive and mask & (IN_CREATE | IN_MOVED_TO) and path != skip:
+                watch_tree(path)
+            return
+        if not mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            return
+        if path in replaced:
+            inode = replaced.pop(path)
+            try:
+                if os.lstat(path).st_ino == inode:
+                    return
+            except FileNotFoundError:
+                return
+        deferred.pop(path, None)
+        pending[path] = None
+
+    def undefer():
+        now = time.time()
+        for path, (key, deadline) in list(deferred.items()):
+            if deadline > now:
+                continue
+            del deferred[path]
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            if _key(st) == key:
+                pending[path] = None
+            else:  # still being written
+                deferred[path] = (_key(st), now + settle)
+
+    def put_batch():
+        keys = {}
+        for path in pending:
+            try:
+                keys[path] = _key(os.lstat(path))  # before hashing, to see if it changes meanwhile
+            except FileNotFoundError:
+                continue
+        pending.clear()
+        for result in ingest(fs, list(keys), workers=workers):
+            if result.error:
+                if not isinstance(result.error, FileNotFoundError):
+                    yield result, None
+                continue
+            action = None
+            if originals != 'keep':
+                action = _settle_original(result.address, result.path, keys[result.path], originals)
+                if action == 'linked':
+                    replaced[result.path] = os.lstat(result.path).st_ino
+            yield result, action
+
+    try:
+        watch_tree(folder)
+        while stop is None or not stop.is_set():
+            if pending:
+                events = inotify.read(batch_seconds)
+            else:
+                events = inotify.read(max(0, min([POLL] + [deadline - time.time() for _, deadline in deferred.values()])))
+            for parent, name, mask in events:
+                handle(parent, name, mask)
+            undefer()
+            if pending and (not events or len(pending) >= batch_size):
+                yield from put_batch()
+    finally:
+        inotify.close()